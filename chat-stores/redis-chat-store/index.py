@@ -1,11 +1,16 @@
 from redis_chat_store import RedisChatStore
-from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.core.ingestion import IngestionPipeline
 from llama_index.core.node_parser import SentenceSplitter
 import chromadb
 from dotenv import load_dotenv
 import os
+import sys
+# Ortak modüller depo kökündeki common/ paketindedir
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from common.batching import index_in_batches
+from common.embedding_cache import EmbeddingCache, CachedEmbedding
+from common.chroma_upsert import UpsertChromaVectorStore
 
 
 def debug_print_docs(docs, tag="[DEBUG]", max_print=10):
@@ -21,49 +26,88 @@ if __name__ == "__main__":
 
     db = chromadb.PersistentClient(path="./chroma_db")
     chroma_collection = db.get_or_create_collection("redis_chat_data")
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+    # Node id'leri içerikten türetilir; yeniden çalıştırma kopya yerine upsert yapar
+    vector_store = UpsertChromaVectorStore(chroma_collection=chroma_collection, source_key="file_path")
+
+    # Değişmemiş parçalar modele gönderilmeden kalıcı önbellekten alınır
+    embedding_cache = EmbeddingCache(
+        os.environ.get("EMBEDDING_CACHE_PATH", "./chroma_db/embedding_cache.sqlite"),
+        max_bytes=int(os.environ.get("EMBEDDING_CACHE_MAX_MB", "256")) * 1024 * 1024
+    )
+    cached_embed_model = CachedEmbedding(embed_model, embedding_cache)
 
     # Upstash ortam değişkenlerine göre yapılandırıldı
     redis_store = RedisChatStore(
         host=os.environ.get("UPSTASH_REDIS_HOST"),
         port=int(os.environ.get("UPSTASH_REDIS_PORT", 6379)),
         password=os.environ.get("UPSTASH_REDIS_PASSWORD"),
-        ssl=True  # Upstash Redis bağlantısı için gereklidir
+        ssl=True,  # Upstash Redis bağlantısı için gereklidir
+        scan_count=int(os.environ.get("REDIS_SCAN_COUNT", "1000")),
+        match_pattern=os.environ.get("REDIS_MATCH_PATTERN", "*"),
+        chunk_size=int(os.environ.get("REDIS_CHUNK_SIZE", "100"))
     )
 
-    try:
-        print("[index_task_001] Loading all data from Redis...")
-        documents = redis_store.get_documents("redis_chat_data")
-        debug_print_docs(documents, "[LOADED]")
+    # "full": tek seferlik tam döküm, "watch": keyspace bildirimleriyle canlı indeksleme
+    sync_mode = os.environ.get("REDIS_SYNC_MODE", "full").lower()
+    # Aynı anda filtrelenip gömülen en fazla doküman sayısı
+    batch_size = int(os.environ.get("INDEX_BATCH_SIZE", "64"))
 
-        print("\n[index_task_002] Applying regex filters...")
-        documents = redis_store.apply_rules(
-            documents,
-            inclusion_rules=[],  # boşsa hepsi dahil
-            exclusion_rules=[
-                r'^cache:',
-                r'^session:',
-                r'^temp_',
-                r'\.bin$',
-                r'^system:',
-                r'^lock:',
-                r'^queue:'
-            ]
-        )
-        debug_print_docs(documents, "[FILTERED]")
+    pipeline = IngestionPipeline(
+        transformations=[
+            SentenceSplitter(chunk_size=512, chunk_overlap=20),
+            cached_embed_model
+        ],
+        vector_store=vector_store,
+    )
+
+    inclusion_rules = []  # boşsa hepsi dahil
+    exclusion_rules = [
+        r'^cache:',
+        r'^session:',
+        r'^temp_',
+        r'\.bin$',
+        r'^system:',
+        r'^lock:',
+        r'^queue:'
+    ]
+
+    def index_documents(documents, stale_keys=None):
+        # Yalnızca silinen/süresi dolan anahtarlar; değişenlerin parçalarını upsert deposu değiştirir
+        if stale_keys:
+            chroma_collection.delete(where={
+                "$and": [{"data_source_id": "redis_chat_data"}, {"file_path": {"$in": stale_keys}}]
+            })
 
-        print("\n[index_task_003] Creating vector index...")
-        pipeline = IngestionPipeline(
-            transformations=[
-                SentenceSplitter(chunk_size=512, chunk_overlap=20),
-                embed_model
-            ],
-            vector_store=vector_store,
+        print("\n[index_task_002] Filtering and indexing in batches...")
+        loaded, indexed = index_in_batches(
+            documents,
+            pipeline,
+            apply_rules=lambda batch: redis_store.apply_rules(batch, inclusion_rules, exclusion_rules),
+            batch_size=batch_size,
+            on_first_batch=lambda batch: debug_print_docs(batch, "[LOADED]")
         )
+        print(f"\n[index_task_003] {loaded} doküman yüklendi, {indexed} doküman indekslendi")
 
-        pipeline.run(documents=documents)
+    try:
+        if sync_mode == "watch":
+            print("[index_task_001] Watching Redis keyspace for changes (Ctrl+C ile çıkış)...")
+            redis_store.watch(
+                "redis_chat_data",
+                index_documents,
+                inclusion_rules,
+                exclusion_rules,
+                debounce_seconds=float(os.environ.get("REDIS_DEBOUNCE_SECONDS", "2")),
+            )
+        else:
+            print("[index_task_001] Streaming all data from Redis...")
+            index_documents(redis_store.iter_documents("redis_chat_data"))
         print("[index_task_004] Indexing completed successfully ✅")
 
+    except KeyboardInterrupt:
+        print("\n[index_task_004] Watcher stopped")
     except Exception as e:
         print(f"[ERROR] Indexing failed: {str(e)}")
         raise
+    finally:
+        print(f"[embedding_cache] {embedding_cache.report()}")
+        embedding_cache.close()
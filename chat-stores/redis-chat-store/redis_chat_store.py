@@ -1,8 +1,13 @@
-import re
-from typing import List, Sequence, Optional, Pattern
+import os
+import sys
+import time
+from typing import List, Sequence, Optional, Iterator, Tuple, Callable, Dict
 from llama_index.core import Document
 from llama_index.core.schema import BaseNode
 import redis
+# Ortak modüller depo kökündeki common/ paketindedir
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from common.rule_matcher import RuleMatcher
 
 
 
@@ -13,13 +18,19 @@ class RedisChatStore:
         port: int,
         password: Optional[str] = None,
         db: Optional[int] = 0,
-        ssl: bool = False  
+        ssl: bool = False,
+        scan_count: int = 1000,
+        match_pattern: str = "*",
+        chunk_size: int = 100
     ):
         self.host = host
         self.port = port
         self.password = password
         self.db = db
         self.ssl = ssl  # <--- Upstash için eklendi
+        self.scan_count = scan_count  # SCAN COUNT ipucu; aynı zamanda pipeline parti boyutu
+        self.match_pattern = match_pattern
+        self.chunk_size = max(1, chunk_size)  # Koleksiyon dokümanı başına en fazla eleman (ör. mesaj)
 
         self.redis_client = redis.Redis(
             host=host,
@@ -38,90 +49,303 @@ class RedisChatStore:
         })
         return document
 
-    def _compile_patterns(self, patterns: List[str]) -> List[Pattern]:
-        compiled = []
-        for pattern in patterns:
-            try:
-                compiled.append(re.compile(pattern))
-            except re.error:
-                print(f"Invalid regex pattern: {pattern}")
-        return compiled
-
     def apply_rules(
         self,
         documents: Sequence[Document],
         inclusion_rules: List[str],
         exclusion_rules: List[str],
     ) -> Sequence[Document]:
-        compiled_exclude = self._compile_patterns(exclusion_rules)
-        compiled_include = self._compile_patterns(inclusion_rules)
-
-        filtered_docs = []
+        matcher = RuleMatcher(inclusion_rules, exclusion_rules)
         print("\n[apply_rules] Başlangıç doküman sayısı:", len(documents))
+        filtered_docs = matcher.filter(documents, key=lambda doc: doc.metadata.get("file_path", ""))
+        matcher.log_summary()
+        return filtered_docs
+
+    def _iter_key_batches(self) -> Iterator[List[str]]:
+        """KEYS yerine SCAN ile anahtarları sunucuyu bloklamadan, parti parti gezer"""
+        cursor = 0
+        while True:
+            cursor, keys = self.redis_client.scan(
+                cursor=cursor, match=self.match_pattern, count=self.scan_count
+            )
+            if keys:
+                yield keys
+            if cursor == 0:
+                return
 
-        for doc in documents:
-            file_path = doc.metadata.get("file_path", "")
-            excluded = any(pattern.search(file_path) for pattern in compiled_exclude)
-            included = any(pattern.search(file_path) for pattern in compiled_include) if compiled_include else True
+    def _fetch_batch(self, keys: List[str]) -> List[Tuple[str, str, object, int]]:
+        """
+        Bir partinin TYPE/TTL ve ilk okumalarını iki pipeline ile yapar;
+        anahtar başına ayrı round trip yerine parti başına iki round trip.
+        Koleksiyonlarda tüm değer değil yalnızca ilk sayfa okunur.
+        """
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.type(key)
+            pipe.ttl(key)
+        meta = pipe.execute(raise_on_error=False)
 
-            if excluded:
-                print(f"[apply_rules] Dışlandı: {file_path}")
+        n = self.chunk_size
+        supported = []
+        pipe = self.redis_client.pipeline(transaction=False)
+        for i, key in enumerate(keys):
+            key_type, ttl = meta[2 * i], meta[2 * i + 1]
+            if isinstance(key_type, Exception):
+                print(f"[get_documents] Error processing key {key}: {str(key_type)}")
                 continue
-            if not included:
-                print(f"[apply_rules] Dahil edilmedi: {file_path}")
+            if key_type == 'string':
+                pipe.get(key)
+            elif key_type == 'hash':
+                pipe.hscan(key, 0, count=n)
+            elif key_type == 'list':
+                pipe.lrange(key, 0, n - 1)
+            elif key_type == 'set':
+                pipe.sscan(key, 0, count=n)
+            elif key_type == 'zset':
+                pipe.zrange(key, 0, n - 1)
+            else:
+                # 'none': SCAN ile okuma arasında silinmiş anahtar
+                if key_type != 'none':
+                    print(f"[get_documents] Desteklenmeyen veri tipi: {key_type} for key: {key}")
                 continue
+            supported.append((key, key_type, ttl))
 
-            print(f"[apply_rules] Geçti: {file_path}")
-            filtered_docs.append(doc)
+        values = pipe.execute(raise_on_error=False) if supported else []
+        return [(key, key_type, value, ttl) for (key, key_type, ttl), value in zip(supported, values)]
 
-        return filtered_docs
+    def _iter_chunks(self, key: str, key_type: str, first_page) -> Iterator[Tuple[int, object]]:
+        """
+        Koleksiyonu en fazla chunk_size elemanlık parçalar halinde (offset, parça)
+        olarak döndürür; bellekte aynı anda yalnızca bir sayfa tutulur.
+        - list/zset: sıralı olduğundan LRANGE/ZRANGE ile indeks bazlı sayfalama
+        - hash/set: HSCAN/SSCAN imleci; offset okunan eleman sayısıdır
+        """
+        n = self.chunk_size
+
+        if key_type in ('list', 'zset'):
+            read_range = self.redis_client.lrange if key_type == 'list' else self.redis_client.zrange
+            offset, page = 0, first_page
+            while page:
+                yield offset, page
+                if len(page) < n:
+                    return
+                offset += n
+                page = read_range(key, offset, offset + n - 1)
+            return
+
+        scan = self.redis_client.hscan if key_type == 'hash' else self.redis_client.sscan
+        offset, buffer = 0, []
+        cursor, items = first_page
+        while True:
+            # COUNT yalnızca bir ipucu; küçük (listpack) koleksiyonlar tek seferde gelir
+            buffer.extend(items.items() if key_type == 'hash' else items)
+            while len(buffer) >= n:
+                yield offset, buffer[:n]
+                offset += n
+                buffer = buffer[n:]
+            if cursor == 0:
+                break
+            cursor, items = scan(key, cursor, count=n)
+        if buffer:
+            yield offset, buffer
+
+    def _to_document(
+        self,
+        key: str,
+        content: str,
+        ttl,
+        data_source_id: str,
+        chunk_offset: Optional[int] = None,
+        chunk_items: Optional[int] = None,
+    ) -> Document:
+        metadata = {
+            "file_path": key,
+            "file_name": key.split('/')[-1] if '/' in key else key,
+            "file_extension": "",
+            "last_modified": str(ttl) if isinstance(ttl, int) and ttl > 0 else "no_expiry"
+        }
+        if chunk_offset is not None:
+            metadata["chunk_offset"] = chunk_offset
+            metadata["chunk_items"] = chunk_items
+
+        doc = Document(text=content, metadata=metadata)
+        self.customize_metadata(doc, data_source_id)
+        return doc
+
+    def _iter_key_documents(self, key: str, key_type: str, value, ttl, data_source_id: str) -> Iterator[Document]:
+        if isinstance(value, Exception):
+            print(f"[get_documents] Error processing key {key}: {str(value)}")
+            return
+        if value is None:
+            return  # Okuma sırasında süresi dolmuş/silinmiş
+
+        if key_type == 'string':
+            yield self._to_document(key, value, ttl, data_source_id)
+            return
+
+        for offset, chunk in self._iter_chunks(key, key_type, value):
+            if key_type == 'hash':
+                content = str(dict(chunk))
+            elif key_type == 'set':
+                content = str(set(chunk))
+            else:
+                content = str(chunk)
+            yield self._to_document(key, content, ttl, data_source_id, offset, len(chunk))
+
+    def iter_documents(self, data_source_id: str) -> Iterator[Document]:
+        """Anahtarları parti parti okur; büyük koleksiyonları sınırlı boyutlu dokümanlara böler"""
+        count = 0
+        try:
+            for keys in self._iter_key_batches():
+                for key, key_type, value, ttl in self._fetch_batch(keys):
+                    try:
+                        for doc in self._iter_key_documents(key, key_type, value, ttl, data_source_id):
+                            count += 1
+                            yield doc
+                    except redis.RedisError as e:
+                        print(f"[get_documents] Error processing key {key}: {str(e)}")
+                        continue
+
+        except Exception as e:
+            print(f"Error accessing Redis: {str(e)}")
+            return
+
+        print(f"[get_documents] Toplam {count} doküman alındı")
 
     def get_documents(self, data_source_id: str) -> List[Document]:
-        documents = []
+        return list(self.iter_documents(data_source_id))
 
+    def get_key_documents(self, keys: List[str], data_source_id: str) -> List[Document]:
+        """Yalnızca verilen anahtarları (aynı pipeline + parçalama yoluyla) okur"""
+        return self._read_keys(keys, data_source_id)[0]
+
+    def _read_keys(self, keys: List[str], data_source_id: str) -> Tuple[List[Document], List[str]]:
+        """
+        Anahtarları okur. Dönüş: (dokümanlar, okunamayan anahtarlar). Okunamayan bir
+        anahtarın yarım kalan parçaları döndürülmez; eski vektörleri yerinde kalır.
+        """
+        documents, failed = [], []
+        for key, key_type, value, ttl in self._fetch_batch(keys):
+            if isinstance(value, Exception):
+                print(f"[get_documents] Error processing key {key}: {str(value)}")
+                failed.append(key)
+                continue
+            try:
+                documents.extend(list(self._iter_key_documents(key, key_type, value, ttl, data_source_id)))
+            except redis.RedisError as e:
+                print(f"[get_documents] Error processing key {key}: {str(e)}")
+                failed.append(key)
+        return documents, failed
+
+    def _missing_keys(self, keys: List[str]) -> List[str]:
+        """Artık var olmayan (silinen/süresi dolan) anahtarlar"""
+        if not keys:
+            return []
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.exists(key)
+        return [key for key, exists in zip(keys, pipe.execute()) if not exists]
+
+    def _enable_keyspace_notifications(self) -> None:
         try:
-            keys = self.redis_client.keys('*')
+            flags = self.redis_client.config_get("notify-keyspace-events").get("notify-keyspace-events", "")
+            # K: keyspace kanalı, g: DEL/EXPIRE vb., $ l h s z: tip komutları, x/e: süre dolumu/tahliye
+            required = set("Kg$lhszxe")
+            if not required.issubset(set(flags)) and "A" not in flags:
+                self.redis_client.config_set("notify-keyspace-events", "".join(sorted(set(flags) | required)))
+        except redis.RedisError as e:
+            # Yönetilen servislerde (ör. Upstash) CONFIG kapalı olabilir; ayar panelden açılmalıdır
+            print(f"[watch] notify-keyspace-events ayarlanamadı: {str(e)}")
 
-            for key in keys:
-                try:
-                    key_type = self.redis_client.type(key)
-
-                    if key_type == 'string':
-                        content = self.redis_client.get(key)
-                    elif key_type == 'hash':
-                        content = str(self.redis_client.hgetall(key))
-                    elif key_type == 'list':
-                        content = str(self.redis_client.lrange(key, 0, -1))
-                    elif key_type == 'set':
-                        content = str(self.redis_client.smembers(key))
-                    elif key_type == 'zset':
-                        content = str(self.redis_client.zrange(key, 0, -1))
-                    else:
-                        print(f"[get_documents] Desteklenmeyen veri tipi: {key_type} for key: {key}")
-                        continue
+    def watch(
+        self,
+        data_source_id: str,
+        on_changes: Callable[[List[Document], List[str]], None],
+        inclusion_rules: Optional[List[str]] = None,
+        exclusion_rules: Optional[List[str]] = None,
+        debounce_seconds: float = 2.0,
+        max_delay_seconds: float = 10.0,
+    ) -> None:
+        """
+        Keyspace bildirimlerine abone olur; kurallardan geçen anahtarlar için
+        yazmaları anahtar başına debounce_seconds kadar biriktirir ve yalnızca
+        değişen anahtarları okuyup on_changes(dokümanlar, eskiyen_anahtarlar)
+        çağırır. Sürekli yazılan bir anahtar en geç max_delay_seconds içinde
+        işlenir. Eskiyen anahtarlar yalnızca silinen ya da süresi dolan anahtarlardır
+        ve vektörleri silinmelidir; değişen anahtarların parçalarını upsert deposu
+        değiştirir. on_changes hata verirse anahtarlar tekrar denenmek üzere
+        bekleyenlere geri konur; bağlantı koparsa abonelik yeniden kurulur.
+        Ctrl+C ile durdurulur.
+        """
+        # apply_rules ile aynı karar; okuma yapmadan anahtar adı üzerinden verilir
+        rules = RuleMatcher(inclusion_rules, exclusion_rules)
+        self._enable_keyspace_notifications()
+
+        prefix = f"__keyspace@{self.db or 0}__:"
 
-                    doc = Document(
-                        text=content,
-                        metadata={
-                            "file_path": key,
-                            "file_name": key.split('/')[-1] if '/' in key else key,
-                            "file_extension": "",
-                            "last_modified": str(self.redis_client.ttl(key)) if self.redis_client.ttl(key) > 0 else "no_expiry"
-                        }
-                    )
-                    self.customize_metadata(doc, data_source_id)
-                    documents.append(doc)
-
-                except Exception as e:
-                    print(f"[get_documents] Error processing key {key}: {str(e)}")
+        def subscribe():
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.psubscribe(f"{prefix}{self.match_pattern}")
+            return pubsub
+
+        pubsub = subscribe()
+        pending: Dict[str, Tuple[float, float]] = {}  # anahtar -> (ilk olay, son olay)
+        retry_delay = 1.0
+        try:
+            while True:
+                try:
+                    if pubsub is None:
+                        pubsub = subscribe()
+                        retry_delay = 1.0
+                        print("[watch] Redis aboneliği yeniden kuruldu")
+                    message = pubsub.get_message(timeout=min(1.0, debounce_seconds))
+                    now = time.monotonic()
+                    while message:
+                        key = message["channel"][len(prefix):]
+                        if rules.allowed(key):
+                            first_seen = pending.get(key, (now, now))[0]
+                            pending[key] = (first_seen, now)
+                        message = pubsub.get_message()
+                except (redis.ConnectionError, redis.TimeoutError) as e:
+                    # Kopukluk sırasında gelen bildirimler kaybolur; bekleyen anahtarlar korunur
+                    print(f"[watch] Redis bağlantısı koptu, {retry_delay:.0f} sn sonra yeniden abone olunacak: {str(e)}")
+                    if pubsub is not None:
+                        try:
+                            pubsub.close()
+                        except redis.RedisError:
+                            pass
+                    pubsub = None
+                    time.sleep(retry_delay)
+                    retry_delay = min(retry_delay * 2, 60.0)
                     continue
 
-        except Exception as e:
-            print(f"Error accessing Redis: {str(e)}")
-            return documents
+                ready = [
+                    key for key, (first_seen, last_seen) in pending.items()
+                    if now - last_seen >= debounce_seconds or now - first_seen >= max_delay_seconds
+                ]
+                if not ready:
+                    continue
+                for key in ready:
+                    del pending[key]
 
-        print(f"[get_documents] Toplam {len(documents)} doküman alındı")
-        return documents
+                # Her hazır anahtar bir kez okunur; artık yoksa doküman üretmez
+                for i in range(0, len(ready), self.scan_count):
+                    batch = ready[i:i + self.scan_count]
+                    try:
+                        documents, failed = self._read_keys(batch, data_source_id)
+                        produced = {doc.metadata["file_path"] for doc in documents}
+                        gone = self._missing_keys([key for key in batch if key not in produced and key not in failed])
+                        print(f"[watch] {len(batch)} anahtar değişti, {len(documents)} doküman üretildi, {len(gone)} anahtar silinmiş")
+                        on_changes(documents, gone)
+                    except Exception as e:
+                        # Embedder/Chroma/Redis hatası izlemeyi durdurmaz; anahtarlar tekrar denenir
+                        print(f"[watch] Değişiklikler işlenemedi, tekrar denenecek: {str(e)}")
+                        failed = batch
+                    for key in failed:
+                        pending.setdefault(key, (now, now))
+        finally:
+            if pubsub is not None:
+                pubsub.close()
 
     def get_nodes(self, documents: Sequence[Document]) -> Sequence[BaseNode]:
         return []
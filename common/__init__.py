@@ -0,0 +1 @@
+"""Bağlayıcı klasörlerinin (readers/, indexing/, chat-stores/, llm/) ortak kullandığı modüller."""
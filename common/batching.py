@@ -0,0 +1,39 @@
+from itertools import islice
+
+
+def iter_batches(documents, batch_size):
+    """Doküman akışını en fazla batch_size elemanlı listeler halinde verir"""
+    documents = iter(documents)
+    while True:
+        batch = list(islice(documents, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def index_in_batches(documents, pipeline, apply_rules=None, batch_size=64, on_nodes=None, on_first_batch=None, **run_kwargs):
+    """
+    Dokümanları batch_size'lık gruplar halinde filtreler, böler, gömer ve yazar;
+    bellekte aynı anda yalnızca bir grup bulunur ve ilk vektörler ilk grupla yazılır.
+    on_first_batch verilirse filtrelenmemiş ilk grupla çağrılır (ör. debug çıktısı).
+    Akış sonunda vector store'un flush'ı çağrılır; son kaynağın eski parçaları da silinir.
+    Dönüş: (yüklenen, indekslenen) doküman sayısı
+    """
+    loaded = indexed = 0
+    for batch_no, batch in enumerate(iter_batches(documents, batch_size), start=1):
+        loaded += len(batch)
+        if batch_no == 1 and on_first_batch is not None:
+            on_first_batch(batch)
+        if apply_rules is not None:
+            batch = apply_rules(batch)
+        if not batch:
+            continue
+        nodes = pipeline.run(documents=batch, **run_kwargs)
+        if on_nodes is not None:
+            on_nodes(nodes)
+        indexed += len(batch)
+        print(f"[index_in_batches] Batch {batch_no}: {len(batch)} doküman, {len(nodes)} parça yazıldı (toplam {indexed}/{loaded})")
+    flush = getattr(pipeline.vector_store, "flush", None)
+    if flush is not None:
+        flush()
+    return loaded, indexed
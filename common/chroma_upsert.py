@@ -0,0 +1,177 @@
+import hashlib
+from typing import Any, Dict, Iterable, List, Set, Tuple
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode, MetadataMode
+from llama_index.core.vector_stores.utils import node_to_metadata_dict
+from llama_index.vector_stores.chroma import ChromaVectorStore
+
+# Aynı kaynaktan üretilen ayrı dokümanları (PDF sayfa aralıkları, XLSX blokları, Redis parçaları) ayıran alanlar
+SEGMENT_KEYS = ("sheet_name", "row_start", "page_start", "chunk_offset")
+# Tek bir Chroma isteğinde gönderilen en fazla kayıt/filtre değeri
+_WRITE_BATCH = 5000
+_FILTER_BATCH = 500
+
+
+def _digest(*parts: Any) -> str:
+    return hashlib.sha256("\0".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+class UpsertChromaVectorStore(ChromaVectorStore):
+    """
+    Node id'lerini (data_source_id, kaynak anahtarı, parça sırası, içerik hash'i)'nden
+    türetir ve Chroma'ya add yerine upsert ile yazar. Dokümanlar kaynak sırasıyla
+    geldiği için bir kaynağın son parçası, akışta sonraki kaynağa geçildiğinde (ya da
+    flush ile çalıştırma sonunda) görülmüş olur; o kaynağın bu çalıştırmada yazılmayan
+    eski parçaları ancak o zaman silinir. Böylece aynı verinin yeniden indekslenmesi
+    koleksiyonu büyütmez ve yarıda kalan bir yazma eski parçaları götürmez.
+    """
+
+    _source_key: str = PrivateAttr(default="file_path")
+    # Son parçası henüz görülmemiş kaynakların bu çalıştırmada yazılan id'leri
+    _open: Dict[Tuple[str, str], Set[str]] = PrivateAttr(default_factory=dict)
+    # Bu çalıştırmada yazılan kaynaklar (data_source_id -> kaynak anahtarları)
+    _written_sources: Dict[str, Set[str]] = PrivateAttr(default_factory=dict)
+    # Bir parçası üretilemediği için eski parçaları bu çalıştırmada silinmeyecek kaynaklar
+    _kept: Set[Tuple[str, str]] = PrivateAttr(default_factory=set)
+
+    def __init__(self, chroma_collection: Any = None, source_key: str = "file_path", **kwargs: Any):
+        super().__init__(chroma_collection=chroma_collection, **kwargs)
+        self._source_key = source_key
+        self._open = {}
+        self._written_sources = {}
+        self._kept = set()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "UpsertChromaVectorStore"
+
+    @property
+    def source_key(self) -> str:
+        return self._source_key
+
+    def _source(self, node: BaseNode) -> Tuple[str, str]:
+        metadata = node.metadata
+        return str(metadata.get("data_source_id", "")), str(metadata.get(self._source_key, node.ref_doc_id or ""))
+
+    @staticmethod
+    def _segment(node: BaseNode) -> tuple:
+        return tuple(node.metadata.get(key) for key in SEGMENT_KEYS)
+
+    def assign_stable_ids(self, nodes: List[BaseNode]) -> None:
+        """Node ve doküman id'lerini içerikten türetir; önceki/sonraki/kaynak ilişkileri yeni id'lere taşınır"""
+        id_map: Dict[str, str] = {}
+        ordinals: Dict[str, int] = {}
+        for node in nodes:
+            document = (*self._source(node), self._segment(node))
+            document_id = node.ref_doc_id or _digest(*document)
+            if node.ref_doc_id and node.ref_doc_id not in id_map:
+                id_map[node.ref_doc_id] = _digest(*document)
+
+            ordinal = ordinals.get(document_id, 0)
+            ordinals[document_id] = ordinal + 1
+            content_hash = _digest(node.get_content(metadata_mode=MetadataMode.NONE))
+            id_map[node.node_id] = _digest(*document, ordinal, content_hash)
+
+        for node in nodes:
+            for related in node.relationships.values():
+                for info in related if isinstance(related, list) else [related]:
+                    info.node_id = id_map.get(info.node_id, info.node_id)
+            node.id_ = id_map[node.node_id]
+
+    def keep_stale(self, data_source_id: str, source: str) -> None:
+        """Kaynağın bir kısmı bu çalıştırmada yazılamadı; kaynak tamamlandığında eski parçaları silinmez"""
+        self._kept.add((data_source_id, source))
+
+    def _delete_stale(self, written: Dict[Tuple[str, str], Set[str]]) -> int:
+        """Tamamlanan kaynakların, written içinde olmayan (bu çalıştırmada yazılmamış) parçalarını siler"""
+        kept = [source for source in written if source in self._kept]
+        if kept:
+            print(f"[chroma_upsert] Eksik yazılan {len(kept)} kaynağın eski parçaları korundu")
+            written = {source: ids for source, ids in written.items() if source not in self._kept}
+            self._kept.difference_update(kept)
+
+        sources_by_data_source: Dict[str, List[str]] = {}
+        for data_source_id, source in written:
+            sources_by_data_source.setdefault(data_source_id, []).append(source)
+
+        deleted = 0
+        for data_source_id, sources in sources_by_data_source.items():
+            for start in range(0, len(sources), _FILTER_BATCH):
+                chunk = sources[start:start + _FILTER_BATCH]
+                existing = self._collection.get(
+                    where={"$and": [{"data_source_id": data_source_id}, {self._source_key: {"$in": chunk}}]},
+                    include=[],
+                )["ids"]
+                keep = set().union(*(written[(data_source_id, source)] for source in chunk))
+                stale = [node_id for node_id in existing if node_id not in keep]
+                if stale:
+                    self._collection.delete(ids=stale)
+                    deleted += len(stale)
+        if deleted:
+            print(f"[chroma_upsert] {len(written)} kaynak için {deleted} eski parça silindi")
+        return deleted
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        self.assign_stable_ids(nodes)
+
+        # Önce yazılır; eski parçalar yalnızca yenileri koleksiyondayken silinir
+        all_ids = []
+        for start in range(0, len(nodes), _WRITE_BATCH):
+            embeddings, metadatas, ids, documents = [], [], [], []
+            for node in nodes[start:start + _WRITE_BATCH]:
+                embeddings.append(node.get_embedding())
+                metadata = node_to_metadata_dict(node, remove_text=True, flat_metadata=self.flat_metadata)
+                metadatas.append({key: "" if value is None else value for key, value in metadata.items()})
+                ids.append(node.node_id)
+                documents.append(node.get_content(metadata_mode=MetadataMode.NONE))
+            self._collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents)
+            all_ids.extend(ids)
+
+        for node in nodes:
+            source = self._source(node)
+            self._open.setdefault(source, set()).add(node.node_id)
+            self._written_sources.setdefault(source[0], set()).add(source[1])
+        # Gruptaki son kaynağın parçaları sonraki gruba taşabilir; diğerleri tamamlandı
+        last = self._source(nodes[-1])
+        finished = {source: ids for source, ids in self._open.items() if source != last}
+        self._open = {last: self._open[last]}
+        self._delete_stale(finished)
+        return all_ids
+
+    def flush(self) -> int:
+        """Akış bittiğinde açık kalan kaynakların eski parçalarını siler; silinen parça sayısını döndürür"""
+        finished, self._open = self._open, {}
+        deleted = self._delete_stale(finished)
+        # Hiç yazılmamış kaynakların işaretleri sonraki çalıştırmaya taşınmaz
+        self._kept = set()
+        return deleted
+
+    def delete_unwritten(self, data_source_id: str, keep: Iterable[str] = ()) -> int:
+        """
+        Tam senkronizasyon başarıyla bittikten sonra çağrılır: bu çalıştırmada
+        yazılmayan ve keep'te olmayan (ör. geçici hatayla alınamayan) kaynakların
+        tüm parçalarını siler. Silinen parça sayısını döndürür.
+        """
+        kept = {source for kept_id, source in self._kept if kept_id == data_source_id}
+        self.flush()
+        written = self._written_sources.pop(data_source_id, set()) | kept | set(keep)
+        stale = []
+        offset = 0
+        while True:
+            page = self._collection.get(
+                where={"data_source_id": data_source_id}, include=["metadatas"], limit=_WRITE_BATCH, offset=offset
+            )
+            for node_id, metadata in zip(page["ids"], page["metadatas"]):
+                if str((metadata or {}).get(self._source_key, "")) not in written:
+                    stale.append(node_id)
+            if len(page["ids"]) < _WRITE_BATCH:
+                break
+            offset += _WRITE_BATCH
+
+        for start in range(0, len(stale), _WRITE_BATCH):
+            self._collection.delete(ids=stale[start:start + _WRITE_BATCH])
+        if stale:
+            print(f"[chroma_upsert] Bu çalıştırmada yazılmayan kaynakların {len(stale)} parçası silindi")
+        return len(stale)
@@ -0,0 +1,158 @@
+import os
+import time
+import sqlite3
+import hashlib
+from array import array
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.schema import BaseNode, MetadataMode, TransformComponent
+
+# SQLite'ın tek sorgudaki parametre sınırının (999) altında kalınır
+_SQL_BATCH = 500
+
+
+class EmbeddingCache:
+    """
+    Embedding vektörleri için SQLite tabanlı, içerik adresli kalıcı önbellek.
+    Anahtar: model adı + gömülen parça metninin SHA-256'sı; değer: float32 vektör.
+    Toplam boyut max_bytes'ı aşınca en uzun süredir kullanılmayan girdiler silinir.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        """Bulunan anahtarların vektörlerini döndürür ve kullanım zamanlarını günceller"""
+        unique = list(dict.fromkeys(keys))
+        found: Dict[str, List[float]] = {}
+        for start in range(0, len(unique), _SQL_BATCH):
+            chunk = unique[start:start + _SQL_BATCH]
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            for key, blob in rows:
+                vector = array("f")
+                vector.frombytes(blob)
+                found[key] = vector.tolist()
+
+        if found:
+            now = time.time()
+            self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+            self._conn.commit()
+        self.hits += len(found)
+        self.misses += len(unique) - len(found)
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, Sequence[float]]]) -> None:
+        now = time.time()
+        with self._conn:
+            for key, embedding in items:
+                blob = array("f", embedding).tobytes()
+                size = len(key) + len(blob)
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO embeddings (key, vector, size, last_used) VALUES (?, ?, ?, ?)",
+                    (key, blob, size, now),
+                )
+                if cursor.rowcount:
+                    self._total_bytes += size
+                    self.writes += 1
+        self._evict()
+
+    def _evict(self) -> None:
+        if self._total_bytes <= self.max_bytes:
+            return
+        stale = []
+        for key, size in self._conn.execute("SELECT key, size FROM embeddings ORDER BY last_used"):
+            if self._total_bytes <= self.max_bytes:
+                break
+            stale.append((key,))
+            self._total_bytes -= size
+        with self._conn:
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", stale)
+        self.evictions += len(stale)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "entries": self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0],
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def report(self) -> str:
+        stats = self.stats()
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = (stats["hits"] / lookups * 100) if lookups else 0.0
+        return (
+            f"{stats['entries']} girdi, {stats['bytes'] / (1024 * 1024):.1f}/"
+            f"{stats['max_bytes'] / (1024 * 1024):.0f} MB, "
+            f"isabet {stats['hits']}/{lookups} (%{hit_rate:.0f}), "
+            f"yazma {stats['writes']}, tahliye {stats['evictions']}"
+        )
+
+
+class CachedEmbedding(TransformComponent):
+    """
+    IngestionPipeline'da embed_model yerine kullanılır. Parçaların gömülecek metni
+    (MetadataMode.EMBED) önbellekte aranır; yalnızca bulunamayanlar modele gönderilir.
+    """
+
+    embed_model: BaseEmbedding = Field(description="Önbellekte bulunmayan parçaları gömen model")
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(self, embed_model: BaseEmbedding, cache: EmbeddingCache, **kwargs: Any):
+        super().__init__(embed_model=embed_model, **kwargs)
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def cache(self) -> EmbeddingCache:
+        return self._cache
+
+    def __call__(self, nodes: Sequence[BaseNode], **kwargs: Any) -> Sequence[BaseNode]:
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        keys = [self._cache.make_key(self.embed_model.model_name, text) for text in texts]
+        embeddings = self._cache.get_many(keys)
+
+        # Aynı grupta tekrar eden parçalar da bir kez gömülür
+        missing = {key: text for key, text in zip(keys, texts) if key not in embeddings}
+        if missing:
+            computed = self.embed_model.get_text_embedding_batch(list(missing.values()), **kwargs)
+            new_embeddings = dict(zip(missing, computed))
+            self._cache.put_many(new_embeddings.items())
+            embeddings.update(new_embeddings)
+
+        for node, key in zip(nodes, keys):
+            node.embedding = embeddings[key]
+        return nodes
@@ -0,0 +1,185 @@
+import re
+from functools import lru_cache
+from typing import Callable, Iterable, List, Optional, Pattern, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+
+_REGEX_META = set(".^$*+?{}[]\\|()")
+# Birleşik regex'te numaraları/isimleri kayacağı için ayrı derlenmesi gereken yapılar
+_UNSAFE_IN_ALTERNATION = re.compile(r"\\[1-9]|\(\?P[<=]|^\(\?[aiLmsux]+\)")
+
+
+def _unescape_literal(text: str) -> Optional[str]:
+    """Desen düz bir metinse kaçışları çözülmüş halini, regex meta karakteri içeriyorsa None döndürür"""
+    out = []
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if ch == "\\":
+            if i + 1 >= len(text) or text[i + 1].isalnum():
+                return None  # \d, \w, \b gibi sınıflar düz metin değildir
+            out.append(text[i + 1])
+            i += 2
+            continue
+        if ch in _REGEX_META:
+            return None
+        out.append(ch)
+        i += 1
+    return "".join(out)
+
+
+def _split_alternatives(pattern: str) -> List[str]:
+    """Grup/sınıf içermeyen desenleri üst düzey '|' işaretlerinden böler (ör. r'\\.jpg$|\\.png$')"""
+    if any(ch in pattern for ch in "()[]"):
+        return [pattern]
+    parts, current, i = [], [], 0
+    while i < len(pattern):
+        if pattern[i] == "\\" and i + 1 < len(pattern):
+            current.append(pattern[i:i + 2])
+            i += 2
+            continue
+        if pattern[i] == "|":
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(pattern[i])
+        i += 1
+    parts.append("".join(current))
+    return parts
+
+
+class _CompiledRules:
+    """
+    Bir kural listesinin derlenmiş hali. Düz metin kurallar regex'e hiç girmez:
+    '^önek' -> str.startswith, 'sonek$' -> str.endswith, 'metin' -> 'in'.
+    Kalan kurallar adlandırılmış gruplarla tek bir alternation regex'inde birleştirilir,
+    böylece her yol için tek bir search yapılır ve eşleşen kural m.lastgroup ile bulunur.
+    """
+
+    def __init__(self, rules: Tuple[str, ...]):
+        self.rules: List[str] = []
+        self.prefixes: List[Tuple[str, int]] = []
+        self.suffixes: List[Tuple[str, int]] = []
+        self.substrings: List[Tuple[str, int]] = []
+        self.fallback: List[Tuple[Pattern, int]] = []
+        regex_parts: List[Tuple[str, int]] = []
+
+        for rule in rules:
+            try:
+                re.compile(rule)
+            except re.error:
+                print(f"Invalid regex pattern: {rule}")
+                continue
+            index = len(self.rules)
+            self.rules.append(rule)
+
+            for part in _split_alternatives(rule):
+                if part.startswith("^") and not part.endswith("$"):
+                    literal = _unescape_literal(part[1:])
+                    if literal is not None:
+                        self.prefixes.append((literal, index))
+                        continue
+                elif part.endswith("$") and not part.endswith("\\$") and not part.startswith("^"):
+                    literal = _unescape_literal(part[:-1])
+                    if literal is not None:
+                        self.suffixes.append((literal, index))
+                        continue
+                else:
+                    literal = _unescape_literal(part)
+                    if literal is not None:
+                        self.substrings.append((literal, index))
+                        continue
+
+                if _UNSAFE_IN_ALTERNATION.search(part):
+                    self.fallback.append((re.compile(part), index))
+                else:
+                    regex_parts.append((part, index))
+
+        self.prefix_tuple = tuple(literal for literal, _ in self.prefixes)
+        self.suffix_tuple = tuple(literal for literal, _ in self.suffixes)
+        self.regex: Optional[Pattern] = None
+        self.group_rules = {}
+        if regex_parts:
+            alternation = "|".join(f"(?P<r{n}>{part})" for n, (part, _) in enumerate(regex_parts))
+            try:
+                self.regex = re.compile(alternation)
+                self.group_rules = {f"r{n}": index for n, (_, index) in enumerate(regex_parts)}
+            except re.error:
+                self.fallback.extend((re.compile(part), index) for part, index in regex_parts)
+
+    def match(self, text: str) -> Optional[int]:
+        """Eşleşen ilk kuralın sırası; eşleşme yoksa None"""
+        if self.prefix_tuple and text.startswith(self.prefix_tuple):
+            for literal, index in self.prefixes:
+                if text.startswith(literal):
+                    return index
+        if self.suffix_tuple:
+            # '$' metnin sonunda ve sondaki tek bir '\n' öncesinde de eşleşir
+            tails = (text, text[:-1]) if text.endswith("\n") else (text,)
+            if any(tail.endswith(self.suffix_tuple) for tail in tails):
+                for literal, index in self.suffixes:
+                    if any(tail.endswith(literal) for tail in tails):
+                        return index
+        for literal, index in self.substrings:
+            if literal in text:
+                return index
+        if self.regex is not None:
+            m = self.regex.search(text)
+            if m:
+                return self.group_rules[m.lastgroup]
+        for pattern, index in self.fallback:
+            if pattern.search(text):
+                return index
+        return None
+
+
+@lru_cache(maxsize=64)
+def _compile_rules(rules: Tuple[str, ...]) -> _CompiledRules:
+    return _CompiledRules(rules)
+
+
+class RuleMatcher:
+    """
+    Dahil etme/hariç tutma kurallarını bir kez derler ve yolları tek geçişte değerlendirir.
+    Karar, her desen için ayrı ayrı any(pattern.search(...)) ile aynıdır: hariç tutma
+    kurallarından biri eşleşirse dışlanır, inclusion kuralları varsa biri eşleşmelidir.
+    Doküman başına satır yazmak yerine kural başına sayaç tutar ve özet basar.
+    """
+
+    def __init__(self, inclusion_rules: Optional[Sequence[str]] = None, exclusion_rules: Optional[Sequence[str]] = None):
+        self.inclusion = _compile_rules(tuple(inclusion_rules or ()))
+        self.exclusion = _compile_rules(tuple(exclusion_rules or ()))
+        self.inclusion_hits = [0] * len(self.inclusion.rules)
+        self.exclusion_hits = [0] * len(self.exclusion.rules)
+        self.passed = 0
+        self.excluded = 0
+        self.not_included = 0
+
+    def allowed(self, text: str) -> bool:
+        rule = self.exclusion.match(text)
+        if rule is not None:
+            self.exclusion_hits[rule] += 1
+            self.excluded += 1
+            return False
+        if self.inclusion.rules:
+            rule = self.inclusion.match(text)
+            if rule is None:
+                self.not_included += 1
+                return False
+            self.inclusion_hits[rule] += 1
+        self.passed += 1
+        return True
+
+    def filter(self, items: Iterable[T], key: Callable[[T], str]) -> List[T]:
+        """Öğeleri key(öğe) metnine göre toplu olarak süzer; sıra korunur"""
+        allowed = self.allowed
+        return [item for item in items if allowed(key(item))]
+
+    def log_summary(self, tag: str = "[apply_rules]") -> None:
+        print(f"{tag} Geçti: {self.passed}, Dışlandı: {self.excluded}, Dahil edilmedi: {self.not_included}")
+        for rule, hits in zip(self.exclusion.rules, self.exclusion_hits):
+            if hits:
+                print(f"{tag}   hariç {rule!r}: {hits}")
+        for rule, hits in zip(self.inclusion.rules, self.inclusion_hits):
+            if hits:
+                print(f"{tag}   dahil {rule!r}: {hits}")
@@ -1,8 +1,21 @@
-import re
-from typing import List, Sequence, Optional, Pattern
+import os
+import sys
+import json
+import tarfile
+import tempfile
+from datetime import datetime, timezone
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Sequence, Optional, Tuple, Dict, Iterable, Iterator, Set
 from llama_index.core import Document
 from llama_index.core.schema import BaseNode
 from gitlab import Gitlab
+import requests
+from requests.adapters import HTTPAdapter
+# Ortak modüller depo kökündeki common/ paketindedir
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from common.rule_matcher import RuleMatcher
 
 
 class GitLabEmbeddingMethod:
@@ -11,10 +24,27 @@ class GitLabEmbeddingMethod:
         repo_url: str,
         private_token: str,
         branch: Optional[str] = "main",
+        max_workers: int = 8,
+        state_path: Optional[str] = None,
+        inclusion_rules: Optional[List[str]] = None,
+        exclusion_rules: Optional[List[str]] = None,
+        max_file_size: Optional[int] = None,
     ):
         self.repo_url = repo_url
         self.private_token = private_token
         self.branch = branch
+        self.max_workers = max(1, max_workers)
+        self.state_path = state_path
+        self._pending_sha: Optional[str] = None
+        # Geçici hatayla (zaman aşımı, 5xx) alınamayan dosyalar; varken commit SHA'sı kaydedilmez
+        self.failed_paths: Set[str] = set()
+        # Tam listeleme/arşiv indirme başarılı olduysa True; yazılmayan kaynaklar ancak o zaman silinebilir
+        self.listing_complete = False
+        # Listeleme aşamasında, içerik indirilmeden uygulanan kurallar
+        self.inclusion_rules = inclusion_rules or []
+        self.exclusion_rules = exclusion_rules or []
+        self.max_file_size = max_file_size
+        self._listing_rules = RuleMatcher(self.inclusion_rules, self.exclusion_rules)
 
         if "https://gitlab.com/" in repo_url:
             self.project_path = repo_url.split("https://gitlab.com/")[1].rstrip("/")
@@ -29,73 +59,170 @@ class GitLabEmbeddingMethod:
         })
         return document
 
-    def _compile_patterns(self, patterns: List[str]) -> List[Pattern]:
-        compiled = []
-        for pattern in patterns:
-            try:
-                compiled.append(re.compile(pattern))
-            except re.error:
-                print(f"Invalid regex pattern: {pattern}")
-        return compiled
-
     def apply_rules(
         self,
         documents: Sequence[Document],
         inclusion_rules: List[str],
         exclusion_rules: List[str],
     ) -> Sequence[Document]:
-        compiled_exclude = self._compile_patterns(exclusion_rules)
-        compiled_include = self._compile_patterns(inclusion_rules)
-
-        filtered_docs = []
+        matcher = RuleMatcher(inclusion_rules, exclusion_rules)
         print("\n[apply_rules] Başlangıç doküman sayısı:", len(documents))
+        filtered_docs = matcher.filter(documents, key=lambda doc: doc.metadata.get("file_path", ""))
+        matcher.log_summary()
+        return filtered_docs
 
-        for doc in documents:
-            file_path = doc.metadata.get("file_path", "")
-            excluded = any(pattern.search(file_path) for pattern in compiled_exclude)
-            included = any(pattern.search(file_path) for pattern in compiled_include) if compiled_include else True
+    def _listing_allowed(self, file_path: str, size: Optional[int] = None) -> bool:
+        """Yol kuralları ve (biliniyorsa) boyut sınırı; indirmeden önce değerlendirilir"""
+        if self.max_file_size is not None and size is not None and size > self.max_file_size:
+            return False
+        return self._listing_rules.allowed(file_path)
 
-            if excluded:
-                print(f"[apply_rules] Dışlandı: {file_path}")
-                continue
-            if not included:
-                print(f"[apply_rules] Dahil edilmedi: {file_path}")
-                continue
+    def _create_client(self) -> Gitlab:
+        """Tüm worker'ların paylaştığı, bağlantı havuzlu bir HTTP session ile istemci oluşturur"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return Gitlab('https://gitlab.com', private_token=self.private_token, session=session)
 
-            print(f"[apply_rules] Geçti: {file_path}")
-            filtered_docs.append(doc)
+    def _resolve_head(self, project) -> str:
+        """Branch HEAD'ini commit SHA'sına çevirir; tüm okumalar aynı commit'ten yapılır"""
+        try:
+            return project.branches.get(self.branch).commit['id']
+        except Exception as e:
+            print(f"[sync_state] Branch HEAD alınamadı, {self.branch} kullanılıyor: {str(e)}")
+            return self.branch
 
-        return filtered_docs
+    def _record_head(self, ref: str) -> None:
+        """Okuma başarılıysa, commit_sync_state ile kaydedilecek SHA'yı işaretler"""
+        if ref != self.branch:
+            self._pending_sha = ref
 
-    def get_documents(self, data_source_id: str) -> List[Document]:
-        gl = Gitlab('https://gitlab.com', private_token=self.private_token)
+    def _fetch_document(self, project, item: dict, data_source_id: str, ref: Optional[str] = None) -> Optional[Document]:
+        file_path = item['path']
+        file_name = item['name']
+        file_ext = file_name.split('.')[-1].lower() if '.' in file_name else ''
+
+        try:
+            file_obj = project.files.get(file_path, ref=ref or self.branch)
+            content = file_obj.decode()
+
+            if isinstance(content, bytes):
+                try:
+                    content = content.decode('utf-8')
+                except UnicodeDecodeError:
+                    print(f"[get_documents] Binary file skipped: {file_path}")
+                    return None
+
+            doc = Document(
+                text=content,
+                metadata={
+                    "file_path": file_path,
+                    "file_name": file_name,
+                    "file_extension": file_ext,
+                    "last_modified": item.get('last_commit', {}).get('committed_date', '')
+                }
+            )
+            self.customize_metadata(doc, data_source_id)
+            return doc
+
+        except Exception as e:
+            print(f"[get_documents] Error processing {file_path}: {str(e)}")
+            self.failed_paths.add(file_path)
+            return None
+
+    def _iter_fetched_documents(
+        self, project, items: List[dict], data_source_id: str, ref: Optional[str] = None
+    ) -> Iterator[Document]:
+        """Dosyaları paralel indirir; en fazla max_workers * 2 istek önden gider ve sıra korunur"""
+        pending = iter(items)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            submit = lambda item: executor.submit(self._fetch_document, project, item, data_source_id, ref)
+            window = deque(submit(item) for item in islice(pending, self.max_workers * 2))
+            while window:
+                doc = window.popleft().result()
+                next_item = next(pending, None)
+                if next_item is not None:
+                    window.append(submit(next_item))
+                if doc is not None:
+                    yield doc
+
+    def _fetch_documents(
+        self, project, items: List[dict], data_source_id: str, ref: Optional[str] = None
+    ) -> List[Document]:
+        return list(self._iter_fetched_documents(project, items, data_source_id, ref))
+
+    def iter_documents(self, data_source_id: str) -> Iterator[Document]:
+        """
+        Dosya ağacını branch HEAD'inin commit'inde listeler ve dosyaları
+        indirildikçe doküman olarak üretir. Bu commit, sonraki incremental
+        çalıştırmanın başlangıç noktası olarak işaretlenir.
+        """
+        self.failed_paths = set()
+        self.listing_complete = False
+        gl = self._create_client()
         project = gl.projects.get(self.project_path)
-        documents = []
+        ref = self._resolve_head(project)
 
         try:
-            items = project.repository_tree(ref=self.branch, recursive=True, all=True)
+            items = project.repository_tree(ref=ref, recursive=True, all=True)
         except Exception as e:
             print(f"Error accessing repository: {str(e)}")
-            return documents
+            return
+        self._record_head(ref)
+        self.listing_complete = True
 
-        for item in items:
-            if item['type'] != 'blob':
-                continue
+        blobs = [item for item in items if item['type'] == 'blob' and self._listing_allowed(item['path'])]
+        print(f"[get_documents] {len(items) - len(blobs)} öğe (klasör/filtrelenen) indirilmeden atlandı")
 
-            file_path = item['path']
-            file_name = item['name']
-            file_ext = file_name.split('.')[-1].lower() if '.' in file_name else ''
+        count = 0
+        for doc in self._iter_fetched_documents(project, blobs, data_source_id, ref):
+            count += 1
+            yield doc
 
-            try:
-                file_obj = project.files.get(file_path, ref=self.branch)
-                content = file_obj.decode()
+        print(f"[get_documents] Toplam {count} dosya alındı")
+
+    def get_documents(self, data_source_id: str) -> List[Document]:
+        return list(self.iter_documents(data_source_id))
+
+    def _read_archive(
+        self,
+        fileobj,
+        data_source_id: str,
+        rules: RuleMatcher,
+    ) -> Iterator[Document]:
+        """tar.gz arşivini sırayla dolaşır; yalnızca filtreyi geçen üyeleri açar"""
+        count = 0
+        skipped = 0
+
+        # "r|gz" akış modu: üyeler geri sarma yapılmadan tek geçişte okunur
+        with tarfile.open(fileobj=fileobj, mode="r|gz") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
 
-                if isinstance(content, bytes):
-                    try:
-                        content = content.decode('utf-8')
-                    except UnicodeDecodeError:
-                        print(f"[get_documents] Binary file skipped: {file_path}")
-                        continue
+                # Arşivdeki üst klasörü (<proje>-<ref>-<sha>/) kaldır
+                file_path = member.name.split('/', 1)[1] if '/' in member.name else member.name
+                if not rules.allowed(file_path):
+                    skipped += 1
+                    continue
+                if self.max_file_size is not None and member.size > self.max_file_size:
+                    skipped += 1
+                    continue
+
+                file_name = file_path.split('/')[-1]
+                file_ext = file_name.split('.')[-1].lower() if '.' in file_name else ''
+
+                try:
+                    raw = tar.extractfile(member).read()
+                    content = raw.decode('utf-8')
+                except UnicodeDecodeError:
+                    print(f"[get_archive_documents] Binary file skipped: {file_path}")
+                    continue
+                except Exception as e:
+                    print(f"[get_archive_documents] Error processing {file_path}: {str(e)}")
+                    self.failed_paths.add(file_path)
+                    continue
 
                 doc = Document(
                     text=content,
@@ -103,18 +230,157 @@ class GitLabEmbeddingMethod:
                         "file_path": file_path,
                         "file_name": file_name,
                         "file_extension": file_ext,
-                        "last_modified": item.get('last_commit', {}).get('committed_date', '')
+                        "last_modified": datetime.fromtimestamp(member.mtime, tz=timezone.utc).isoformat()
                     }
                 )
                 self.customize_metadata(doc, data_source_id)
-                documents.append(doc)
+                count += 1
+                yield doc
+
+        print(f"[get_archive_documents] {skipped} dosya filtre nedeniyle açılmadan atlandı")
+        print(f"[get_archive_documents] Toplam {count} dosya alındı")
+
+    def iter_archive_documents(
+        self,
+        data_source_id: str,
+        inclusion_rules: Optional[List[str]] = None,
+        exclusion_rules: Optional[List[str]] = None,
+    ) -> Iterator[Document]:
+        """
+        Branch'in arşivini tek bir tar.gz olarak indirip dosyaları oradan,
+        arşivdeki sırayla okur. Kurallar verilmezse yapıcıdaki listeleme
+        kuralları kullanılır.
+        """
+        self.failed_paths = set()
+        self.listing_complete = False
+        gl = self._create_client()
+        project = gl.projects.get(self.project_path)
+        ref = self._resolve_head(project)
+        if inclusion_rules is None and exclusion_rules is None:
+            rules = self._listing_rules
+        else:
+            rules = RuleMatcher(
+                self.inclusion_rules if inclusion_rules is None else inclusion_rules,
+                self.exclusion_rules if exclusion_rules is None else exclusion_rules,
+            )
 
+        # 64MB'a kadar bellekte, sonrası geçici dosyada tutulur
+        with tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024) as spool:
+            try:
+                project.repository_archive(sha=ref, format="tar.gz", streamed=True, action=spool.write)
             except Exception as e:
-                print(f"[get_documents] Error processing {file_path}: {str(e)}")
+                print(f"Error downloading repository archive: {str(e)}")
+                return
+            self._record_head(ref)
+            self.listing_complete = True
+            spool.seek(0)
+            yield from self._read_archive(spool, data_source_id, rules)
+
+    def get_archive_documents(
+        self,
+        data_source_id: str,
+        inclusion_rules: Optional[List[str]] = None,
+        exclusion_rules: Optional[List[str]] = None,
+    ) -> List[Document]:
+        return list(self.iter_archive_documents(data_source_id, inclusion_rules, exclusion_rules))
+
+    @property
+    def _state_key(self) -> str:
+        return f"{self.project_path}@{self.branch}"
+
+    def _load_sync_state(self) -> Dict[str, str]:
+        if not self.state_path or not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"[sync_state] Durum dosyası okunamadı: {str(e)}")
+            return {}
+
+    def commit_sync_state(self) -> None:
+        """
+        İndeksleme başarılı olduktan sonra son işlenen commit SHA'sını kaydeder.
+        Alınamayan dosya varsa SHA ilerletilmez; sonraki çalıştırma aynı farkı tekrar dener.
+        """
+        if not self.state_path or not self._pending_sha:
+            return
+        if self.failed_paths:
+            print(f"[sync_state] {len(self.failed_paths)} dosya alınamadı, commit kaydedilmedi; sonraki çalıştırmada tekrar denenecek")
+            self._pending_sha = None
+            return
+        state = self._load_sync_state()
+        state[self._state_key] = self._pending_sha
+        state_dir = os.path.dirname(self.state_path)
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+        self._pending_sha = None
+
+    def get_changed_documents(self, data_source_id: str) -> Tuple[Iterable[Document], Optional[List[str]]]:
+        """
+        Son indekslenen commit ile branch HEAD'i arasındaki farkı kullanarak
+        yalnızca eklenen/değişen dosyaları indirir.
+        Dönüş: (indekslenecek dokümanlar, vektörleri önceden silinecek dosya yolları).
+        Önceden yalnızca silinen, taşınan ve artık kurallara uymayan yollar silinir;
+        değişen dosyaların parçalarını upsert deposu değiştirir. Silinecek yollar
+        None ise tam senkronizasyon yapılmıştır, dokümanlar iter_documents
+        akışıdır ve akış bitince yazılmayan kaynaklar silinmelidir.
+        """
+        self.failed_paths = set()
+        self.listing_complete = False
+        gl = self._create_client()
+        project = gl.projects.get(self.project_path)
+
+        head_sha = project.branches.get(self.branch).commit['id']
+        last_sha = self._load_sync_state().get(self._state_key)
+        self._pending_sha = head_sha
+
+        if last_sha == head_sha:
+            print(f"[get_changed_documents] Değişiklik yok ({head_sha[:8]})")
+            return [], []
+
+        if last_sha is None:
+            print("[get_changed_documents] Kayıtlı commit yok, tam senkronizasyon yapılıyor")
+            return self.iter_documents(data_source_id), None
+
+        try:
+            comparison = project.repository_compare(last_sha, head_sha)
+        except Exception as e:
+            print(f"[get_changed_documents] Karşılaştırma başarısız, tam senkronizasyon yapılıyor: {str(e)}")
+            return self.iter_documents(data_source_id), None
+
+        if comparison.get('compare_timeout'):
+            print("[get_changed_documents] Karşılaştırma zaman aşımına uğradı, tam senkronizasyon yapılıyor")
+            return self.iter_documents(data_source_id), None
+
+        changed_items = []
+        stale_paths = []
+        for diff in comparison.get('diffs', []):
+            if diff.get('deleted_file'):
+                stale_paths.append(diff['old_path'])
                 continue
+            if diff.get('renamed_file'):
+                stale_paths.append(diff['old_path'])
+
+            new_path = diff['new_path']
+            if self._listing_allowed(new_path):
+                # Değişen dosyanın eski parçalarını upsert deposu yenileri yazıldıktan sonra siler;
+                # indirme başarısız olursa eski vektörler yerinde kalır
+                changed_items.append({"path": new_path, "name": new_path.split('/')[-1]})
+            elif not diff.get('new_file') and not diff.get('renamed_file'):
+                stale_paths.append(new_path)
 
-        print(f"[get_documents] Toplam {len(documents)} dosya alındı")
-        return documents
+        # Karşılaştırılan commit'ten okunur; arada gelen push kaydedilen SHA ile içeriği ayırmaz
+        documents = self._fetch_documents(project, changed_items, data_source_id, head_sha)
+        print(
+            f"[get_changed_documents] {last_sha[:8]}..{head_sha[:8]}: "
+            f"{len(documents)} dosya alındı, {len(stale_paths)} eski yol silinecek"
+        )
+        return documents, stale_paths
 
     def get_nodes(self, documents: Sequence[Document]) -> Sequence[BaseNode]:
         return []
@@ -1,5 +1,4 @@
 from ocr_embedding import DocumentEmbeddingMethod
-from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.core.ingestion import IngestionPipeline
 from llama_index.core.node_parser import MarkdownNodeParser
@@ -8,6 +7,12 @@ from llama_index.core.schema import MetadataMode
 import chromadb
 from dotenv import load_dotenv
 import os
+import sys
+# Ortak modüller depo kökündeki common/ paketindedir
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from common.batching import index_in_batches
+from common.embedding_cache import EmbeddingCache, CachedEmbedding
+from common.chroma_upsert import UpsertChromaVectorStore
 
 def debug_print_docs(docs, tag="[DEBUG]", max_print=5):
     print(f"\n{tag} Toplam {len(docs)} doküman (ilk {max_print} gösteriliyor):")
@@ -18,6 +23,7 @@ def debug_print_docs(docs, tag="[DEBUG]", max_print=5):
         print(f"{tag}   - Boyut: {metadata.get('file_size')} byte")
         print(f"{tag}   - Son değişiklik: {metadata.get('last_modified')}")
 
+
 if __name__ == "__main__":
     load_dotenv()
     
@@ -41,46 +47,70 @@ if __name__ == "__main__":
         os.getenv("CHROMA_COLLECTION_NAME", "llama_parsed_docs"),
         metadata={"hnsw:space": "cosine"}
     )
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+    # Node id'leri içerikten türetilir; yeniden çalıştırma kopya yerine upsert yapar
+    vector_store = UpsertChromaVectorStore(chroma_collection=chroma_collection, source_key="file_path")
+
+    # Değişmemiş parçalar modele gönderilmeden kalıcı önbellekten alınır
+    embedding_cache = EmbeddingCache(
+        os.getenv("EMBEDDING_CACHE_PATH", os.path.join(os.getenv("CHROMA_DB_PATH", "./chroma_db"), "embedding_cache.sqlite")),
+        max_bytes=int(os.getenv("EMBEDDING_CACHE_MAX_MB", "256")) * 1024 * 1024
+    )
+    cached_embed_model = CachedEmbedding(embed_model, embedding_cache)
 
     # Doküman işleyiciyi oluştur
     embedder = DocumentEmbeddingMethod(
-        docs_path=os.path.expanduser(os.getenv("DOCUMENTS_PATH", "./documents"))
+        docs_path=os.path.expanduser(os.getenv("DOCUMENTS_PATH", "./documents")),
+        cache_dir=os.getenv("PARSE_CACHE_DIR", "./parse_cache"),
+        cache_max_bytes=int(os.getenv("PARSE_CACHE_MAX_MB", "512")) * 1024 * 1024,
+        parse_workers=int(os.getenv("PARSE_WORKERS", "4")),
+        extract_workers=int(os.getenv("EXTRACT_WORKERS", os.cpu_count() or 1)),
+        pages_per_document=int(os.getenv("PDF_PAGES_PER_DOCUMENT", "0")),
+        # Bir sayfa aralığı işlenemezse dosyanın eski parçaları silinmez
+        on_incomplete=vector_store.keep_stale
     )
+    # Aynı anda işlenip gömülen en fazla doküman sayısı
+    batch_size = int(os.getenv("INDEX_BATCH_SIZE", "64"))
 
     try:
-        # 1. Adım: Tüm dokümanları yükle
-        print("\n[1/3] Dokümanlar yükleniyor...")
-        documents = embedder.get_documents("llama_parsed_collection")
-        debug_print_docs(documents, "[YÜKLENEN]")
-
-        # 2. Adım: İşleme pipeline'ını oluştur
-        print("\n[2/3] İşleme pipeline'ı hazırlanıyor...")
+        # 1. Adım: İşleme pipeline'ını oluştur
+        print("\n[1/3] İşleme pipeline'ı hazırlanıyor...")
         node_parser = MarkdownNodeParser()
         
         pipeline = IngestionPipeline(
             transformations=[
                 node_parser,
-                embed_model
+                cached_embed_model
             ],
             vector_store=vector_store,
         )
 
-        # 3. Adım: Dokümanları işle ve indeksle
-        print("\n[3/3] Dokümanlar işleniyor ve indeksleniyor...")
-        pipeline.run(
-            documents=documents,
+        # 2. Adım: Dokümanlar ayrıştırıldıkça gruplar halinde indeksle
+        print("\n[2/3] Dokümanlar akış halinde yükleniyor...")
+        documents = embedder.iter_documents("llama_parsed_collection")
+
+        print("\n[3/3] Dokümanlar gruplar halinde işleniyor ve indeksleniyor...")
+        loaded, indexed = index_in_batches(
+            documents,
+            pipeline,
+            batch_size=batch_size,
+            # Önbellekli embedding (SQLite bağlantısı) tek süreçte çalışır;
+            # HuggingFace modeli zaten embed_batch_size'lık gruplarla çalışıyor
             show_progress=True,
-            num_workers=4
+            on_first_batch=lambda batch: debug_print_docs(batch, "[YÜKLENEN]")
         )
         
         # Sonuçları raporla
         print("\n[SONUÇ] İndeksleme tamamlandı:")
-        print(f"- İşlenen toplam doküman: {len(documents)}")
+        print(f"- İşlenen toplam doküman: {loaded}")
         print(f"- Vektör koleksiyonundaki öğe sayısı: {chroma_collection.count()}")
         print("- Embedding modeli:", os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-mpnet-base-v2"))
         print("- Kullanılan parser: LlamaParse")
+        if embedder.parse_cache:
+            print(f"- Parse önbelleği: {embedder.parse_cache.report()}")
+        print(f"- Embedding önbelleği: {embedding_cache.report()}")
 
     except Exception as e:
         print(f"\n[HATA] İşlem sırasında bir hata oluştu: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+    finally:
+        embedding_cache.close()
@@ -1,70 +1,406 @@
 import os
-import re
-from typing import List, Sequence, Pattern, Dict
+import sys
+import gzip
+import json
+import hashlib
+import asyncio
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import List, Sequence, Dict, Optional, Tuple, Iterator, Callable, Set
 from llama_index.core import Document
 from llama_index.core.schema import BaseNode
 from llama_parse import LlamaParse
 from dotenv import load_dotenv
+# Ortak modüller depo kökündeki common/ paketindedir
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from common.rule_matcher import RuleMatcher
 
 load_dotenv()
 
+
+def _llama_parse_version() -> str:
+    try:
+        from importlib.metadata import version
+        return version("llama-parse")
+    except Exception:
+        return "unknown"
+
+
+def _with_empty_metadata(extractor: Callable[[str], str], file_path: str) -> Tuple[str, Dict[str, object]]:
+    # Process pool'da çalışır; PDF yolu ile aynı (içerik, ek metadata) biçimini döndürür
+    return extractor(file_path), {}
+
+
+async def _make_semaphore(limit: int) -> asyncio.Semaphore:
+    # Semaphore, kullanılacağı olay döngüsünün içinde oluşturulur
+    return asyncio.Semaphore(limit)
+
+
+class ParseCache:
+    """
+    LlamaParse çıktıları için içerik adresli disk önbelleği.
+    Anahtar: dosya içeriğinin SHA-256'sı + parser ayarları; değer: gzip'li markdown.
+    Toplam boyut max_bytes'ı aşınca en uzun süredir kullanılmayan girdiler silinir
+    (kullanım zamanı olarak dosya mtime'ı tutulur).
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._total_bytes = sum(os.path.getsize(path) for path in self._entries())
+
+    def _entries(self) -> List[str]:
+        paths = []
+        for root, _, files in os.walk(self.cache_dir):
+            paths.extend(os.path.join(root, name) for name in files if name.endswith(".md.gz"))
+        return paths
+
+    @staticmethod
+    def file_hash(file_path: str) -> str:
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def make_key(content_hash: str, settings: Dict[str, str]) -> str:
+        payload = json.dumps({"content": content_hash, "settings": settings}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.md.gz")
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                text = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            print(f"[parse_cache] Bozuk girdi siliniyor ({key}): {str(e)}")
+            self._remove(path)
+            self.misses += 1
+            return None
+        os.utime(path)  # LRU için kullanım zamanını güncelle
+        self.hits += 1
+        return text
+
+    def put(self, key: str, text: str) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        previous = os.path.getsize(path) if os.path.exists(path) else 0
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+        self._total_bytes += os.path.getsize(path) - previous
+        self.writes += 1
+        self._evict()
+
+    def _remove(self, path: str) -> None:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            self._total_bytes -= size
+        except OSError:
+            pass
+
+    def _evict(self) -> None:
+        if self._total_bytes <= self.max_bytes:
+            return
+        for path in sorted(self._entries(), key=os.path.getmtime):
+            if self._total_bytes <= self.max_bytes:
+                break
+            self._remove(path)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "entries": len(self._entries()),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def report(self) -> str:
+        stats = self.stats()
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = (stats["hits"] / lookups * 100) if lookups else 0.0
+        return (
+            f"{stats['entries']} girdi, {stats['bytes'] / (1024 * 1024):.1f}/"
+            f"{stats['max_bytes'] / (1024 * 1024):.0f} MB, "
+            f"isabet {stats['hits']}/{lookups} (%{hit_rate:.0f}), "
+            f"yazma {stats['writes']}, tahliye {stats['evictions']}"
+        )
+
+
 class DocumentEmbeddingMethod:
-    def __init__(self, docs_path: str):
+    def __init__(
+        self,
+        docs_path: str,
+        cache_dir: Optional[str] = None,
+        cache_max_bytes: int = 512 * 1024 * 1024,
+        parser=None,
+        min_page_chars: int = 25,
+        sample_pages: int = 5,
+        parse_workers: int = 4,
+        extract_workers: Optional[int] = None,
+        pages_per_document: int = 0,
+        on_incomplete: Optional[Callable[[str, str], None]] = None,
+    ):
         self.docs_path = docs_path
         self.supported_extensions = ['.pdf', '.docx', '.pptx', '.html', '.txt']
-        self.parser = LlamaParse(
+        self.result_type = "markdown"  # Daha iyi yapılandırılmış çıktı
+        # parser: testlerde LlamaParse yerine load_data(file_path) sunan yerel bir sahte nesne verilebilir
+        self.parser = parser or LlamaParse(
             api_key=os.getenv("LLAMA_CLOUD_API_KEY"),
-            result_type="markdown",  # Daha iyi yapılandırılmış çıktı
-            num_workers=4,           # Paralel işleme
+            result_type=self.result_type,
+            num_workers=parse_workers,  # Paralel işleme
             verbose=True
         )
+        self.parse_cache = ParseCache(cache_dir, cache_max_bytes) if cache_dir else None
+        # Bir sayfa en az min_page_chars çıkarılabilir karakter içeriyorsa metin katmanı var sayılır
+        self.min_page_chars = min_page_chars
+        self.sample_pages = sample_pages
+        self.parse_workers = max(1, parse_workers)  # Aynı anda işlenen PDF sayısı
+        self.extract_workers = max(1, extract_workers or os.cpu_count() or 1)
+        # 0: PDF başına tek doküman; N > 0: her N sayfa ayrı doküman (sayfa akışı modu)
+        self.pages_per_document = max(0, pages_per_document)
+        # Bir parçası (ör. sayfa aralığı) işlenemeyen dosyalar; on_incomplete(data_source_id, file_path)
+        # ile vektör deposuna bildirilir ki dosyanın eski parçaları bu çalıştırmada silinmesin
+        self.failed_paths: Set[str] = set()
+        self.on_incomplete = on_incomplete
+        self._file_hashes: Dict[Tuple[str, float, int], str] = {}
+        # Bu ayarlardan biri değişirse önbellek anahtarı da değişir
+        self.parser_settings = {
+            "result_type": self.result_type,
+            "parser_version": _llama_parse_version(),
+        }
 
     @staticmethod
     def customize_metadata(document: Document, data_source_id: str) -> Document:
         document.metadata.update({
             "data_source_id": data_source_id,
             "file_type": document.metadata.get("file_name", "").split(".")[-1].lower(),
-            "processing_method": "llama_parse"
+            "processing_method": document.metadata.get("processing_method", "llama_parse")
         })
         return document
 
-    def _compile_patterns(self, patterns: List[str]) -> List[Pattern]:
-        compiled = []
-        for pattern in patterns:
+    def apply_rules(
+        self,
+        documents: Sequence[Document],
+        inclusion_rules: List[str],
+        exclusion_rules: List[str],
+    ) -> Sequence[Document]:
+        matcher = RuleMatcher(inclusion_rules, exclusion_rules)
+        print("\n[apply_rules] Başlangıç doküman sayısı:", len(documents))
+
+        supported = {ext[1:] for ext in self.supported_extensions}
+        supported_docs = [doc for doc in documents if doc.metadata.get("file_extension", "").lower() in supported]
+
+        filtered_docs = matcher.filter(supported_docs, key=lambda doc: doc.metadata.get("file_path", ""))
+        matcher.log_summary()
+        print(f"[apply_rules] Filtrelenen doküman sayısı: {len(filtered_docs)}")
+        return filtered_docs
+
+    async def _aprocess_with_llamaparse(self, file_path: str, cache_id: Optional[str] = None) -> str:
+        """
+        LlamaParse ile dosya işleme; değişmemiş dosyalar önbellekten okunur.
+        cache_id: geçici alt PDF'lerde içerik kimliği (kaynak hash + sayfa aralığı)
+        """
+        cache_key = None
+        if self.parse_cache:
             try:
-                compiled.append(re.compile(pattern))
-            except re.error:
-                print(f"Geçersiz regex deseni: {pattern}")
-        return compiled
+                content_id = cache_id or await asyncio.to_thread(ParseCache.file_hash, file_path)
+                cache_key = ParseCache.make_key(content_id, self.parser_settings)
+                cached = self.parse_cache.get(cache_key)
+                if cached is not None:
+                    return cached
+            except OSError as e:
+                print(f"[parse_cache] Önbellek okunamadı ({file_path}): {str(e)}")
 
-    def apply_rules():
+        try:
+            if hasattr(self.parser, "aload_data"):
+                documents = await self.parser.aload_data(file_path)
+            else:
+                documents = await asyncio.to_thread(self.parser.load_data, file_path)
+            text = "\n".join([doc.text for doc in documents])
+        except Exception as e:
+            print(f"LlamaParse işleme hatası ({file_path}): {str(e)}")
+            return ""
 
-        for doc in documents:
-            file_path = doc.metadata.get("file_path", "")
-            file_ext = doc.metadata.get("file_extension", "").lower()
+        # Boş sonuçlar (ör. geçici hata) önbelleğe yazılmaz
+        if cache_key and text.strip():
+            try:
+                self.parse_cache.put(cache_key, text)
+            except OSError as e:
+                print(f"[parse_cache] Önbelleğe yazılamadı ({file_path}): {str(e)}")
+        return text
 
-            if file_ext not in [ext[1:] for ext in self.supported_extensions]:
-                continue
+    def _process_with_llamaparse(self, file_path: str, cache_id: Optional[str] = None) -> str:
+        return asyncio.run(self._aprocess_with_llamaparse(file_path, cache_id))
 
-            excluded = any(pattern.search(file_path) for pattern in compiled_exclude)
-            included = any(pattern.search(file_path) for pattern in compiled_include) if compiled_include else True
+    def _has_text_layer(self, text: Optional[str]) -> bool:
+        return len((text or "").strip()) >= self.min_page_chars
 
-            if not excluded and included:
-                filtered_docs.append(doc)
+    def _sample_indices(self, page_count: int) -> List[int]:
+        if page_count <= self.sample_pages:
+            return list(range(page_count))
+        step = (page_count - 1) / (self.sample_pages - 1) if self.sample_pages > 1 else 0
+        return sorted({round(i * step) for i in range(self.sample_pages)})
 
-        print(f"[apply_rules] Filtrelenen doküman sayısı: {len(filtered_docs)}")
-        return filtered_docs
+    @staticmethod
+    def _pdf_page_count(file_path: str) -> int:
+        from pypdf import PdfReader
+        # Dosya yolu yerine tutamaç verilir; pypdf yol verildiğinde tüm dosyayı belleğe okur
+        with open(file_path, "rb") as f:
+            return len(PdfReader(f).pages)
 
-    def _process_with_llamaparse(self, file_path: str) -> str:
-        """LlamaParse ile dosya işleme"""
+    def _read_text_layer(self, file_path: str) -> Tuple[int, Optional[List[str]]]:
+        """
+        Örnek sayfalarda metin katmanı arar. Dönüş: (sayfa sayısı, sayfa metinleri);
+        örneklerin hiçbirinde metin yoksa sayfa metinleri None'dır.
+        """
+        from pypdf import PdfReader
+        with open(file_path, "rb") as f:
+            reader = PdfReader(f)
+            page_count = len(reader.pages)
+            sampled = self._sample_indices(page_count)
+            if not any(self._has_text_layer(reader.pages[i].extract_text()) for i in sampled):
+                return page_count, None
+            return page_count, [page.extract_text() or "" for page in reader.pages]
+
+    @staticmethod
+    def _read_page_range(file_path: str, start: int, end: int) -> List[str]:
+        """Yalnızca [start, end] aralığındaki sayfaların metnini çıkarır"""
+        from pypdf import PdfReader
+        with open(file_path, "rb") as f:
+            reader = PdfReader(f)
+            return [reader.pages[i].extract_text() or "" for i in range(start, end + 1)]
+
+    @staticmethod
+    def _write_page_run(file_path: str, start: int, end: int) -> str:
+        """[start, end] aralığındaki sayfaları geçici bir alt PDF'e yazar ve yolunu döndürür"""
+        from pypdf import PdfReader, PdfWriter
+
+        with open(file_path, "rb") as f:
+            reader = PdfReader(f)
+            writer = PdfWriter()
+            for index in range(start, end + 1):
+                writer.add_page(reader.pages[index])
+            tmp = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+            with tmp:
+                writer.write(tmp)
+        return tmp.name
+
+    async def _afile_hash(self, file_path: str) -> str:
+        # Sayfa aralığı modunda aynı dosyanın birden çok işi tek hash'i paylaşır
+        stat = os.stat(file_path)
+        memo_key = (file_path, stat.st_mtime, stat.st_size)
+        if memo_key not in self._file_hashes:
+            self._file_hashes[memo_key] = await asyncio.to_thread(ParseCache.file_hash, file_path)
+        return self._file_hashes[memo_key]
+
+    async def _aocr_page_run(self, file_path: str, start: int, end: int) -> str:
+        """Ardışık görüntü sayfalarını tek bir alt PDF olarak OCR'a gönderir"""
+        cache_id = f"{await self._afile_hash(file_path)}:pages={start}-{end}" if self.parse_cache else None
+        tmp_path = await asyncio.to_thread(self._write_page_run, file_path, start, end)
+        try:
+            return await self._aprocess_with_llamaparse(tmp_path, cache_id=cache_id)
+        finally:
+            os.remove(tmp_path)
+
+    async def _amerge_with_ocr(self, file_path: str, page_texts: List[str], first_page: int) -> Tuple[str, int]:
+        """
+        page_texts (first_page'den başlayan) içinde metin katmanı olmayan sayfaları
+        ardışık gruplar halinde, eşzamanlı olarak OCR'a gönderir ve sayfa sırasıyla birleştirir.
+        Dönüş: (metin, OCR'lanan sayfa sayısı)
+        """
+        image_pages = [i for i, text in enumerate(page_texts) if not self._has_text_layer(text)]
+
+        # Ardışık görüntü sayfalarını tek istekte topla
+        runs = []
+        for index in image_pages:
+            if runs and runs[-1][1] == index - 1:
+                runs[-1][1] = index
+            else:
+                runs.append([index, index])
+
+        ocr_texts = await asyncio.gather(*[
+            self._aocr_page_run(file_path, first_page + start, first_page + end) for start, end in runs
+        ])
+
+        parts = []
+        next_page = 0
+        for (start, end), ocr_text in zip(runs, ocr_texts):
+            parts.extend(page_texts[next_page:start])
+            parts.append(ocr_text)
+            next_page = end + 1
+        parts.extend(page_texts[next_page:])
+
+        return "\n\n".join(part for part in parts if part.strip()), len(image_pages)
+
+    async def _aprocess_pdf(self, file_path: str) -> Tuple[str, Dict[str, object]]:
+        """
+        Önce örnek sayfalarda metin katmanı arar:
+        - hiçbirinde yoksa (taranmış PDF) dosyanın tamamı LlamaParse'a gider
+        - varsa sayfalar yerel olarak çıkarılır; yalnızca metin katmanı olmayan
+          sayfalar OCR'a gönderilir (bkz. _amerge_with_ocr)
+        """
         try:
-            documents = self.parser.load_data(file_path)
-            return "\n".join([doc.text for doc in documents])
+            page_count, page_texts = await asyncio.to_thread(self._read_text_layer, file_path)
         except Exception as e:
-            print(f"LlamaParse işleme hatası ({file_path}): {str(e)}")
-            return ""
+            print(f"PDF metin katmanı kontrol edilemedi ({file_path}): {str(e)}")
+            return await self._aprocess_with_llamaparse(file_path), {"processing_method": "llama_parse"}
+
+        if page_texts is None:
+            return await self._aprocess_with_llamaparse(file_path), {
+                "processing_method": "llama_parse",
+                "page_count": page_count,
+                "ocr_pages": page_count,
+            }
+
+        content, ocr_pages = await self._amerge_with_ocr(file_path, page_texts, 0)
+        return content, {
+            "processing_method": "hybrid" if ocr_pages else "text_layer",
+            "page_count": page_count,
+            "ocr_pages": ocr_pages,
+        }
+
+    async def _aprocess_pdf_pages(self, file_path: str, start: int, end: int) -> Tuple[str, Dict[str, object]]:
+        """Sayfa akışı modu: yalnızca [start, end] aralığını okur; her aralık ayrı bir doküman olur"""
+        page_texts = await asyncio.to_thread(self._read_page_range, file_path, start, end)
+        content, ocr_pages = await self._amerge_with_ocr(file_path, page_texts, start)
+        if ocr_pages == len(page_texts):
+            method = "llama_parse"
+        else:
+            method = "hybrid" if ocr_pages else "text_layer"
+        return content, {
+            "processing_method": method,
+            "page_number": start + 1,
+            "page_start": start + 1,
+            "page_end": end + 1,
+            "ocr_pages": ocr_pages,
+        }
+
+    def _process_pdf(self, file_path: str) -> Tuple[str, Dict[str, object]]:
+        return asyncio.run(self._aprocess_pdf(file_path))
 
-    def _process_docx(self, file_path: str) -> str:
+    @staticmethod
+    def _process_docx(file_path: str) -> str:
         """DOCX işleme (LlamaParse desteklemiyorsa)"""
         try:
             from docx import Document as DocxDocument
@@ -74,7 +410,8 @@ class DocumentEmbeddingMethod:
             print(f"DOCX işleme hatası ({file_path}): {str(e)}")
             return ""
 
-    def _process_pptx(self, file_path: str) -> str:
+    @staticmethod
+    def _process_pptx(file_path: str) -> str:
         """PPTX işleme (LlamaParse desteklemiyorsa)"""
         try:
             from pptx import Presentation
@@ -89,7 +426,8 @@ class DocumentEmbeddingMethod:
             print(f"PPTX işleme hatası ({file_path}): {str(e)}")
             return ""
 
-    def _process_html(self, file_path: str) -> str:
+    @staticmethod
+    def _process_html(file_path: str) -> str:
         """HTML işleme"""
         try:
             from unstructured.partition.html import partition_html
@@ -101,7 +439,8 @@ class DocumentEmbeddingMethod:
             print(f"HTML işleme hatası ({file_path}): {str(e)}")
             return ""
 
-    def _process_txt(self, file_path: str) -> str:
+    @staticmethod
+    def _process_txt(file_path: str) -> str:
         """TXT işleme"""
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
@@ -110,36 +449,118 @@ class DocumentEmbeddingMethod:
             print(f"TXT işleme hatası ({file_path}): {str(e)}")
             return ""
 
-    def get_documents(self, data_source_id: str) -> List[Document]:
-        documents = []
+    def _list_files(self) -> List[Tuple[str, str, str]]:
+        """Desteklenen dosyaları sabit (sıralı) yürüme düzeninde listeler"""
+        files = []
+        for root, dirs, file_names in os.walk(self.docs_path):
+            dirs.sort()
+            for file_name in sorted(file_names):
+                file_ext = os.path.splitext(file_name)[1].lower()
+                if file_ext in self.supported_extensions:
+                    files.append((os.path.join(root, file_name), file_name, file_ext))
+        return files
+
+    def _iter_jobs(self) -> Iterator[Tuple[str, str, str, Optional[Tuple[int, int]]]]:
+        """
+        Dosya başına bir iş üretir; sayfa akışı modunda PDF'ler pages_per_document
+        sayfalık aralıklara bölünür ve her aralık ayrı (paralel) bir iş olur.
+        """
+        for file_path, file_name, file_ext in self._list_files():
+            if file_ext != '.pdf' or not self.pages_per_document:
+                yield file_path, file_name, file_ext, None
+                continue
+            try:
+                page_count = self._pdf_page_count(file_path)
+            except Exception as e:
+                print(f"PDF sayfa sayısı okunamadı, dosya bütün işlenecek ({file_path}): {str(e)}")
+                yield file_path, file_name, file_ext, None
+                continue
+            for start in range(0, page_count, self.pages_per_document):
+                end = min(start + self.pages_per_document, page_count) - 1
+                yield file_path, file_name, file_ext, (start, end)
+
+    def _submit(
+        self,
+        loop,
+        pdf_slots,
+        extract_pool: ProcessPoolExecutor,
+        file_path: str,
+        file_ext: str,
+        page_range: Optional[Tuple[int, int]] = None,
+    ) -> Future:
+        """PDF'ler olay döngüsüne, yerel çıkarıcılar process pool'a gönderilir; ikisi de Future döndürür"""
+        if file_ext == '.pdf':
+            async def run():
+                async with pdf_slots:
+                    if page_range:
+                        return await self._aprocess_pdf_pages(file_path, *page_range)
+                    return await self._aprocess_pdf(file_path)
+            return asyncio.run_coroutine_threadsafe(run(), loop)
+        if file_ext == '.txt':
+            # Okuması ucuz; ayrı sürece göndermeye değmez
+            future = Future()
+            future.set_result((self._process_txt(file_path), {}))
+            return future
+        extractor = {
+            '.docx': DocumentEmbeddingMethod._process_docx,
+            '.pptx': DocumentEmbeddingMethod._process_pptx,
+            '.html': DocumentEmbeddingMethod._process_html,
+        }[file_ext]
+        return extract_pool.submit(_with_empty_metadata, extractor, file_path)
+
+    def _mark_incomplete(self, data_source_id: str, file_path: str) -> None:
+        # Dosyanın sonraki dokümanları yield edilmeden önce çağrılır; depo kaynağı henüz kapatmamıştır
+        self.failed_paths.add(file_path)
+        if self.on_incomplete:
+            self.on_incomplete(data_source_id, file_path)
+
+    def iter_documents(self, data_source_id: str) -> Iterator[Document]:
+        """
+        Tüm PDF'leri tek bir olay döngüsünde eşzamanlı LlamaParse işleri olarak
+        (en fazla parse_workers adet), DOCX/PPTX/HTML'i process pool'da işler.
+        Sonuçlar hazır oldukça, ancak her zaman dosya listesi sırasıyla döndürülür.
+        """
         print(f"\n[get_documents] Dokümanlar taranıyor: {self.docs_path}")
 
-        for root, _, files in os.walk(self.docs_path):
-            for file_name in files:
-                file_ext = os.path.splitext(file_name)[1].lower()
-                if file_ext not in self.supported_extensions:
-                    continue
+        loop = asyncio.new_event_loop()
+        loop_thread = threading.Thread(target=loop.run_forever, daemon=True)
+        loop_thread.start()
+        pdf_slots = asyncio.run_coroutine_threadsafe(_make_semaphore(self.parse_workers), loop).result()
+        extract_pool = ProcessPoolExecutor(max_workers=self.extract_workers)
+
+        count = 0
+        self.failed_paths = set()
+        max_in_flight = max(self.parse_workers, self.extract_workers) * 2
+        window = deque()
+        pending = self._iter_jobs()
+        try:
+            for file_path, file_name, file_ext, page_range in pending:
+                window.append((file_path, file_name, file_ext, page_range,
+                               self._submit(loop, pdf_slots, extract_pool, file_path, file_ext, page_range)))
+                if len(window) >= max_in_flight:
+                    break
+
+            while window:
+                file_path, file_name, file_ext, page_range, future = window.popleft()
+                next_job = next(pending, None)
+                if next_job:
+                    next_path, next_name, next_ext, next_range = next_job
+                    window.append((next_path, next_name, next_ext, next_range,
+                                   self._submit(loop, pdf_slots, extract_pool, next_path, next_ext, next_range)))
 
-                file_path = os.path.join(root, file_name)
-                content = ""
-                
                 try:
-                    if file_ext == '.pdf':
-                        content = self._process_with_llamaparse(file_path)
-                    elif file_ext == '.docx':
-                        content = self._process_docx(file_path)
-                    elif file_ext == '.pptx':
-                        content = self._process_pptx(file_path)
-                    elif file_ext == '.html':
-                        content = self._process_html(file_path)
-                    elif file_ext == '.txt':
-                        content = self._process_txt(file_path)
+                    content, extra_metadata = future.result()
                 except Exception as e:
                     print(f"Doküman işleme hatası ({file_path}): {str(e)}")
+                    self._mark_incomplete(data_source_id, file_path)
                     continue
 
                 if not content.strip():
                     print(f"Uyarı: {file_path} boş içerik")
+                    # Sayfa aralığında boş sonuç OCR hatası da olabilir; dosyanın diğer aralıkları yazılsa da
+                    # eski parçaları korunur
+                    if page_range is not None:
+                        self._mark_incomplete(data_source_id, file_path)
                     continue
 
                 doc = Document(
@@ -149,14 +570,25 @@ class DocumentEmbeddingMethod:
                         "file_name": file_name,
                         "file_extension": file_ext[1:],
                         "last_modified": os.path.getmtime(file_path),
-                        "file_size": os.path.getsize(file_path)
+                        "file_size": os.path.getsize(file_path),
+                        **extra_metadata
                     }
                 )
                 self.customize_metadata(doc, data_source_id)
-                documents.append(doc)
+                count += 1
+                yield doc
+        finally:
+            for *_, future in window:
+                future.cancel()
+            extract_pool.shutdown(wait=True, cancel_futures=True)
+            loop.call_soon_threadsafe(loop.stop)
+            loop_thread.join()
+            loop.close()
 
-        print(f"[get_documents] İşlenen doküman sayısı: {len(documents)}")
-        return documents
+        print(f"[get_documents] İşlenen doküman sayısı: {count}")
+
+    def get_documents(self, data_source_id: str) -> List[Document]:
+        return list(self.iter_documents(data_source_id))
 
     def get_nodes(self, documents: Sequence[Document]) -> Sequence[BaseNode]:
         return []
\ No newline at end of file
@@ -1,12 +1,17 @@
 # index.py
 from obsidian_embedding import ObsidianEmbeddingMethod
-from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.core.ingestion import IngestionPipeline
 from llama_index.core.node_parser import SentenceSplitter
 import chromadb
 from dotenv import load_dotenv
 import os
+import sys
+# Ortak modüller depo kökündeki common/ paketindedir
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from common.batching import index_in_batches
+from common.embedding_cache import EmbeddingCache, CachedEmbedding
+from common.chroma_upsert import UpsertChromaVectorStore
 
 
 def debug_print_docs(docs, tag="[DEBUG]", max_print=10):
@@ -24,61 +29,92 @@ if __name__ == "__main__":
     )
 
     # ChromaDB ayarları
-    db = chromadb.PersistentClient(path=os.getenv("CHROMA_DB_PATH", "./chroma_db"))
+    chroma_db_path = os.getenv("CHROMA_DB_PATH", "./chroma_db")
+    db = chromadb.PersistentClient(path=chroma_db_path)
     chroma_collection = db.get_or_create_collection(
         os.getenv("CHROMA_COLLECTION_NAME", "obsidian_vaults")
     )
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+    # Node id'leri içerikten türetilir; yeniden çalıştırma kopya yerine upsert yapar
+    vector_store = UpsertChromaVectorStore(chroma_collection=chroma_collection, source_key="file_path")
+
+    # Değişmemiş parçalar modele gönderilmeden kalıcı önbellekten alınır
+    embedding_cache = EmbeddingCache(
+        os.getenv("EMBEDDING_CACHE_PATH", os.path.join(chroma_db_path, "embedding_cache.sqlite")),
+        max_bytes=int(os.getenv("EMBEDDING_CACHE_MAX_MB", "256")) * 1024 * 1024
+    )
+    cached_embed_model = CachedEmbedding(embed_model, embedding_cache)
+
+    # Artımlı mod: yalnızca yeni/değişmiş notlar okunur ve gömülür
+    incremental = os.getenv("INCREMENTAL_INDEXING", "false").lower() == "true"
+    # Aynı anda filtrelenip gömülen en fazla doküman sayısı
+    batch_size = int(os.getenv("INDEX_BATCH_SIZE", "64"))
 
     # Obsidian embedder'ı oluşturma
     embedder = ObsidianEmbeddingMethod(
-        vault_path=os.path.expanduser(os.getenv("OBSIDIAN_VAULT_PATH"))
+        vault_path=os.path.expanduser(os.getenv("OBSIDIAN_VAULT_PATH")),
+        manifest_path=os.getenv(
+            "OBSIDIAN_MANIFEST_PATH",
+            os.path.join(chroma_db_path, "obsidian_manifest.json")
+        ) if incremental else None
+    )
+
+    pipeline = IngestionPipeline(
+        transformations=[
+            SentenceSplitter(
+                chunk_size=int(os.getenv("CHUNK_SIZE", "512")),
+                chunk_overlap=int(os.getenv("CHUNK_OVERLAP", "20")),
+                # Obsidian'ın wikilink formatını dikkate alan ayar
+                paragraph_separator=r'\n\n|\n-{3,}\n|\[\[.*?\]\]'
+            ),
+            cached_embed_model
+        ],
+        vector_store=vector_store,
     )
 
+    inclusion_rules = [
+        r'\.md$',  # Sadece markdown dosyalarını al
+    ]
+    exclusion_rules = [
+        r'(^|/)\.obsidian/',  # Obsidian ayar klasörü
+        r'(^|/)\.trash/',     # Çöp klasörü
+        r'(^|/)\.git/',       # Git klasörü
+        r'(^|/)temp/',        # Geçici klasör
+        r'\/_',               # _ ile başlayan klasör/dosyalar
+        r'\.(png|jpg|jpeg|pdf|drawio)$'  # Resim ve PDF dosyaları
+    ]
+
     try:
-        print("\n[index_task_001] Loading all documents...")
-        documents = embedder.get_documents("obsidian_vault")
-        debug_print_docs(documents, "[LOADED]")
+        if incremental:
+            print("\n[index_task_001] Loading new/changed documents...")
+            documents, stale_node_ids = embedder.get_changed_documents("obsidian_vault")
+            if stale_node_ids:
+                print(f"[index_task_001] {len(stale_node_ids)} eski vektör siliniyor...")
+                chroma_collection.delete(ids=stale_node_ids)
+        else:
+            print("\n[index_task_001] Streaming all documents...")
+            documents = embedder.iter_documents("obsidian_vault")
 
-        print("\n[index_task_002] Applying filters...")
-        documents = embedder.apply_rules(
+        # Dokümanları gruplar halinde filtreleme, işleme ve indeksleme
+        print("\n[index_task_002] Filtering and indexing in batches...")
+        loaded, indexed = index_in_batches(
             documents,
-            inclusion_rules=[
-                r'\.md$',  # Sadece markdown dosyalarını al
-            ],
-            exclusion_rules=[
-                r'(^|/)\.obsidian/',  # Obsidian ayar klasörü
-                r'(^|/)\.trash/',     # Çöp klasörü
-                r'(^|/)\.git/',       # Git klasörü
-                r'(^|/)temp/',        # Geçici klasör
-                r'\/_',               # _ ile başlayan klasör/dosyalar
-                r'\.(png|jpg|jpeg|pdf|drawio)$'  # Resim ve PDF dosyaları
-            ]
-        )
-        debug_print_docs(documents, "[FILTERED]")
-
-        print("\n[index_task_003] Creating vector index...")
-        pipeline = IngestionPipeline(
-            transformations=[
-                SentenceSplitter(
-                    chunk_size=int(os.getenv("CHUNK_SIZE", "512")),
-                    chunk_overlap=int(os.getenv("CHUNK_OVERLAP", "20")),
-                    # Obsidian'ın wikilink formatını dikkate alan ayar
-                    paragraph_separator=r'\n\n|\n-{3,}\n|\[\[.*?\]\]'
-                ),
-                embed_model
-            ],
-            vector_store=vector_store,
+            pipeline,
+            apply_rules=lambda batch: embedder.apply_rules(batch, inclusion_rules, exclusion_rules),
+            batch_size=batch_size,
+            on_nodes=embedder.record_nodes if incremental else None,
+            on_first_batch=lambda batch: debug_print_docs(batch, "[LOADED]")
         )
+        if incremental:
+            embedder.commit_manifest()
 
-        # Dokümanları işleme ve indeksleme
-        pipeline.run(documents=documents)
-        
         print("\n[index_task_004] Indexing stats:")
-        print(f"- Toplam doküman: {len(documents)}")
+        print(f"- Toplam doküman: {loaded} (indekslenen: {indexed})")
         print(f"- Vektör koleksiyonu boyutu: {chroma_collection.count()}")
         print("[SUCCESS] Indexing completed successfully ✅")
 
     except Exception as e:
         print(f"\n[ERROR] Indexing failed: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+    finally:
+        print(f"[embedding_cache] {embedding_cache.report()}")
+        embedding_cache.close()
@@ -1,12 +1,21 @@
-import re
 import os
-from typing import List, Sequence, Pattern
+import sys
+import json
+import hashlib
+from typing import List, Sequence, Optional, Tuple, Dict, Iterator
 from llama_index.core import Document
 from llama_index.core.schema import BaseNode
+# Ortak modüller depo kökündeki common/ paketindedir
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from common.rule_matcher import RuleMatcher
 
 class ObsidianEmbeddingMethod:
-    def __init__(self, vault_path: str):
+    def __init__(self, vault_path: str, manifest_path: Optional[str] = None):
         self.vault_path = vault_path
+        self.manifest_path = manifest_path
+        self.manifest: Dict[str, dict] = self._load_manifest()
+        self._pending_entries: Dict[str, dict] = {}
+        self._removed_paths: List[str] = []
 
     @staticmethod
     def customize_metadata(document: Document, data_source_id: str) -> Document:
@@ -16,15 +25,6 @@ class ObsidianEmbeddingMethod:
         })
         return document
 
-    def _compile_patterns(self, patterns: List[str]) -> List[Pattern]:
-        compiled = []
-        for pattern in patterns:
-            try:
-                compiled.append(re.compile(pattern))
-            except re.error:
-                print(f"Invalid regex pattern: {pattern}")
-        return compiled
-
     def apply_rules(
         self,
         documents: Sequence[Document],
@@ -43,38 +43,21 @@ class ObsidianEmbeddingMethod:
         # Kullanıcının verdiği kuralları varsayılanlarla birleştir
         combined_exclusions = default_obsidian_exclusions + exclusion_rules
 
-        compiled_exclude = self._compile_patterns(combined_exclusions)
-        compiled_include = self._compile_patterns(inclusion_rules)
-
-        filtered_docs = []
+        matcher = RuleMatcher(inclusion_rules, combined_exclusions)
         print("\n[apply_rules] Başlangıç doküman sayısı:", len(documents))
 
-        for doc in documents:
-            file_path = doc.metadata.get("file_path", "")
-            file_ext = doc.metadata.get("file_extension", "")
-
-            # Özel durum: .md uzantılı olmayanları hariç tut (isteğe bağlı)
-            if file_ext != 'md':
-                print(f"[apply_rules] Uzantı filtresi: {file_path} (.md dosyası değil)")
-                continue
-
-            excluded = any(pattern.search(file_path) for pattern in compiled_exclude)
-            included = any(pattern.search(file_path) for pattern in compiled_include) if compiled_include else True
-
-            if excluded:
-                print(f"[apply_rules] Dışlandı: {file_path}")
-                continue
-            if not included:
-                print(f"[apply_rules] Dahil edilmedi: {file_path}")
-                continue
-
-            print(f"[apply_rules] Geçti: {file_path}")
-            filtered_docs.append(doc)
+        # Özel durum: .md uzantılı olmayanları hariç tut (isteğe bağlı)
+        markdown_docs = [doc for doc in documents if doc.metadata.get("file_extension", "") == 'md']
+        if len(markdown_docs) < len(documents):
+            print(f"[apply_rules] Uzantı filtresi: {len(documents) - len(markdown_docs)} dosya (.md dosyası değil)")
 
+        filtered_docs = matcher.filter(markdown_docs, key=lambda doc: doc.metadata.get("file_path", ""))
+        matcher.log_summary()
         return filtered_docs
 
-    def get_documents(self, data_source_id: str) -> List[Document]:
-        documents = []
+    def iter_documents(self, data_source_id: str) -> Iterator[Document]:
+        """Notları kasayı dolaşırken tek tek okur ve üretir"""
+        count = 0
 
         for root, _, files in os.walk(self.vault_path):
             for file_name in files:
@@ -101,10 +84,128 @@ class ObsidianEmbeddingMethod:
                     }
                 )
                 self.customize_metadata(doc, data_source_id)
+                count += 1
+                yield doc
+
+        print(f"[get_documents] Toplam {count} dosya alındı")
+
+    def get_documents(self, data_source_id: str) -> List[Document]:
+        return list(self.iter_documents(data_source_id))
+
+    def _load_manifest(self) -> Dict[str, dict]:
+        """Manifest dosyasını okur: path -> {mtime, size, hash, node_ids}"""
+        if not self.manifest_path or not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"[manifest] Manifest okunamadı, tam indeksleme yapılacak: {str(e)}")
+            return {}
+
+    def save_manifest(self) -> None:
+        if not self.manifest_path:
+            return
+        manifest_dir = os.path.dirname(self.manifest_path)
+        if manifest_dir:
+            os.makedirs(manifest_dir, exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+
+    def get_changed_documents(self, data_source_id: str) -> Tuple[List[Document], List[str]]:
+        """
+        Manifest'e göre yalnızca yeni veya değişmiş notları okur.
+        Dönüş: (indekslenecek dokümanlar, Chroma'dan silinecek node id'leri)
+        """
+        documents = []
+        seen_paths = set()
+        self._pending_entries = {}
+
+        for root, _, files in os.walk(self.vault_path):
+            for file_name in files:
+                if not file_name.lower().endswith(".md"):
+                    continue
+
+                file_path = os.path.join(root, file_name)
+                seen_paths.add(file_path)
+                try:
+                    stat = os.stat(file_path)
+                except OSError as e:
+                    print(f"[get_changed_documents] Dosya bilgisi alınamadı: {file_path}, Hata: {str(e)}")
+                    continue
+
+                entry = self.manifest.get(file_path)
+                # mtime ve boyut aynıysa dosyayı hiç okumadan atla
+                if entry and entry.get("mtime") == stat.st_mtime and entry.get("size") == stat.st_size:
+                    continue
+
+                try:
+                    with open(file_path, "rb") as f:
+                        raw = f.read()
+                    content = raw.decode("utf-8")
+                except Exception as e:
+                    print(f"[get_changed_documents] Dosya okunamadı: {file_path}, Hata: {str(e)}")
+                    continue
+
+                content_hash = hashlib.sha256(raw).hexdigest()
+                if entry and entry.get("hash") == content_hash:
+                    # Sadece zaman damgası değişmiş (ör. touch), içerik aynı
+                    entry.update({"mtime": stat.st_mtime, "size": stat.st_size})
+                    continue
+
+                self._pending_entries[file_path] = {
+                    "mtime": stat.st_mtime,
+                    "size": stat.st_size,
+                    "hash": content_hash,
+                    "node_ids": [],
+                }
+
+                doc = Document(
+                    text=content,
+                    metadata={
+                        "file_path": file_path,
+                        "file_name": file_name,
+                        "file_extension": file_name.split('.')[-1].lower(),
+                        "last_modified": stat.st_mtime
+                    }
+                )
+                self.customize_metadata(doc, data_source_id)
                 documents.append(doc)
 
-        print(f"[get_documents] Toplam {len(documents)} dosya alındı")
-        return documents
+        # Silinen veya yeniden adlandırılan notlar
+        self._removed_paths = [path for path in self.manifest if path not in seen_paths]
+
+        stale_node_ids = []
+        for path in list(self._pending_entries) + self._removed_paths:
+            stale_node_ids.extend(self.manifest.get(path, {}).get("node_ids", []))
+
+        print(
+            f"[get_changed_documents] {len(documents)} yeni/değişmiş, "
+            f"{len(self._removed_paths)} silinmiş not, "
+            f"{len(seen_paths) - len(documents)} değişmemiş not atlandı"
+        )
+        return documents, stale_node_ids
+
+    def record_nodes(self, nodes: Sequence[BaseNode]) -> None:
+        """Bir grupta indekslenen node id'lerini bekleyen manifest kayıtlarına ekler"""
+        for node in nodes:
+            file_path = node.metadata.get("file_path")
+            if file_path in self._pending_entries:
+                self._pending_entries[file_path]["node_ids"].append(node.node_id)
+
+    def commit_manifest(self, nodes: Sequence[BaseNode] = ()) -> None:
+        """İndekslenen node id'lerini manifest'e işler ve diske yazar"""
+        self.record_nodes(nodes)
+
+        for path in self._removed_paths:
+            self.manifest.pop(path, None)
+        self.manifest.update(self._pending_entries)
+
+        self._pending_entries = {}
+        self._removed_paths = []
+        self.save_manifest()
 
     def get_nodes(self, documents: Sequence[Document]) -> Sequence[BaseNode]:
         return []
@@ -1,5 +1,6 @@
+import inspect
 import multiprocessing
-from typing import List, Sequence, Optional
+from typing import List, Sequence, Optional, Iterator
 from llama_index.core import Document
 from llama_index.core.ingestion import IngestionPipeline
 from llama_index.core.node_parser import SentenceSplitter
@@ -36,6 +37,8 @@ class GitHubEmbeddingMethod:
         github_token: Optional[str] = None,
         ignore_directories: Optional[List[str]] = None,
         ignore_file_extensions: Optional[List[str]] = None,
+        inclusion_rules: Optional[List[str]] = None,
+        exclusion_rules: Optional[List[str]] = None,
     ):
         self.owner = owner
         self.repo = repo
@@ -45,6 +48,9 @@ class GitHubEmbeddingMethod:
         self.github_token = github_token
         self.ignore_directories = ignore_directories or []
         self.ignore_file_extensions = ignore_file_extensions or []
+        # Ağaç listesi üzerinde, blob indirilmeden uygulanan kurallar (apply_rules ile aynı anlam)
+        self.inclusion_rules = inclusion_rules or []
+        self.exclusion_rules = exclusion_rules or []
 
     @staticmethod
     def customize_metadata(document: Document, data_source_id: str) -> Document:
@@ -55,6 +61,18 @@ class GitHubEmbeddingMethod:
         }
         return document
 
+    @staticmethod
+    def _path_allowed(file_path: str, file_name: str, inclusion_rules: List[str], exclusion_rules: List[str]) -> bool:
+        file_path = file_path.lower()
+        file_name = file_name.lower()
+
+        # Exclusion kontrolü
+        if any(excl.lower() in file_path or excl.lower() in file_name for excl in exclusion_rules):
+            return False
+
+        # Inclusion kontrolü (eğer inclusion_rules boşsa tümünü kabul et)
+        return not inclusion_rules or any(incl.lower() in file_path or incl.lower() in file_name for incl in inclusion_rules)
+
     def apply_rules(
         self,
         documents: Sequence[Document],
@@ -63,26 +81,39 @@ class GitHubEmbeddingMethod:
     ) -> Sequence[Document]:
         filtered_docs = []
         for doc in documents:
-            file_path = doc.metadata.get("file_path", "").lower()
-            file_name = doc.metadata.get("file_name", "").lower()
-
-            # Exclusion kontrolü
-            if any(excl.lower() in file_path or excl.lower() in file_name for excl in exclusion_rules):
-                continue
-
-            # Inclusion kontrolü (eğer inclusion_rules boşsa tümünü kabul et)
-            if not inclusion_rules or any(incl.lower() in file_path or incl.lower() in file_name for incl in inclusion_rules):
+            file_path = doc.metadata.get("file_path", "")
+            file_name = doc.metadata.get("file_name", "")
+            if self._path_allowed(file_path, file_name, inclusion_rules, exclusion_rules):
                 filtered_docs.append(doc)
 
         print(f"Filtreleme detayı: {len(documents)} -> {len(filtered_docs)} doküman")
         return filtered_docs
 
-    def get_documents(self, data_source_id: str) -> List[Document]:
+    def iter_documents(self, data_source_id: str) -> Iterator[Document]:
+        """
+        GithubRepositoryReader dokümanları tek seferde yükler; burada bunlar
+        filtrelenip tek tek üretilir ve tüketilen doküman listeden bırakılır.
+        """
         github_client = GithubClient(
             github_token=self.github_token,
             verbose=self.verbose
         )
 
+        reader_kwargs = {}
+        prefiltered = False
+        if self.exclusion_rules:
+            if "custom_folder_and_file_filter" in inspect.signature(GithubRepositoryReader.__init__).parameters:
+                # Ağaç gezilirken her klasör ve dosya yolu için çağrılır; reddedilen blob'lar
+                # hiç indirilmez. Dışlanan bir klasörün altındaki dosyalar da dışlanacağından
+                # exclusion kuralları klasörlere de uygulanabilir; inclusion kuralları ise
+                # klasörleri yanlışlıkla eleyeceği için yükleme sonrasına bırakılır.
+                reader_kwargs["custom_folder_and_file_filter"] = lambda file_path: self._path_allowed(
+                    file_path, file_path.split("/")[-1], [], self.exclusion_rules
+                )
+                prefiltered = True
+            else:
+                print("[get_documents] Bu llama-index-readers-github sürümü yol filtresini desteklemiyor; kurallar indirme sonrası uygulanacak")
+
         loader = GithubRepositoryReader(
             github_client=github_client,
             owner=self.owner,
@@ -97,12 +128,20 @@ class GitHubEmbeddingMethod:
                 self.ignore_file_extensions,
                 GithubRepositoryReader.FilterType.EXCLUDE
             ),
+            **reader_kwargs,
         )
 
         documents = loader.load_data(branch=self.branch)
-        for document in documents:
-            self.customize_metadata(document, data_source_id)
-        return documents
+        if self.inclusion_rules or (self.exclusion_rules and not prefiltered):
+            documents = self.apply_rules(documents, self.inclusion_rules, self.exclusion_rules)
+
+        # Sondan pop edilerek her doküman üretildikten sonra listede referansı kalmaz
+        documents = list(reversed(documents))
+        while documents:
+            yield self.customize_metadata(documents.pop(), data_source_id)
+
+    def get_documents(self, data_source_id: str) -> List[Document]:
+        return list(self.iter_documents(data_source_id))
 
     def get_nodes(self, documents: Sequence[Document]) -> Sequence[BaseNode]:
         pipeline = IngestionPipeline(
@@ -140,6 +179,10 @@ class GitHubEmbeddingMethod:
 
             print(f"[{task_id}] Vektör deposuna ekleniyor...")
             vector_store.add(nodes)
+            # Upsert deposu son kaynağın eski parçalarını akış bitince siler
+            flush = getattr(vector_store, "flush", None)
+            if flush is not None:
+                flush()
             task_manager.update_task(task_id, TaskStatus.DONE)
             print(f"[{task_id}] İndeksleme tamamlandı")
         except Exception as e:
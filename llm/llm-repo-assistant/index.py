@@ -1,11 +1,17 @@
 from github_embedding import GitHubEmbeddingMethod
-from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.core.ingestion import IngestionPipeline
 from llama_index.core.node_parser import SentenceSplitter
 import chromadb
 from dotenv import load_dotenv
 import os
+import sys
+# Ortak modüller depo kökündeki common/ paketindedir
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from common.batching import index_in_batches
+from common.embedding_cache import EmbeddingCache, CachedEmbedding
+from common.chroma_upsert import UpsertChromaVectorStore
+
 
 if __name__ == "__main__":
     load_dotenv()
@@ -16,7 +22,15 @@ if __name__ == "__main__":
     # ChromaDB kurulumu
     db = chromadb.PersistentClient(path="./chroma_db")
     chroma_collection = db.get_or_create_collection("github_repos")
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+    # Node id'leri içerikten türetilir; yeniden çalıştırma kopya yerine upsert yapar
+    vector_store = UpsertChromaVectorStore(chroma_collection=chroma_collection, source_key="file_path")
+
+    # Değişmemiş parçalar modele gönderilmeden kalıcı önbellekten alınır
+    embedding_cache = EmbeddingCache(
+        os.environ.get("EMBEDDING_CACHE_PATH", "./chroma_db/embedding_cache.sqlite"),
+        max_bytes=int(os.environ.get("EMBEDDING_CACHE_MAX_MB", "256")) * 1024 * 1024
+    )
+    cached_embed_model = CachedEmbedding(embed_model, embedding_cache)
 
     class SimpleTaskManager:
         def init_task(self, task_id): 
@@ -31,7 +45,8 @@ if __name__ == "__main__":
         branch="main",
         github_token=os.environ.get("GITHUB_TOKEN"),
         ignore_directories=["node_modules", "dist", "tests"],
-        ignore_file_extensions=[".png", ".jpg", ".md"]
+        ignore_file_extensions=[".png", ".jpg", ".md"],
+        exclusion_rules=["test"]  # Blob'lar indirilmeden önce değerlendirilir
     )
 
     try:
@@ -39,26 +54,31 @@ if __name__ == "__main__":
         pipeline = IngestionPipeline(
             transformations=[
                 SentenceSplitter(chunk_size=512, chunk_overlap=20),
-                embed_model  # Embedding modelini doğrudan ekle
+                cached_embed_model
             ],
             vector_store=vector_store,
         )
 
         print(f"[index_task_001] Dokümanlar yükleniyor...")
-        documents = embedder.get_documents("test_repo")
-        print(f"[index_task_001] {len(documents)} doküman yüklendi")
+        documents = embedder.iter_documents("test_repo")
 
-        documents = embedder.apply_rules(
+        print(f"[index_task_001] Dokümanlar gruplar halinde filtrelenip vektör deposuna ekleniyor...")
+        loaded, indexed = index_in_batches(
             documents,
-            inclusion_rules=[],  
-            exclusion_rules=["test"]  
+            pipeline,
+            apply_rules=lambda batch: embedder.apply_rules(
+                batch,
+                inclusion_rules=[],
+                exclusion_rules=["test"]
+            ),
+            batch_size=int(os.environ.get("INDEX_BATCH_SIZE", "64"))
         )
-        print(f"[index_task_001] {len(documents)} doküman filtreleme sonrası")
-
-        print(f"[index_task_001] Düğümler oluşturuluyor ve vektör deposuna ekleniyor...")
-        pipeline.run(documents=documents)
+        print(f"[index_task_001] {loaded} doküman yüklendi, {indexed} doküman filtreleme sonrası indekslendi")
         
         print(f"[index_task_001] İndeksleme tamamlandı")
         print("Indexleme başarıyla tamamlandı!")
     except Exception as e:
-        print(f"Indexleme hatası: {str(e)}")
\ No newline at end of file
+        print(f"Indexleme hatası: {str(e)}")
+    finally:
+        print(f"[embedding_cache] {embedding_cache.report()}")
+        embedding_cache.close()
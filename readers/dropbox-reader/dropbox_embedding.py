@@ -1,11 +1,198 @@
-import re
 import io
-from typing import List, Sequence, Optional, Pattern
+import os
+import sys
+import json
+import time
+import queue
+import signal
+import tempfile
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, Sequence, Optional, Tuple, Dict, Callable, Iterable, Iterator
 from llama_index.core import Document
 from llama_index.core.schema import BaseNode
 from dropbox import Dropbox
-from dropbox.files import FileMetadata
+from dropbox.files import FileMetadata, DeletedMetadata
 import dropbox
+# Ortak modüller depo kökündeki common/ paketindedir
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from common.rule_matcher import RuleMatcher
+
+BINARY_EXTENSIONS = ['pdf', 'docx', 'xlsx']
+TEXT_EXTENSIONS = ['txt', 'log', 'md', 'csv']
+
+
+def iter_xlsx_segments(content: bytes, rows_per_document: int = 1000) -> Iterator[Tuple[str, dict]]:
+    """
+    Çalışma kitabını read-only modda satır satır okur ve her sayfayı
+    rows_per_document satırlık bloklara böler. Her blok hazır olduğunda verilir;
+    ne kitap ne de blokların tamamı belleğe alınır.
+    Üretilen: (metin, {"sheet_name", "row_start", "row_end"})
+    """
+    from openpyxl import load_workbook
+    wb = load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+    try:
+        for sheet in wb.worksheets:
+            lines = []
+            block_start = 1
+            row_number = 0
+            for row_number, row in enumerate(sheet.iter_rows(values_only=True), start=1):
+                # 0 ve False da değerdir; yalnızca boş hücreler atlanır
+                line = " ".join(str(cell) for cell in row if cell is not None)
+                if line:
+                    lines.append(line)
+                if row_number - block_start + 1 >= rows_per_document:
+                    if lines:
+                        yield "\n".join(lines), {
+                            "sheet_name": sheet.title, "row_start": block_start, "row_end": row_number
+                        }
+                    lines = []
+                    block_start = row_number + 1
+            if lines:
+                yield "\n".join(lines), {
+                    "sheet_name": sheet.title, "row_start": block_start, "row_end": row_number
+                }
+    finally:
+        wb.close()
+
+
+def extract_xlsx_segments(content: bytes, rows_per_document: int = 1000) -> List[Tuple[str, dict]]:
+    return list(iter_xlsx_segments(content, rows_per_document))
+
+
+def _pdf_page_text(layout) -> str:
+    from pdfminer.layout import LTTextContainer
+    return "".join(element.get_text() for element in layout if isinstance(element, LTTextContainer))
+
+
+def iter_pdf_page_segments(content: bytes, pages_per_document: int) -> Iterator[Tuple[str, dict]]:
+    """
+    PDF'i pdfminer ile sayfa sayfa düzenler (extract_pages bir üreteçtir) ve
+    her pages_per_document sayfayı ayrı bir parça olarak verir.
+    Üretilen: (metin, {"page_number", "page_start", "page_end"})
+    """
+    from pdfminer.high_level import extract_pages
+
+    pages = []
+    block_start = 1
+    page_number = 0
+    for page_number, layout in enumerate(extract_pages(io.BytesIO(content)), start=1):
+        pages.append(_pdf_page_text(layout))
+        if page_number - block_start + 1 >= pages_per_document:
+            yield "\n".join(pages), {"page_number": block_start, "page_start": block_start, "page_end": page_number}
+            pages = []
+            block_start = page_number + 1
+    if pages:
+        yield "\n".join(pages), {"page_number": block_start, "page_start": block_start, "page_end": page_number}
+
+
+def count_pdf_pages(content: bytes) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(io.BytesIO(content)).pages)
+
+
+def spool_pdf_page_range(spool_path: str, pdf_path: str, start: int, end: int) -> None:
+    """
+    Process pool'da çalışır: PDF'in start..end (1 tabanlı, dahil) sayfalarını tek
+    parça olarak spool_path'e yazar. Her sayfa aralığı ayrı bir iştir; PDF
+    içeriği işlere kopyalanmaz, ortak geçici dosyadan okunur.
+    """
+    from pdfminer.high_level import extract_pages
+    try:
+        with open(pdf_path, "rb") as pdf:
+            text = "\n".join(_pdf_page_text(layout) for layout in extract_pages(pdf, page_numbers=range(start - 1, end)))
+    except Exception as e:
+        print(f"Binary dosya işleme hatası (sayfa {start}-{end}): {str(e)}")
+        text = ""
+    with open(spool_path, "w", encoding="utf-8") as spool:
+        metadata = {"page_number": start, "page_start": start, "page_end": end}
+        spool.write(json.dumps([text, metadata], ensure_ascii=False) + "\n")
+
+
+def iter_binary_segments(
+    content: bytes,
+    file_ext: str,
+    rows_per_document: int = 1000,
+    pdf_pages_per_document: int = 0,
+) -> Iterator[Tuple[str, dict]]:
+    """
+    Binary dosyaları işler (PDF, DOCX, XLSX) ve parçaları üretildikçe verir.
+    Üretilen: (metin, ek metadata); XLSX için sayfa/satır bloğu, pdf_pages_per_document > 0
+    ise PDF sayfa aralığı başına bir parça.
+    """
+    try:
+        if file_ext == 'pdf':
+            if pdf_pages_per_document:
+                yield from iter_pdf_page_segments(content, pdf_pages_per_document)
+                return
+            from pdfminer.high_level import extract_text
+            yield extract_text(io.BytesIO(content)), {}
+        elif file_ext == 'docx':
+            from docx import Document as DocxDocument
+            doc = DocxDocument(io.BytesIO(content))
+            yield "\n".join([para.text for para in doc.paragraphs]), {}
+        elif file_ext == 'xlsx':
+            yield from iter_xlsx_segments(content, rows_per_document)
+        else:
+            raise ValueError(f"Desteklenmeyen dosya uzantısı: {file_ext}")
+    except Exception as e:
+        print(f"Binary dosya işleme hatası: {str(e)}")
+
+
+def extract_binary_segments(
+    content: bytes,
+    file_ext: str,
+    rows_per_document: int = 1000,
+    pdf_pages_per_document: int = 0,
+) -> List[Tuple[str, dict]]:
+    return list(iter_binary_segments(content, file_ext, rows_per_document, pdf_pages_per_document))
+
+
+def spool_binary_segments(
+    spool_path: str,
+    content: bytes,
+    file_ext: str,
+    rows_per_document: int = 1000,
+    pdf_pages_per_document: int = 0,
+) -> None:
+    """
+    Process pool'da çalışır (bu yüzden modül seviyesindedir). Parçaları üretildikçe
+    spool_path'e JSON Lines olarak yazar; sonuç süreçler arasında tek parça halinde
+    taşınmaz, ana süreç dosyayı read_spooled_segments ile satır satır okur.
+    """
+    with open(spool_path, "w", encoding="utf-8") as spool:
+        for text, metadata in iter_binary_segments(content, file_ext, rows_per_document, pdf_pages_per_document):
+            spool.write(json.dumps([text, metadata], ensure_ascii=False) + "\n")
+
+
+def read_spooled_segments(spool_path: str) -> Iterator[Tuple[str, dict]]:
+    """spool_binary_segments çıktısını parça parça okur; dosya okuma bitince silinir"""
+    try:
+        with open(spool_path, "r", encoding="utf-8") as spool:
+            for line in spool:
+                text, metadata = json.loads(line)
+                yield text, metadata
+    finally:
+        _remove_temp_file(spool_path)
+
+
+def _remove_temp_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _register_worker(pids) -> None:
+    """Process pool initializer'ı; takılan bir işin worker'ı sonlandırılabilsin diye PID'i bildirir"""
+    pids.put(os.getpid())
+
+
+def extract_binary_text(content: bytes, file_ext: str) -> str:
+    """Binary dosyaları işler (PDF, DOCX, XLSX)"""
+    return "\n".join(text for text, _ in extract_binary_segments(content, file_ext))
 
 
 class DropboxEmbeddingMethod:
@@ -13,9 +200,32 @@ class DropboxEmbeddingMethod:
         self,
         access_token: str,
         root_path: Optional[str] = "",
+        state_path: Optional[str] = None,
+        extract_workers: Optional[int] = None,
+        extract_timeout: int = 120,
+        xlsx_rows_per_document: int = 1000,
+        pdf_pages_per_document: int = 0,
+        inclusion_rules: Optional[List[str]] = None,
+        exclusion_rules: Optional[List[str]] = None,
+        max_file_size: Optional[int] = None,
     ):
         self.access_token = access_token
         self.root_path = root_path.rstrip("/")
+        self.state_path = state_path
+        self.extract_workers = extract_workers or os.cpu_count() or 1
+        self.extract_timeout = extract_timeout
+        self.xlsx_rows_per_document = xlsx_rows_per_document
+        # 0: PDF başına tek doküman; N > 0: her N sayfa ayrı doküman
+        self.pdf_pages_per_document = max(0, pdf_pages_per_document)
+        self._pending_cursor: Optional[str] = None
+        self._pending_files: Optional[Dict[str, dict]] = None
+        self.pending_copies: List[Document] = []
+        self._copy_entries: Dict[str, FileMetadata] = {}
+        # Listeleme aşamasında, içerik indirilmeden uygulanan kurallar
+        self.inclusion_rules = inclusion_rules or []
+        self.exclusion_rules = exclusion_rules or []
+        self.max_file_size = max_file_size
+        self._listing_rules = RuleMatcher(self.inclusion_rules, self.exclusion_rules)
 
     @staticmethod
     def customize_metadata(document: Document, data_source_id: str) -> Document:
@@ -25,38 +235,15 @@ class DropboxEmbeddingMethod:
         })
         return document
 
-    def _compile_patterns(self, patterns: List[str]) -> List[Pattern]:
-        compiled = []
-        for pattern in patterns:
-            try:
-                compiled.append(re.compile(pattern))
-            except re.error:
-                print(f"Invalid regex pattern: {pattern}")
-        return compiled
+    def _listing_allowed(self, entry: FileMetadata) -> bool:
+        """Yol kuralları ve boyut sınırı, listeleme metadata'sı üzerinden indirmeden önce değerlendirilir"""
+        if self.max_file_size is not None and entry.size > self.max_file_size:
+            return False
+        return self._listing_rules.allowed(entry.path_display)
 
     def _process_binary_file(self, content: bytes, file_ext: str) -> str:
         """Binary dosyaları işler (PDF, DOCX, XLSX)"""
-        try:
-            if file_ext == 'pdf':
-                from pdfminer.high_level import extract_text
-                return extract_text(io.BytesIO(content))
-            elif file_ext == 'docx':
-                from docx import Document as DocxDocument
-                doc = DocxDocument(io.BytesIO(content))
-                return "\n".join([para.text for para in doc.paragraphs])
-            elif file_ext == 'xlsx':
-                from openpyxl import load_workbook
-                wb = load_workbook(io.BytesIO(content))
-                text = ""
-                for sheet in wb:
-                    for row in sheet.iter_rows(values_only=True):
-                        text += " ".join(str(cell) for cell in row if cell) + "\n"
-                return text
-            else:
-                raise ValueError(f"Desteklenmeyen dosya uzantısı: {file_ext}")
-        except Exception as e:
-            print(f"Binary dosya işleme hatası: {str(e)}")
-            return ""
+        return extract_binary_text(content, file_ext)
 
     def apply_rules(
         self,
@@ -64,32 +251,310 @@ class DropboxEmbeddingMethod:
         inclusion_rules: List[str],
         exclusion_rules: List[str],
     ) -> Sequence[Document]:
-        compiled_exclude = self._compile_patterns(exclusion_rules)
-        compiled_include = self._compile_patterns(inclusion_rules)
-
-        filtered_docs = []
+        matcher = RuleMatcher(inclusion_rules, exclusion_rules)
         print("\n[apply_rules] Başlangıç doküman sayısı:", len(documents))
+        filtered_docs = matcher.filter(documents, key=lambda doc: doc.metadata.get("file_path", ""))
+        matcher.log_summary()
+        return filtered_docs
 
-        for doc in documents:
-            file_path = doc.metadata.get("file_path", "")
-            excluded = any(pattern.search(file_path) for pattern in compiled_exclude)
-            included = any(pattern.search(file_path) for pattern in compiled_include) if compiled_include else True
+    def _download(self, dbx: Dropbox, file_path: str) -> Optional[bytes]:
+        try:
+            _, response = dbx.files_download(file_path)
+            return response.content
+        except Exception as e:
+            print(f"[get_documents] Error downloading {file_path}: {str(e)}")
+            return None
 
-            if excluded:
-                print(f"[apply_rules] Dışlandı: {file_path}")
-                continue
-            if not included:
-                print(f"[apply_rules] Dahil edilmedi: {file_path}")
+    def _decode_text(self, file_path: str, file_ext: str, content: bytes) -> Optional[str]:
+        """Metin dosyalarını çözer; binary dosyalar için None döner"""
+        try:
+            return content.decode('utf-8-sig')  # Türkçe karakter desteği
+        except UnicodeDecodeError:
+            if file_ext in TEXT_EXTENSIONS:
+                try:
+                    return content.decode('latin1')
+                except Exception as e:
+                    print(f"[get_documents] Text dosya decode hatası: {file_path} - {str(e)}")
+                    return None
+            if file_ext not in BINARY_EXTENSIONS:
+                print(f"[get_documents] Desteklenmeyen binary dosya: {file_path}")
+            return None
+
+    def _iter_entry_documents(
+        self, entry: FileMetadata, segments: Iterable[Tuple[str, dict]], data_source_id: str
+    ) -> Iterator[Document]:
+        """Parçaları okundukça dokümana çevirir (XLSX satır bloğu / PDF sayfa aralığı başına bir doküman)"""
+        count = 0
+        file_name = entry.name
+        for text_content, extra_metadata in segments:
+            if not text_content.strip():
                 continue
+            doc = Document(
+                text=text_content,
+                metadata={
+                    "file_path": entry.path_display,
+                    "file_name": file_name,
+                    "file_extension": file_name.split('.')[-1].lower() if '.' in file_name else '',
+                    "last_modified": entry.client_modified.isoformat(),
+                    "content_hash": entry.content_hash,
+                    **extra_metadata
+                }
+            )
+            # Hash yalnızca senkronizasyon için; embedding metnine girmesin
+            doc.excluded_embed_metadata_keys.append("content_hash")
+            doc.excluded_llm_metadata_keys.append("content_hash")
+            self.customize_metadata(doc, data_source_id)
+            count += 1
+            yield doc
 
-            print(f"[apply_rules] Geçti: {file_path}")
-            filtered_docs.append(doc)
+        if not count:
+            print(f"[get_documents] Boş içerik: {entry.path_display}")
 
-        return filtered_docs
+    def _make_documents(self, entry: FileMetadata, segments: Iterable[Tuple[str, dict]], data_source_id: str) -> List[Document]:
+        return list(self._iter_entry_documents(entry, segments, data_source_id))
 
-    def get_documents(self, data_source_id: str) -> List[Document]:
+    def _entry_to_documents(self, entry: FileMetadata, content: bytes, data_source_id: str) -> List[Document]:
+        """Tek bir dosyayı aynı thread'de işler"""
+        file_ext = entry.name.split('.')[-1].lower() if '.' in entry.name else ''
+        text_content = self._decode_text(entry.path_display, file_ext, content)
+        if text_content is not None:
+            return self._make_documents(entry, [(text_content, {})], data_source_id)
+        if file_ext in BINARY_EXTENSIONS:
+            print(f"[get_documents] Binary dosya işleniyor: {entry.path_display}")
+            segments = extract_binary_segments(content, file_ext, self.xlsx_rows_per_document,
+                                               self.pdf_pages_per_document)
+            return self._make_documents(entry, segments, data_source_id)
+        return []
+
+    def _new_extract_pool(self) -> Tuple[ProcessPoolExecutor, "multiprocessing.SimpleQueue"]:
+        """Havuz ve worker'larının başlarken PID'lerini yazdığı kuyruk"""
+        pids = multiprocessing.SimpleQueue()
+        pool = ProcessPoolExecutor(max_workers=self.extract_workers, initializer=_register_worker, initargs=(pids,))
+        return pool, pids
+
+    @staticmethod
+    def _kill_pool(pool: ProcessPoolExecutor, pids: "multiprocessing.SimpleQueue") -> None:
+        """Takılan bir extraction işlemini durdurmak için havuzu kapatır ve worker'larını sonlandırır"""
+        pool.shutdown(wait=False, cancel_futures=True)
+        while not pids.empty():
+            try:
+                os.kill(pids.get(), signal.SIGTERM)
+            except OSError:
+                pass  # Worker zaten çıkmış
+
+    def _iter_fetched_documents(
+        self,
+        dbx: Dropbox,
+        entries: Iterable[FileMetadata],
+        data_source_id: str,
+        failed: Optional[List[FileMetadata]] = None,
+    ) -> Iterator[Document]:
+        """
+        İndirme ve metin çıkarma işlemlerini ayırır: bir thread dosyaları indirip
+        kuyruğa koyar, binary dosyalar (PDF/DOCX/XLSX) process pool'da paralel
+        işlenir ve parçalarını geçici dosyaya yazar. Dokümanlar hazır oldukça,
+        ancak girdi sırasıyla ve parça parça üretilir; indirilemeyen kayıtlar
+        failed listesine eklenir.
+        """
+        # Sıra birimi "slot"tur: dosya başına bir slot, sayfa aralıklarına bölünen PDF'lerde
+        # aralık başına bir slot. slot -> (kayıt, parçalar); atlananlarda parçalar None'dır
+        segments: Dict[int, Tuple[FileMetadata, Optional[Iterable[Tuple[str, dict]]]]] = {}
+        # slot -> worker'ın parçaları yazdığı geçici dosya
+        spool_paths: Dict[int, str] = {}
+        # Sayfa aralığı işlerinin okuduğu geçici PDF -> henüz toplanmamış iş sayısı
+        pdf_jobs_left: Dict[str, int] = {}
+        next_slot = 0
+        next_emit = 0
+        # Hem kuyruk hem de havuzdaki işler sınırlı tutulur; bellekteki indirilmiş içerik sabit kalır
+        max_in_flight = self.extract_workers * 2
+        download_queue: queue.Queue = queue.Queue(maxsize=max_in_flight)
+        stop = threading.Event()
+        in_flight: deque = deque()  # (slot, entry, (fn, args, pdf_path), future, gönderilme zamanı)
+        finished_at: Dict[Future, float] = {}
+        # Toplanan (kendisinden önce gönderilmiş) işlerin en geç bitiş zamanı
+        earlier_finished = 0.0
+        pool, pids = self._new_extract_pool()
+
+        def put(item) -> bool:
+            """Tüketici durursa (hata ya da erken kapatma) beklemeyi bırakır"""
+            while not stop.is_set():
+                try:
+                    download_queue.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def downloader():
+            try:
+                for entry in entries:
+                    if stop.is_set() or not put((entry, self._download(dbx, entry.path_display))):
+                        return
+            except Exception as e:
+                print(f"[get_documents] Listeleme hatası: {str(e)}")
+            finally:
+                put(None)
+
+        def new_slot() -> int:
+            nonlocal next_slot
+            next_slot += 1
+            return next_slot - 1
+
+        def submit(slot: int, job: tuple) -> Tuple[Future, float]:
+            fn, args, _ = job
+            if slot not in spool_paths:
+                fd, spool_paths[slot] = tempfile.mkstemp(prefix="dropbox-extract-", suffix=".jsonl")
+                os.close(fd)
+            future = pool.submit(fn, spool_paths[slot], *args)
+            future.add_done_callback(lambda done: finished_at.__setitem__(done, time.monotonic()))
+            return future, time.monotonic()
+
+        def enqueue(entry: FileMetadata, job: tuple) -> None:
+            slot = new_slot()
+            in_flight.append((slot, entry, job, *submit(slot, job)))
+
+        def collect_oldest():
+            nonlocal pool, pids, earlier_finished
+            slot, entry, (_, _, pdf_path), future, submitted = in_flight.popleft()
+            segments[slot] = (entry, None)
+            # Önceki işlerin hepsi bittiğinde bu iş kesin başlamıştır; süre tüketicinin
+            # beklemeye başladığı andan değil, o andan ölçülür
+            deadline = max(submitted, earlier_finished) + self.extract_timeout
+            try:
+                future.result(timeout=max(0.0, deadline - time.monotonic()))
+                segments[slot] = (entry, read_spooled_segments(spool_paths[slot]))
+            except FutureTimeoutError:
+                print(f"[get_documents] Zaman aşımı ({self.extract_timeout}s), atlandı: {entry.path_display}")
+                # Takılan işlemi öldür, bitmemiş işleri yeni havuza yeniden gönder
+                self._kill_pool(pool, pids)
+                pool, pids = self._new_extract_pool()
+                for position, (j_slot, j_entry, j_job, j_future, _) in enumerate(in_flight):
+                    if not j_future.done() or j_future.cancelled() or j_future.exception() is not None:
+                        finished_at.pop(j_future, None)
+                        in_flight[position] = (j_slot, j_entry, j_job, *submit(j_slot, j_job))
+            except Exception as e:
+                print(f"[get_documents] Error processing {entry.path_display}: {str(e)}")
+            finally:
+                earlier_finished = max(earlier_finished, finished_at.pop(future, time.monotonic()))
+                if pdf_path is not None:
+                    pdf_jobs_left[pdf_path] -= 1
+                    if not pdf_jobs_left[pdf_path]:
+                        del pdf_jobs_left[pdf_path]
+                        _remove_temp_file(pdf_path)
+
+        def ready() -> Iterator[Document]:
+            """Sıradaki slottan başlayarak tamamlanmış olanları parça parça dokümana çevirir"""
+            nonlocal next_emit
+            while next_emit in segments:
+                slot = next_emit
+                entry, entry_segments = segments.pop(slot)
+                next_emit += 1
+                if entry_segments is not None:
+                    yield from self._iter_entry_documents(entry, entry_segments, data_source_id)
+                if slot in spool_paths:
+                    _remove_temp_file(spool_paths.pop(slot))
+
+        def drain() -> Iterator[Document]:
+            # Yavaş bir binary dosyanın arkasında biriken metin dosyaları da sınırlanır
+            while in_flight and (len(in_flight) >= max_in_flight or len(segments) >= max_in_flight):
+                collect_oldest()
+                yield from ready()
+            yield from ready()
+
+        def page_ranges(content: bytes) -> Optional[List[Tuple[int, int]]]:
+            try:
+                page_count = count_pdf_pages(content)
+            except Exception as e:
+                print(f"[get_documents] PDF sayfa sayısı okunamadı, dosya tek işte işlenecek: {str(e)}")
+                return None
+            step = self.pdf_pages_per_document
+            return [(start, min(start + step - 1, page_count)) for start in range(1, page_count + 1, step)]
+
+        download_thread = threading.Thread(target=downloader, daemon=True)
+        download_thread.start()
+
+        try:
+            while True:
+                item = download_queue.get()
+                if item is None:
+                    break
+                entry, content = item
+                if content is None:
+                    if failed is not None:
+                        failed.append(entry)
+                    segments[new_slot()] = (entry, None)
+                    yield from ready()
+                    continue
+
+                file_ext = entry.name.split('.')[-1].lower() if '.' in entry.name else ''
+                text_content = self._decode_text(entry.path_display, file_ext, content)
+                if text_content is not None:
+                    segments[new_slot()] = (entry, [(text_content, {})])
+                elif file_ext in BINARY_EXTENSIONS:
+                    ranges = page_ranges(content) if file_ext == 'pdf' and self.pdf_pages_per_document else None
+                    if ranges:
+                        # Her sayfa aralığı ayrı bir iş; aralıklar paralel işlenir ve bittikçe sırayla verilir
+                        print(f"[get_documents] PDF {len(ranges)} sayfa aralığında işleniyor: {entry.path_display}")
+                        fd, pdf_path = tempfile.mkstemp(prefix="dropbox-extract-", suffix=".pdf")
+                        with os.fdopen(fd, "wb") as pdf:
+                            pdf.write(content)
+                        pdf_jobs_left[pdf_path] = len(ranges)
+                        for start, end in ranges:
+                            enqueue(entry, (spool_pdf_page_range, (pdf_path, start, end), pdf_path))
+                            yield from drain()
+                        continue
+                    print(f"[get_documents] Binary dosya işleniyor: {entry.path_display}")
+                    enqueue(entry, (spool_binary_segments, (content, file_ext, self.xlsx_rows_per_document,
+                                                            self.pdf_pages_per_document), None))
+                else:
+                    segments[new_slot()] = (entry, None)
+                yield from drain()
+
+            while in_flight:
+                collect_oldest()
+                yield from ready()
+        finally:
+            # İndirici kuyrukta beklerken tüketici durduysa serbest kalır ve bağlantısını bırakır
+            stop.set()
+            download_thread.join()
+            if in_flight:
+                # Erken kapatma: çalışan işler durdurulur, silinen dosyalara yazmaya devam etmesinler
+                self._kill_pool(pool, pids)
+            else:
+                pool.shutdown(wait=False, cancel_futures=True)
+            # Erken kapatmada okunmamış kalan parça dosyaları ve geçici PDF'ler
+            for temp_path in [*spool_paths.values(), *pdf_jobs_left]:
+                _remove_temp_file(temp_path)
+
+    def _fetch_documents(
+        self,
+        dbx: Dropbox,
+        entries: List[FileMetadata],
+        data_source_id: str,
+    ) -> Tuple[List[Document], List[FileMetadata]]:
+        """Dönüş: (dokümanlar, indirilemeyen kayıtlar)"""
+        failed: List[FileMetadata] = []
+        documents = list(self._iter_fetched_documents(dbx, entries, data_source_id, failed))
+        return documents, failed
+
+    def _iter_listing(self, dbx: Dropbox, result) -> Iterator[FileMetadata]:
+        """Listeleme sayfalarını ihtiyaç duyuldukça çeker"""
+        while True:
+            for entry in result.entries:
+                if isinstance(entry, FileMetadata) and self._listing_allowed(entry):
+                    yield entry
+
+            if not result.has_more:
+                break
+            result = dbx.files_list_folder_continue(result.cursor)
+
+    def iter_documents(self, data_source_id: str) -> Iterator[Document]:
+        """
+        Listeleme, indirme ve çıkarma akış halinde yapılır; dokümanlar hazır oldukça üretilir.
+        Hash indeksinde içeriği değişmemiş görünen dosyalar indirilmez; güncellenen
+        indeks commit_sync_state ile kaydedilir (kayıtlı cursor olduğu gibi kalır).
+        """
         dbx = Dropbox(self.access_token)
-        documents = []
 
         try:
             if self.root_path:
@@ -98,64 +563,326 @@ class DropboxEmbeddingMethod:
                 result = dbx.files_list_folder(path="", recursive=True)
         except Exception as e:
             print(f"Error accessing Dropbox: {str(e)}")
-            return documents
+            return
 
-        # Process all files
-        while True:
-            for entry in result.entries:
-                if not isinstance(entry, FileMetadata):
+        saved = self._saved_state()
+        files: Dict[str, dict] = saved["files"]
+        self._pending_cursor = saved.get("cursor")
+        self._pending_files = files
+        self.pending_copies = []
+        failed: List[FileMetadata] = []
+        unchanged = 0
+
+        def changed_entries(entries: Iterable[FileMetadata]) -> Iterator[FileMetadata]:
+            nonlocal unchanged
+            for entry in entries:
+                known = files.get(entry.path_lower)
+                if known and known.get("content_hash") == entry.content_hash:
+                    unchanged += 1
                     continue
+                files[entry.path_lower] = {"path": entry.path_display, "content_hash": entry.content_hash, "chunk_ids": []}
+                yield entry
 
-                file_path = entry.path_display
-                file_name = entry.name
-                file_ext = file_name.split('.')[-1].lower() if '.' in file_name else ''
+        count = 0
+        entries = changed_entries(self._iter_listing(dbx, result))
+        for doc in self._iter_fetched_documents(dbx, entries, data_source_id, failed):
+            count += 1
+            yield doc
 
-                try:
-                    _, response = dbx.files_download(file_path)
-                    content = response.content
-
-                    # Text veya binary dosya işleme
-                    try:
-                        text_content = content.decode('utf-8-sig')  # Türkçe karakter desteği
-                    except UnicodeDecodeError:
-                        if file_ext in ['pdf', 'docx', 'xlsx']:
-                            print(f"[get_documents] Binary dosya işleniyor: {file_path}")
-                            text_content = self._process_binary_file(content, file_ext)
-                            if not text_content.strip():
-                                print(f"[get_documents] Boş içerik: {file_path}")
-                                continue
-                        elif file_ext in ['txt', 'log', 'md', 'csv']:
-                            try:
-                                text_content = content.decode('latin1')
-                            except Exception as e:
-                                print(f"[get_documents] Text dosya decode hatası: {file_path} - {str(e)}")
-                                continue
-                        else:
-                            print(f"[get_documents] Desteklenmeyen binary dosya: {file_path}")
+        for entry in failed:
+            # Geçici hata: bir sonraki senkronizasyonda yeniden denensin
+            files.pop(entry.path_lower, None)
+        print(f"[get_documents] {unchanged} dosya içerik hash'i değişmediği için indirilmedi")
+        print(f"[get_documents] Toplam {count} dosya alındı")
+
+    def get_documents(self, data_source_id: str) -> List[Document]:
+        return list(self.iter_documents(data_source_id))
+
+    def _load_sync_state(self) -> Dict[str, dict]:
+        if not self.state_path or not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"[sync_state] Durum dosyası okunamadı: {str(e)}")
+            return {}
+
+    def commit_sync_state(self) -> None:
+        """İndeksleme başarılı olduktan sonra cursor'ı ve hash indeksini root_path için kaydeder"""
+        if not self.state_path or (self._pending_cursor is None and self._pending_files is None):
+            return
+        state = self._load_sync_state()
+        state[self.root_path or "/"] = {
+            "cursor": self._pending_cursor,
+            "files": self._pending_files or {},
+        }
+        state_dir = os.path.dirname(self.state_path)
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+        self._pending_cursor = None
+        self._pending_files = None
+
+    def _saved_state(self) -> dict:
+        saved = self._load_sync_state().get(self.root_path or "/", {})
+        # path_lower -> {"path", "content_hash", "chunk_ids"}
+        saved["files"] = {
+            path_lower: {"path": entry} if isinstance(entry, str) else entry
+            for path_lower, entry in saved.get("files", {}).items()
+        }
+        return saved
+
+    def _process_entry(
+        self,
+        dbx: Dropbox,
+        entry: FileMetadata,
+        files: Dict[str, dict],
+        hash_owners: Dict[str, str],
+        data_source_id: str,
+        to_fetch: List[FileMetadata],
+        stale_paths: List[str],
+    ) -> None:
+        """
+        Bir FileMetadata kaydını hash indeksine göre işler:
+        - içerik değişmediyse hiç indirmez,
+        - aynı içerik başka bir yolda zaten gömülmüşse indirmeden paylaşılmak üzere işaretler,
+        - aksi halde indirilecekler listesine ekler.
+        """
+        known = files.get(entry.path_lower)
+        if known and known.get("content_hash") == entry.content_hash:
+            return
+
+        if known:
+            stale_paths.append(known["path"])
+        files[entry.path_lower] = {"path": entry.path_display, "content_hash": entry.content_hash, "chunk_ids": []}
+
+        owner = hash_owners.get(entry.content_hash)
+        if owner and owner != entry.path_lower:
+            # Metin boş; yalnızca apply_rules ve embedding kopyalama için metadata taşır
+            copy = Document(
+                text="",
+                metadata={
+                    "file_path": entry.path_display,
+                    "file_name": entry.name,
+                    "file_extension": entry.name.split('.')[-1].lower() if '.' in entry.name else '',
+                    "last_modified": entry.client_modified.isoformat(),
+                    "content_hash": entry.content_hash,
+                    "shared_from": owner,
+                }
+            )
+            self.customize_metadata(copy, data_source_id)
+            self.pending_copies.append(copy)
+            self._copy_entries[entry.path_lower] = entry
+            return
+
+        hash_owners[entry.content_hash] = entry.path_lower
+        to_fetch.append(entry)
+
+    @staticmethod
+    def _hash_owners(files: Dict[str, dict]) -> Dict[str, str]:
+        """content_hash -> parçaları Chroma'da bulunan bir dosya yolu"""
+        owners = {}
+        for path_lower, entry in files.items():
+            if entry.get("content_hash") and entry.get("chunk_ids"):
+                owners.setdefault(entry["content_hash"], path_lower)
+        return owners
+
+    def get_changed_documents(self, data_source_id: str) -> Tuple[List[Document], Optional[List[str]]]:
+        """
+        Kayıtlı cursor'dan itibaren yalnızca delta kayıtlarını işler; içerik
+        hash'i değişmemiş dosyalar indirilmez.
+        Dönüş: (indekslenecek dokümanlar, vektörleri silinecek dosya yolları).
+        Silinecek yollar None ise ilk tam tarama yapılmıştır ve veri kaynağının
+        tüm eski vektörleri silinmelidir. Aynı içeriğe sahip dosyalar için
+        pending_copies doldurulur (bkz. apply_shared_embeddings).
+        """
+        dbx = Dropbox(self.access_token)
+        saved = self._saved_state()
+        files: Dict[str, dict] = saved["files"]
+        had_index = bool(files) or bool(saved.get("cursor"))
+        hash_owners = self._hash_owners(files)
+        to_fetch: List[FileMetadata] = []
+        stale_paths: List[str] = []
+        self.pending_copies = []
+        self._copy_entries = {}
+
+        result = None
+        cursor = saved.get("cursor")
+        if cursor:
+            try:
+                result = dbx.files_list_folder_continue(cursor)
+            except Exception as e:
+                # Süresi dolmuş cursor (reset) durumunda tam taramaya dön
+                print(f"[get_changed_documents] Cursor kullanılamadı, tam tarama yapılıyor: {str(e)}")
+
+        if result is None:
+            # Tam tarama; hash indeksi varsa değişmeyen dosyalar yine indirilmez
+            try:
+                result = dbx.files_list_folder(path=self.root_path, recursive=True)
+            except Exception as e:
+                print(f"Error accessing Dropbox: {str(e)}")
+                return [], []
+            seen = set()
+            while True:
+                for entry in result.entries:
+                    # Filtrelenen dosyalar "görülmemiş" sayılır; önceden indekslendilerse vektörleri silinir
+                    if isinstance(entry, FileMetadata) and self._listing_allowed(entry):
+                        seen.add(entry.path_lower)
+                        self._process_entry(dbx, entry, files, hash_owners, data_source_id, to_fetch, stale_paths)
+                if not result.has_more:
+                    break
+                result = dbx.files_list_folder_continue(result.cursor)
+
+            for path_lower in [p for p in files if p not in seen]:
+                stale_paths.append(files.pop(path_lower)["path"])
+            if not had_index:
+                stale_paths = None
+        else:
+            while True:
+                for entry in result.entries:
+                    if isinstance(entry, DeletedMetadata):
+                        # Silinen bir klasör alt öğeleri ayrıca listelenmeden gelir
+                        prefix = entry.path_lower + "/"
+                        for path_lower in [p for p in files if p == entry.path_lower or p.startswith(prefix)]:
+                            stale_paths.append(files.pop(path_lower)["path"])
+                    elif isinstance(entry, FileMetadata):
+                        if not self._listing_allowed(entry):
+                            if entry.path_lower in files:
+                                stale_paths.append(files.pop(entry.path_lower)["path"])
                             continue
+                        self._process_entry(dbx, entry, files, hash_owners, data_source_id, to_fetch, stale_paths)
 
-                    doc = Document(
-                        text=text_content,
-                        metadata={
-                            "file_path": file_path,
-                            "file_name": file_name,
-                            "file_extension": file_ext,
-                            "last_modified": entry.client_modified.isoformat()
-                        }
-                    )
-                    self.customize_metadata(doc, data_source_id)
-                    documents.append(doc)
+                if not result.has_more:
+                    break
+                result = dbx.files_list_folder_continue(result.cursor)
 
-                except Exception as e:
-                    print(f"[get_documents] Error processing {file_path}: {str(e)}")
+        documents, failed = self._fetch_documents(dbx, to_fetch, data_source_id)
+        for entry in failed:
+            # Geçici hata: bir sonraki senkronizasyonda yeniden denensin
+            files.pop(entry.path_lower, None)
+
+        self._pending_cursor = result.cursor
+        self._pending_files = files
+
+        print(
+            f"[get_changed_documents] {len(documents)} dosya indirildi, "
+            f"{len(self.pending_copies)} dosya mevcut embedding'leri paylaşacak, "
+            f"{len(stale_paths or [])} eski yol silinecek"
+        )
+        return documents, stale_paths
+
+    def record_nodes(self, nodes: Sequence[BaseNode]) -> None:
+        """Pipeline'dan çıkan parça id'lerini hash indeksine işler"""
+        if self._pending_files is None:
+            return
+        for node in nodes:
+            entry = self._pending_files.get(node.metadata.get("file_path", "").lower())
+            if entry is not None:
+                entry["chunk_ids"].append(node.node_id)
+
+    def apply_shared_embeddings(self, chroma_collection, copies: Sequence[Document]) -> List[Document]:
+        """
+        Aynı içeriğe sahip dosyalar için kaynak dosyanın parçalarını
+        (embedding dahil) yeni yol metadata'sıyla kopyalar. Kaynağı gömülmemiş
+        olan (ör. filtrelenmiş) kopyaları indirip doküman olarak döndürür;
+        bunlar normal pipeline'dan geçirilmelidir.
+        """
+        files = self._pending_files or {}
+        dbx = None
+        to_embed = []
+        shared = 0
+
+        for copy in copies:
+            path_lower = copy.metadata["file_path"].lower()
+            target = files.get(path_lower)
+            source = files.get(copy.metadata["shared_from"], {})
+            if target is None:
+                continue
+
+            source_ids = source.get("chunk_ids", [])
+            existing = chroma_collection.get(
+                ids=source_ids, include=["embeddings", "documents", "metadatas"]
+            ) if source_ids else None
+
+            if not existing or not existing["ids"]:
+                dbx = dbx or Dropbox(self.access_token)
+                content = self._download(dbx, copy.metadata["file_path"])
+                if content is None:
+                    files.pop(path_lower, None)
                     continue
+                to_embed.extend(
+                    self._entry_to_documents(self._copy_entries[path_lower], content, copy.metadata["data_source_id"])
+                )
+                continue
 
-            if not result.has_more:
-                break
-            result = dbx.files_list_folder_continue(result.cursor)
+            new_ids = [f"{chunk_id}:{path_lower}" for chunk_id in existing["ids"]]
+            updates = {
+                key: copy.metadata[key]
+                for key in ("file_path", "file_name", "file_extension", "file_type", "last_modified", "data_source_id")
+                if key in copy.metadata
+            }
+            metadatas = []
+            for new_id, metadata in zip(new_ids, existing["metadatas"]):
+                metadata = dict(metadata, **updates)
+                # ChromaVectorStore node'u _node_content'ten geri kurar; id ve yol orada da güncellenmeli
+                if "_node_content" in metadata:
+                    node_content = json.loads(metadata["_node_content"])
+                    node_content["id_"] = new_id
+                    node_content.setdefault("metadata", {}).update(updates)
+                    metadata["_node_content"] = json.dumps(node_content)
+                metadatas.append(metadata)
+
+            chroma_collection.upsert(
+                ids=new_ids,
+                embeddings=existing["embeddings"],
+                documents=existing["documents"],
+                metadatas=metadatas,
+            )
+            target["chunk_ids"] = new_ids
+            shared += 1
+
+        print(f"[apply_shared_embeddings] {shared} dosya mevcut embedding'leri paylaştı, {len(to_embed)} dosya gömülecek")
+        return to_embed
+
+    def watch(
+        self,
+        data_source_id: str,
+        on_changes: Callable[[List[Document], Optional[List[str]]], None],
+        timeout: int = 30,
+    ) -> None:
+        """
+        files_list_folder_longpoll ile değişiklikleri bekler ve her değişiklikte
+        on_changes(dokümanlar, silinecek_yollar) çağırır. Ctrl+C ile durdurulur.
+        """
+        if not self.state_path:
+            raise ValueError("watch için state_path gereklidir")
+        dbx = Dropbox(self.access_token)
+
+        # İlk senkronizasyon (kayıtlı cursor yoksa tam tarama)
+        documents, stale_paths = self.get_changed_documents(data_source_id)
+        on_changes(documents, stale_paths)
+        self.commit_sync_state()
+
+        while True:
+            cursor = self._saved_state().get("cursor")
+            try:
+                result = dbx.files_list_folder_longpoll(cursor, timeout=timeout)
+            except Exception as e:
+                print(f"[watch] Longpoll hatası: {str(e)}")
+                time.sleep(timeout)
+                continue
+
+            if result.changes:
+                documents, stale_paths = self.get_changed_documents(data_source_id)
+                on_changes(documents, stale_paths)
+                self.commit_sync_state()
 
-        print(f"[get_documents] Toplam {len(documents)} dosya alındı")
-        return documents
+            if result.backoff:
+                time.sleep(result.backoff)
 
     def get_nodes(self, documents: Sequence[Document]) -> Sequence[BaseNode]:
         return []
@@ -1,11 +1,16 @@
 from dropbox_embedding import DropboxEmbeddingMethod
-from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.core.ingestion import IngestionPipeline
 from llama_index.core.node_parser import SentenceSplitter
 import chromadb
 from dotenv import load_dotenv
 import os
+import sys
+# Ortak modüller depo kökündeki common/ paketindedir
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from common.batching import index_in_batches
+from common.embedding_cache import EmbeddingCache, CachedEmbedding
+from common.chroma_upsert import UpsertChromaVectorStore
 
 
 def debug_print_docs(docs, tag="[DEBUG]", max_print=10):
@@ -19,48 +24,101 @@ if __name__ == "__main__":
 
     embed_model = HuggingFaceEmbedding(model_name="sentence-transformers/all-MiniLM-L6-v2")
 
-    db = chromadb.PersistentClient(path="./chroma_db")
+    chroma_db_path = "./chroma_db"
+    db = chromadb.PersistentClient(path=chroma_db_path)
     chroma_collection = db.get_or_create_collection("dropbox_files")
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+    # Node id'leri içerikten türetilir; yeniden çalıştırma kopya yerine upsert yapar
+    vector_store = UpsertChromaVectorStore(chroma_collection=chroma_collection, source_key="file_path")
+
+    # Değişmemiş parçalar modele gönderilmeden kalıcı önbellekten alınır
+    embedding_cache = EmbeddingCache(
+        os.environ.get("EMBEDDING_CACHE_PATH", os.path.join(chroma_db_path, "embedding_cache.sqlite")),
+        max_bytes=int(os.environ.get("EMBEDDING_CACHE_MAX_MB", "256")) * 1024 * 1024
+    )
+    cached_embed_model = CachedEmbedding(embed_model, embedding_cache)
+
+    # Kurallar dosya listesi üzerinde, içerik indirilmeden de uygulanır
+    inclusion_rules = []  # boşsa hepsi dahil
+    exclusion_rules = [
+        r'\.git/',       # .git dizinini hariç tut
+        r'\.DS_Store$',  # macOS sistem dosyalarını hariç tut
+        r'\.log$',       # log dosyalarını hariç tut
+        r'/temp/',       # temp dizinlerini hariç tut
+        r'\.zip$',       # zip dosyalarını hariç tut
+        r'\.exe$',       # executable dosyaları hariç tut
+        r'\.jpg$|\.png$|\.gif$'  # resim dosyalarını hariç tut
+    ]
 
     embedder = DropboxEmbeddingMethod(
         access_token=os.environ.get("DROPBOX_ACCESS_TOKEN"),
-        root_path=os.environ.get("DROPBOX_ROOT_PATH", "")
+        root_path=os.environ.get("DROPBOX_ROOT_PATH", ""),
+        state_path=os.path.join(chroma_db_path, "dropbox_sync_state.json"),
+        pdf_pages_per_document=int(os.environ.get("PDF_PAGES_PER_DOCUMENT", "0")),
+        inclusion_rules=inclusion_rules,
+        exclusion_rules=exclusion_rules,
+        max_file_size=int(os.environ["DROPBOX_MAX_FILE_SIZE"]) if os.environ.get("DROPBOX_MAX_FILE_SIZE") else None
     )
 
-    try:
-        print("[index_task_001] Loading all files from Dropbox...")
-        documents = embedder.get_documents("dropbox_files")
-        debug_print_docs(documents, "[LOADED]")
+    # "full": her çalıştırmada tüm ağaç, "incremental": kayıtlı cursor'dan itibaren delta,
+    # "watch": longpoll ile değişiklikleri bekleyerek sürekli indeksleme
+    sync_mode = os.environ.get("DROPBOX_SYNC_MODE", "full").lower()
+    # Aynı anda filtrelenip gömülen en fazla doküman sayısı
+    batch_size = int(os.environ.get("INDEX_BATCH_SIZE", "64"))
+
+    pipeline = IngestionPipeline(
+        transformations=[
+            SentenceSplitter(chunk_size=512, chunk_overlap=20),
+            cached_embed_model
+        ],
+        vector_store=vector_store,
+    )
+
+    def index_documents(documents, stale_paths=None):
+        if stale_paths is None and sync_mode != "full":
+            chroma_collection.delete(where={"data_source_id": "dropbox_files"})
+        elif stale_paths:
+            chroma_collection.delete(where={
+                "$and": [{"data_source_id": "dropbox_files"}, {"file_path": {"$in": stale_paths}}]
+            })
 
-        print("\n[index_task_002] Applying regex filters...")
-        documents = embedder.apply_rules(
+        print("\n[index_task_002] Filtering and indexing in batches...")
+        loaded, indexed = index_in_batches(
             documents,
-            inclusion_rules=[],  # boşsa hepsi dahil
-            exclusion_rules=[
-                r'\.git/',       # .git dizinini hariç tut
-                r'\.DS_Store$',  # macOS sistem dosyalarını hariç tut
-                r'\.log$',       # log dosyalarını hariç tut
-                r'/temp/',       # temp dizinlerini hariç tut
-                r'\.zip$',       # zip dosyalarını hariç tut
-                r'\.exe$',       # executable dosyaları hariç tut
-                r'\.jpg$|\.png$|\.gif$'  # resim dosyalarını hariç tut
-            ]
-        )
-        debug_print_docs(documents, "[FILTERED]")
-
-        print("\n[index_task_003] Creating vector index...")
-        pipeline = IngestionPipeline(
-            transformations=[
-                SentenceSplitter(chunk_size=512, chunk_overlap=20),
-                embed_model
-            ],
-            vector_store=vector_store,
+            pipeline,
+            apply_rules=lambda batch: embedder.apply_rules(batch, inclusion_rules, exclusion_rules),
+            batch_size=batch_size,
+            on_nodes=embedder.record_nodes,
+            on_first_batch=lambda batch: debug_print_docs(batch, "[LOADED]")
         )
+        print(f"\n[index_task_003] {loaded} doküman yüklendi, {indexed} doküman indekslendi")
 
-        pipeline.run(documents=documents)
+        # İçeriği zaten gömülmüş dosyalar indirilmeden embedding'leri paylaşır
+        if embedder.pending_copies:
+            copies = embedder.apply_rules(embedder.pending_copies, inclusion_rules, exclusion_rules)
+            remaining = embedder.apply_shared_embeddings(chroma_collection, copies)
+            if remaining:
+                index_in_batches(remaining, pipeline, batch_size=batch_size, on_nodes=embedder.record_nodes)
+
+    try:
+        if sync_mode == "watch":
+            print("[index_task_001] Watching Dropbox for changes (Ctrl+C ile çıkış)...")
+            embedder.watch("dropbox_files", index_documents)
+        elif sync_mode == "incremental":
+            print("[index_task_001] Loading changed files from Dropbox...")
+            documents, stale_paths = embedder.get_changed_documents("dropbox_files")
+            index_documents(documents, stale_paths)
+            embedder.commit_sync_state()
+        else:
+            print("[index_task_001] Streaming all files from Dropbox...")
+            index_documents(embedder.iter_documents("dropbox_files"))
+            embedder.commit_sync_state()
         print("[index_task_004] Indexing completed successfully ✅")
 
+    except KeyboardInterrupt:
+        print("\n[index_task_004] Watcher stopped")
     except Exception as e:
         print(f"[ERROR] Indexing failed: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+    finally:
+        print(f"[embedding_cache] {embedding_cache.report()}")
+        embedding_cache.close()
@@ -1,11 +1,16 @@
 from jira_embedding import JiraEmbeddingMethod
-from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.core.ingestion import IngestionPipeline
 from llama_index.core.node_parser import SentenceSplitter
 import chromadb
 from dotenv import load_dotenv
 import os
+import sys
+# Ortak modüller depo kökündeki common/ paketindedir
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from common.batching import index_in_batches
+from common.embedding_cache import EmbeddingCache, CachedEmbedding
+from common.chroma_upsert import UpsertChromaVectorStore
 
 
 def debug_print_docs(docs, tag="[DEBUG]", max_print=10):
@@ -19,46 +24,80 @@ if __name__ == "__main__":
 
     embed_model = HuggingFaceEmbedding(model_name="sentence-transformers/all-MiniLM-L6-v2")
 
-    db = chromadb.PersistentClient(path="./chroma_db")
+    chroma_db_path = "./chroma_db"
+    db = chromadb.PersistentClient(path=chroma_db_path)
     chroma_collection = db.get_or_create_collection("jira_issues")
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+    # Node id'leri içerikten türetilir; yeniden çalıştırma kopya yerine upsert yapar
+    vector_store = UpsertChromaVectorStore(chroma_collection=chroma_collection, source_key="issue_key")
+
+    # Değişmemiş parçalar modele gönderilmeden kalıcı önbellekten alınır
+    embedding_cache = EmbeddingCache(
+        os.environ.get("EMBEDDING_CACHE_PATH", os.path.join(chroma_db_path, "embedding_cache.sqlite")),
+        max_bytes=int(os.environ.get("EMBEDDING_CACHE_MAX_MB", "256")) * 1024 * 1024
+    )
+    cached_embed_model = CachedEmbedding(embed_model, embedding_cache)
 
     embedder = JiraEmbeddingMethod(
         jira_url=os.environ.get("JIRA_URL"),
         email=os.environ.get("JIRA_EMAIL"),
         api_token=os.environ.get("JIRA_API_TOKEN"),
-        project_key="YOUR-PROJECT-KEY"
+        project_key="YOUR-PROJECT-KEY",
+        page_size=int(os.environ.get("JIRA_PAGE_SIZE", "100")),
+        max_workers=int(os.environ.get("JIRA_MAX_WORKERS", "4")),
+        state_path=os.path.join(chroma_db_path, "jira_sync_state.json"),
+        reconcile_interval_hours=float(os.environ.get("JIRA_RECONCILE_HOURS", "24"))
+    )
+
+    # "incremental": yalnızca son watermark'tan bu yana güncellenen issue'lar
+    sync_mode = os.environ.get("JIRA_SYNC_MODE", "full").lower()
+    # Aynı anda filtrelenip gömülen en fazla doküman sayısı
+    batch_size = int(os.environ.get("INDEX_BATCH_SIZE", "64"))
+
+    inclusion_rules = []  # boşsa hepsi dahil
+    exclusion_rules = [
+        r'^TEST-',  # TEST- prefixli issue'ları hariç tut
+        r'-BUG$',   # -BUG suffixli issue'ları hariç tut
+        r'^EPIC-'   # EPIC tipindeki issue'ları hariç tut
+    ]
+
+    pipeline = IngestionPipeline(
+        transformations=[
+            SentenceSplitter(chunk_size=512, chunk_overlap=20),
+            cached_embed_model
+        ],
+        vector_store=vector_store,
     )
 
     try:
-        print("[index_task_001] Loading all issues...")
-        documents = embedder.get_documents("jira_project")
-        debug_print_docs(documents, "[LOADED]")
+        if sync_mode == "incremental":
+            print("[index_task_001] Loading issues updated since last sync...")
+            documents, stale_keys = embedder.get_changed_documents("jira_project")
+            if stale_keys is None:
+                chroma_collection.delete(where={"data_source_id": "jira_project"})
+            elif stale_keys:
+                chroma_collection.delete(where={
+                    "$and": [{"data_source_id": "jira_project"}, {"issue_key": {"$in": stale_keys}}]
+                })
+        else:
+            print("[index_task_001] Streaming all issues...")
+            documents = embedder.iter_documents("jira_project")
 
-        print("\n[index_task_002] Applying regex filters...")
-        documents = embedder.apply_rules(
+        print("\n[index_task_002] Filtering and indexing in batches...")
+        loaded, indexed = index_in_batches(
             documents,
-            inclusion_rules=[],  # boşsa hepsi dahil
-            exclusion_rules=[
-                r'^TEST-',  # TEST- prefixli issue'ları hariç tut
-                r'-BUG$',   # -BUG suffixli issue'ları hariç tut
-                r'^EPIC-'   # EPIC tipindeki issue'ları hariç tut
-            ]
-        )
-        debug_print_docs(documents, "[FILTERED]")
-
-        print("\n[index_task_003] Creating vector index...")
-        pipeline = IngestionPipeline(
-            transformations=[
-                SentenceSplitter(chunk_size=512, chunk_overlap=20),
-                embed_model
-            ],
-            vector_store=vector_store,
+            pipeline,
+            apply_rules=lambda batch: embedder.apply_rules(batch, inclusion_rules, exclusion_rules),
+            batch_size=batch_size,
+            on_first_batch=lambda batch: debug_print_docs(batch, "[LOADED]")
         )
-
-        pipeline.run(documents=documents)
+        print(f"\n[index_task_003] {loaded} issue yüklendi, {indexed} issue indekslendi")
+        if sync_mode == "incremental":
+            embedder.commit_sync_state()
         print("[index_task_004] Indexing completed successfully ✅")
 
     except Exception as e:
         print(f"[ERROR] Indexing failed: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+    finally:
+        print(f"[embedding_cache] {embedding_cache.report()}")
+        embedding_cache.close()
@@ -1,8 +1,20 @@
-import re
-from typing import List, Sequence, Optional, Pattern
+import os
+import sys
+import json
+import time
+from datetime import datetime, timezone
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Sequence, Optional, Iterator, Tuple, Dict
 from llama_index.core import Document
 from llama_index.core.schema import BaseNode
 from jira import JIRA
+# Ortak modüller depo kökündeki common/ paketindedir
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from common.rule_matcher import RuleMatcher
+
+# Doküman oluşturmak için gereken alanlar; geri kalanı Jira'dan hiç istenmez
+ISSUE_FIELDS = "summary,description,issuetype,status,created,updated,assignee,reporter"
 
 
 class JiraEmbeddingMethod:
@@ -12,11 +24,20 @@ class JiraEmbeddingMethod:
         email: str,
         api_token: str,
         project_key: str,
+        page_size: int = 100,
+        max_workers: int = 4,
+        state_path: Optional[str] = None,
+        reconcile_interval_hours: float = 24,
     ):
         self.jira_url = jira_url
         self.email = email
         self.api_token = api_token
         self.project_key = project_key
+        self.page_size = page_size
+        self.max_workers = max(1, max_workers)
+        self.state_path = state_path
+        self.reconcile_interval_hours = reconcile_interval_hours
+        self._pending_state: Optional[dict] = None
 
     @staticmethod
     def customize_metadata(document: Document, data_source_id: str) -> Document:
@@ -26,96 +47,213 @@ class JiraEmbeddingMethod:
         })
         return document
 
-    def _compile_patterns(self, patterns: List[str]) -> List[Pattern]:
-        compiled = []
-        for pattern in patterns:
-            try:
-                compiled.append(re.compile(pattern))
-            except re.error:
-                print(f"Invalid regex pattern: {pattern}")
-        return compiled
-
     def apply_rules(
         self,
         documents: Sequence[Document],
         inclusion_rules: List[str],
         exclusion_rules: List[str],
     ) -> Sequence[Document]:
-        compiled_exclude = self._compile_patterns(exclusion_rules)
-        compiled_include = self._compile_patterns(inclusion_rules)
-
-        filtered_docs = []
+        matcher = RuleMatcher(inclusion_rules, exclusion_rules)
         print("\n[apply_rules] Başlangıç doküman sayısı:", len(documents))
+        filtered_docs = matcher.filter(documents, key=lambda doc: doc.metadata.get("issue_key", ""))
+        matcher.log_summary()
+        return filtered_docs
 
-        for doc in documents:
-            issue_key = doc.metadata.get("issue_key", "")
-            excluded = any(pattern.search(issue_key) for pattern in compiled_exclude)
-            included = any(pattern.search(issue_key) for pattern in compiled_include) if compiled_include else True
+    def _issue_to_document(self, issue, data_source_id: str) -> Optional[Document]:
+        try:
+            # Create document content
+            content = f"""
+            Issue Key: {issue.key}
+            Summary: {issue.fields.summary}
+            Description: {issue.fields.description}
+            Issue Type: {issue.fields.issuetype.name}
+            Status: {issue.fields.status.name}
+            Created: {issue.fields.created}
+            Updated: {issue.fields.updated}
+            """.strip()
 
-            if excluded:
-                print(f"[apply_rules] Dışlandı: {issue_key}")
-                continue
-            if not included:
-                print(f"[apply_rules] Dahil edilmedi: {issue_key}")
-                continue
+            doc = Document(
+                text=content,
+                metadata={
+                    "issue_key": issue.key,
+                    "summary": issue.fields.summary,
+                    "issue_type": issue.fields.issuetype.name,
+                    "status": issue.fields.status.name,
+                    "created": issue.fields.created,
+                    "updated": issue.fields.updated,
+                    "assignee": getattr(issue.fields.assignee, 'displayName', None),
+                    "reporter": getattr(issue.fields.reporter, 'displayName', None)
+                }
+            )
+            self.customize_metadata(doc, data_source_id)
+            return doc
 
-            print(f"[apply_rules] Geçti: {issue_key}")
-            filtered_docs.append(doc)
+        except Exception as e:
+            print(f"[get_documents] Error processing issue {issue.key}: {str(e)}")
+            return None
 
-        return filtered_docs
+    def _iter_issue_pages(self, jira: JIRA, jql: str, fields: str = ISSUE_FIELDS) -> Iterator[list]:
+        """
+        İlk sayfadan toplam issue sayısını öğrenir, kalan sayfaları sınırlı
+        sayıda worker ile paralel çeker ve sayfa sırasıyla döndürür.
+        """
+        def fetch(start_at: int):
+            return jira.search_issues(jql, startAt=start_at, maxResults=self.page_size, fields=fields)
 
-    def get_documents(self, data_source_id: str) -> List[Document]:
-        jira = JIRA(
+        first_page = fetch(0)
+        yield first_page
+        total = getattr(first_page, 'total', len(first_page))
+
+        starts = iter(range(self.page_size, total, self.page_size))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # En fazla max_workers sayfa önden istenir; bellek sayfa sayısıyla büyümez
+            window = deque(executor.submit(fetch, start) for _, start in zip(range(self.max_workers), starts))
+            while window:
+                page = window.popleft().result()
+                next_start = next(starts, None)
+                if next_start is not None:
+                    window.append(executor.submit(fetch, next_start))
+                yield page
+
+    def _connect(self) -> JIRA:
+        return JIRA(
             server=self.jira_url,
             basic_auth=(self.email, self.api_token)
         )
-        documents = []
 
+    def _iter_jql_documents(
+        self, jira: JIRA, jql: str, data_source_id: str, raise_errors: bool = False
+    ) -> Iterator[Document]:
+        count = 0
         try:
-            # Get all issues from the project
-            issues = jira.search_issues(f'project={self.project_key}', maxResults=False)
+            for page in self._iter_issue_pages(jira, jql):
+                for issue in page:
+                    doc = self._issue_to_document(issue, data_source_id)
+                    if doc is not None:
+                        count += 1
+                        yield doc
         except Exception as e:
             print(f"Error accessing Jira: {str(e)}")
-            return documents
+            if raise_errors:
+                raise
 
-        for issue in issues:
-            try:
-                # Get full issue details
-                full_issue = jira.issue(issue.key)
-                
-                # Create document content
-                content = f"""
-                Issue Key: {issue.key}
-                Summary: {issue.fields.summary}
-                Description: {issue.fields.description}
-                Issue Type: {issue.fields.issuetype.name}
-                Status: {issue.fields.status.name}
-                Created: {issue.fields.created}
-                Updated: {issue.fields.updated}
-                """.strip()
-
-                doc = Document(
-                    text=content,
-                    metadata={
-                        "issue_key": issue.key,
-                        "summary": issue.fields.summary,
-                        "issue_type": issue.fields.issuetype.name,
-                        "status": issue.fields.status.name,
-                        "created": issue.fields.created,
-                        "updated": issue.fields.updated,
-                        "assignee": getattr(issue.fields.assignee, 'displayName', None),
-                        "reporter": getattr(issue.fields.reporter, 'displayName', None)
-                    }
-                )
-                self.customize_metadata(doc, data_source_id)
-                documents.append(doc)
+        print(f"[get_documents] Toplam {count} issue alındı")
+
+    def iter_documents(self, data_source_id: str) -> Iterator[Document]:
+        """Issue'ları sayfa sayfa, yalnızca gerekli alanlarla çeker ve geldikçe doküman üretir"""
+        # Sabit sıralama, offset tabanlı paralel sayfalamanın tutarlı olması için gereklidir
+        jql = f'project={self.project_key} ORDER BY key ASC'
+        yield from self._iter_jql_documents(self._connect(), jql, data_source_id)
+
+    def get_documents(self, data_source_id: str) -> List[Document]:
+        return list(self.iter_documents(data_source_id))
+
+    @staticmethod
+    def _parse_jira_datetime(value: str) -> datetime:
+        # Ör. 2024-01-31T10:15:30.000+0300
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%f%z")
+
+    @staticmethod
+    def _jql_datetime(jira: JIRA, value: datetime) -> str:
+        """JQL tarihleri kullanıcının profil saat diliminde ve dakika hassasiyetinde yorumlanır"""
+        try:
+            from zoneinfo import ZoneInfo
+            user_tz = ZoneInfo(jira.myself().get("timeZone", "UTC"))
+        except Exception:
+            user_tz = timezone.utc
+        return value.astimezone(user_tz).strftime("%Y/%m/%d %H:%M")
+
+    def _load_sync_state(self) -> Dict[str, dict]:
+        if not self.state_path or not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"[sync_state] Durum dosyası okunamadı: {str(e)}")
+            return {}
+
+    def commit_sync_state(self) -> None:
+        """İndeksleme başarılı olduktan sonra watermark'ı project_key için kaydeder"""
+        if not self.state_path or self._pending_state is None:
+            return
+        state = self._load_sync_state()
+        state[self.project_key] = self._pending_state
+        state_dir = os.path.dirname(self.state_path)
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+        self._pending_state = None
+
+    def _live_issue_keys(self, jira: JIRA) -> set:
+        keys = set()
+        jql = f'project={self.project_key} ORDER BY key ASC'
+        for page in self._iter_issue_pages(jira, jql, fields="key"):
+            keys.update(issue.key for issue in page)
+        return keys
 
+    def get_changed_documents(self, data_source_id: str) -> Tuple[List[Document], Optional[List[str]]]:
+        """
+        Kayıtlı 'updated' watermark'ından bu yana güncellenen issue'ları çeker;
+        reconcile_interval_hours'ta bir Jira'da artık bulunmayan issue'ları tespit eder.
+        Dönüş: (indekslenecek dokümanlar, parçaları silinecek issue key'leri).
+        Silinecek key'ler None ise tam yükleme yapılmıştır ve veri kaynağının
+        tüm eski vektörleri silinmelidir. Çekim yarıda kalırsa hata yükseltilir;
+        watermark ilerletilmez ve kaydedilecek durum oluşmaz.
+        """
+        self._pending_state = None
+        jira = self._connect()
+        saved = self._load_sync_state().get(self.project_key, {})
+        watermark = saved.get("updated_watermark")
+        known_keys = set(saved.get("issue_keys", []))
+
+        if watermark:
+            # >= ile sınırdaki issue'lar tekrar gelir; eski parçaları silindiği için sorun olmaz
+            since = self._jql_datetime(jira, self._parse_jira_datetime(watermark))
+            jql = f'project={self.project_key} AND updated >= "{since}" ORDER BY key ASC'
+        else:
+            print("[get_changed_documents] Kayıtlı watermark yok, tam yükleme yapılıyor")
+            jql = f'project={self.project_key} ORDER BY key ASC'
+
+        # Sayfalar updated'a göre değil key'e göre sıralı; kısmi bir sonuçla watermark
+        # ilerletilirse çekilemeyen sayfalardaki issue'lar bir daha alınmazdı
+        documents = list(self._iter_jql_documents(jira, jql, data_source_id, raise_errors=True))
+
+        max_updated = self._parse_jira_datetime(watermark) if watermark else None
+        for doc in documents:
+            updated = self._parse_jira_datetime(doc.metadata["updated"])
+            if max_updated is None or updated > max_updated:
+                max_updated = updated
+                watermark = doc.metadata["updated"]
+
+        # Güncellenen issue'ların eski parçaları issue_key ile değiştirilir
+        stale_keys = [doc.metadata["issue_key"] for doc in documents]
+        known_keys.update(stale_keys)
+
+        last_reconcile = saved.get("last_reconcile", 0)
+        if saved and time.time() - last_reconcile >= self.reconcile_interval_hours * 3600:
+            print("[get_changed_documents] Silinen issue'lar için uzlaştırma yapılıyor...")
+            try:
+                deleted_keys = known_keys - self._live_issue_keys(jira)
+                stale_keys.extend(sorted(deleted_keys))
+                known_keys -= deleted_keys
+                last_reconcile = time.time()
             except Exception as e:
-                print(f"[get_documents] Error processing issue {issue.key}: {str(e)}")
-                continue
+                print(f"[get_changed_documents] Uzlaştırma başarısız: {str(e)}")
+        elif not saved:
+            last_reconcile = time.time()
+
+        self._pending_state = {
+            "updated_watermark": watermark,
+            "issue_keys": sorted(known_keys),
+            "last_reconcile": last_reconcile,
+        }
 
-        print(f"[get_documents] Toplam {len(documents)} issue alındı")
-        return documents
+        print(f"[get_changed_documents] {len(documents)} issue alındı, {len(stale_keys)} issue'nun eski parçaları silinecek")
+        return documents, (stale_keys if saved else None)
 
     def get_nodes(self, documents: Sequence[Document]) -> Sequence[BaseNode]:
         return []
\ No newline at end of file
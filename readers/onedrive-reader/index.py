@@ -1,12 +1,16 @@
 from onedrive_embedding import OneDriveEmbeddingMethod
-from gitlab_embedding import GitLabEmbeddingMethod
-from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.core.ingestion import IngestionPipeline
 from llama_index.core.node_parser import SentenceSplitter
 import chromadb
 from dotenv import load_dotenv
 import os
+import sys
+# Ortak modüller depo kökündeki common/ paketindedir
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from common.batching import index_in_batches
+from common.embedding_cache import EmbeddingCache, CachedEmbedding
+from common.chroma_upsert import UpsertChromaVectorStore
 
 
 def debug_print_docs(docs, tag="[DEBUG]", max_print=10):
@@ -20,50 +24,91 @@ if __name__ == "__main__":
 
     embed_model = HuggingFaceEmbedding(model_name="sentence-transformers/all-MiniLM-L6-v2")
 
-    db = chromadb.PersistentClient(path="./chroma_db")
+    chroma_db_path = "./chroma_db"
+    db = chromadb.PersistentClient(path=chroma_db_path)
     chroma_collection = db.get_or_create_collection("gitlab_repos")
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+    # Node id'leri içerikten türetilir; yeniden çalıştırma kopya yerine upsert yapar
+    vector_store = UpsertChromaVectorStore(chroma_collection=chroma_collection, source_key="file_path")
+
+    # Değişmemiş parçalar modele gönderilmeden kalıcı önbellekten alınır
+    embedding_cache = EmbeddingCache(
+        os.environ.get("EMBEDDING_CACHE_PATH", os.path.join(chroma_db_path, "embedding_cache.sqlite")),
+        max_bytes=int(os.environ.get("EMBEDDING_CACHE_MAX_MB", "256")) * 1024 * 1024
+    )
+    cached_embed_model = CachedEmbedding(embed_model, embedding_cache)
+
+    # Kurallar dosya listesi üzerinde, içerik indirilmeden de uygulanır
+    inclusion_rules = []  # boşsa hepsi dahil
+    exclusion_rules = [
+        r'(^|/)tests?/',
+        r'__pycache__',
+        r'\.md$',
+        r'\.png$',
+        r'\.jpg$',
+        r'\.jpeg$'
+    ]
 
     embedder = OneDriveEmbeddingMethod(
         client_id=os.environ.get("ONEDRIVE_CLIENT_ID"),
         client_secret=os.environ.get("ONEDRIVE_CLIENT_SECRET"),
         redirect_uri=os.environ.get("ONEDRIVE_REDIRECT_URI"),
         refresh_token=os.environ.get("ONEDRIVE_REFRESH_TOKEN"),
-        tenant_id=os.environ.get("ONEDRIVE_TENANT_ID", "organizations")  # Varsayılan değer eklendi
+        tenant_id=os.environ.get("ONEDRIVE_TENANT_ID", "organizations"),  # Varsayılan değer eklendi
+        state_path=os.path.join(chroma_db_path, "onedrive_sync_state.json"),
+        max_workers=int(os.environ.get("ONEDRIVE_MAX_WORKERS", "8")),
+        inclusion_rules=inclusion_rules,
+        exclusion_rules=exclusion_rules,
+        max_file_size=int(os.environ["ONEDRIVE_MAX_FILE_SIZE"]) if os.environ.get("ONEDRIVE_MAX_FILE_SIZE") else None
+    )
+
+    # "incremental": kayıtlı deltaLink'ten itibaren yalnızca değişen/silinen öğeler
+    sync_mode = os.environ.get("ONEDRIVE_SYNC_MODE", "full").lower()
+    # Aynı anda filtrelenip gömülen en fazla doküman sayısı
+    batch_size = int(os.environ.get("INDEX_BATCH_SIZE", "64"))
+
+    pipeline = IngestionPipeline(
+        transformations=[
+            SentenceSplitter(chunk_size=512, chunk_overlap=20),
+            cached_embed_model
+        ],
+        vector_store=vector_store,
     )
 
     try:
-        print("[index_task_001] Loading all documents...")
-        documents = embedder.get_documents("test_repo")
-        debug_print_docs(documents, "[LOADED]")
+        # Tam listelemede silinen dosyalar akış başarıyla bittikten sonra temizlenir
+        full_sync = True
+        if sync_mode == "incremental":
+            print("[index_task_001] Loading changed documents since last sync...")
+            documents, stale_ids = embedder.get_changed_documents("test_repo")
+            full_sync = stale_ids is None
+            if stale_ids:
+                # Yalnızca silinen/taşınan öğeler; yerinde değişenleri upsert deposu değiştirir
+                chroma_collection.delete(where={
+                    "$and": [{"data_source_id": "test_repo"}, {"item_id": {"$in": stale_ids}}]
+                })
+        else:
+            print("[index_task_001] Streaming all documents...")
+            documents = embedder.iter_documents("test_repo")
 
-        print("\n[index_task_002] Applying regex filters...")
-        documents = embedder.apply_rules(
+        print("\n[index_task_002] Filtering and indexing in batches...")
+        loaded, indexed = index_in_batches(
             documents,
-            inclusion_rules=[],  # boşsa hepsi dahil
-            exclusion_rules=[
-                r'(^|/)tests?/',
-                r'__pycache__',
-                r'\.md$',
-                r'\.png$',
-                r'\.jpg$',
-                r'\.jpeg$'
-            ]
-        )
-        debug_print_docs(documents, "[FILTERED]")
-
-        print("\n[index_task_003] Creating vector index...")
-        pipeline = IngestionPipeline(
-            transformations=[
-                SentenceSplitter(chunk_size=512, chunk_overlap=20),
-                embed_model
-            ],
-            vector_store=vector_store,
+            pipeline,
+            apply_rules=lambda batch: embedder.apply_rules(batch, inclusion_rules, exclusion_rules),
+            batch_size=batch_size,
+            on_first_batch=lambda batch: debug_print_docs(batch, "[LOADED]")
         )
-
-        pipeline.run(documents=documents)
+        print(f"\n[index_task_003] {loaded} doküman yüklendi, {indexed} doküman indekslendi")
+        if full_sync and embedder.listing_complete:
+            # İndirilemeyen dosyaların eski vektörleri korunur
+            vector_store.delete_unwritten("test_repo", keep=embedder.failed_items.values())
+        if sync_mode == "incremental":
+            embedder.commit_sync_state()
         print("[index_task_004] Indexing completed successfully ✅")
 
     except Exception as e:
         print(f"[ERROR] Indexing failed: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+    finally:
+        print(f"[embedding_cache] {embedding_cache.report()}")
+        embedding_cache.close()
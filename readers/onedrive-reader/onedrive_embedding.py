@@ -1,9 +1,19 @@
-import re
-from typing import List, Sequence, Optional, Pattern
+import os
+import sys
+import json
+import threading
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Sequence, Optional, Tuple, Dict, Iterable, Iterator
 from llama_index.core import Document
 from llama_index.core.schema import BaseNode
 from msal import ConfidentialClientApplication
 import requests
+from requests.adapters import HTTPAdapter
+# Ortak modüller depo kökündeki common/ paketindedir
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from common.rule_matcher import RuleMatcher
 
 class OneDriveEmbeddingMethod:
     def __init__(
@@ -13,6 +23,12 @@ class OneDriveEmbeddingMethod:
         redirect_uri: str,
         refresh_token: str,
         tenant_id: str,
+        state_path: Optional[str] = None,
+        graph_base_url: str = "https://graph.microsoft.com/v1.0",
+        max_workers: int = 8,
+        inclusion_rules: Optional[List[str]] = None,
+        exclusion_rules: Optional[List[str]] = None,
+        max_file_size: Optional[int] = None,
     ):
 
         self.client_id = client_id
@@ -21,6 +37,26 @@ class OneDriveEmbeddingMethod:
         self.refresh_token = refresh_token
         self.tenant_id = tenant_id
         self.scopes = ["https://graph.microsoft.com/.default"]
+        self.state_path = state_path
+        self.graph_base_url = graph_base_url.rstrip("/")
+        self._pending_state: Optional[dict] = None
+        # İndirilemeyen dosyalar (item id -> yol); varken deltaLink kaydedilmez
+        self.failed_items: Dict[str, str] = {}
+        # Tam listeleme başarılı olduysa True; yazılmayan kaynaklar ancak o zaman silinebilir
+        self.listing_complete = False
+        self.max_workers = max(1, max_workers)
+        # Listeleme aşamasında, içerik indirilmeden uygulanan kurallar
+        self.inclusion_rules = inclusion_rules or []
+        self.exclusion_rules = exclusion_rules or []
+        self.max_file_size = max_file_size
+        self._listing_rules = RuleMatcher(self.inclusion_rules, self.exclusion_rules)
+
+        # Tüm istekler aynı bağlantı havuzunu kullanır (her istekte yeni TLS el sıkışması yok)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._token_lock = threading.Lock()
         
         # MSAL Confidential Client uygulamasını oluştur
         self.app = ConfidentialClientApplication(
@@ -45,16 +81,36 @@ class OneDriveEmbeddingMethod:
             )
             if "access_token" not in result:
                 raise Exception(f"Access token alınamadı: {result.get('error_description')}")
+            # Refresh token dönerse bir sonraki yenileme için sakla
+            self.refresh_token = result.get("refresh_token", self.refresh_token)
             return result["access_token"]
         except Exception as e:
             raise Exception(f"Token alma hatası: {str(e)}")
 
+    def _refresh_access_token(self, expired_token: str) -> None:
+        """Süresi dolan token'ı yeniler; aynı anda 401 alan thread'ler tek bir yenileme yapar"""
+        with self._token_lock:
+            if self.access_token != expired_token:
+                return
+            print("[auth] Access token süresi doldu, yenileniyor...")
+            self.access_token = self._get_access_token()
+            self.headers = {
+                "Authorization": f"Bearer {self.access_token}",
+                "Content-Type": "application/json"
+            }
+
+    def _authorized_get(self, url: str, **kwargs) -> requests.Response:
+        """Graph isteği yapar; 401 dönerse token'ı yenileyip bir kez tekrar dener"""
+        token = self.access_token
+        response = self.session.get(url, headers=self.headers, **kwargs)
+        if response.status_code == 401:
+            self._refresh_access_token(token)
+            response = self.session.get(url, headers=self.headers, **kwargs)
+        return response
+
     def _make_graph_api_request(self, url: str) -> dict:
         try:
-            response = requests.get(
-                url,
-                headers=self.headers
-            )
+            response = self._authorized_get(url)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -68,15 +124,6 @@ class OneDriveEmbeddingMethod:
         })
         return document
 
-    def _compile_patterns(self, patterns: List[str]) -> List[Pattern]:
-        compiled = []
-        for pattern in patterns:
-            try:
-                compiled.append(re.compile(pattern))
-            except re.error:
-                print(f"Invalid regex pattern: {pattern}")
-        return compiled
-
     def apply_rules(
         self,
         documents: Sequence[Document],
@@ -86,87 +133,291 @@ class OneDriveEmbeddingMethod:
         inclusion_rules = inclusion_rules or []
         exclusion_rules = exclusion_rules or []
         
-        compiled_exclude = self._compile_patterns(exclusion_rules)
-        compiled_include = self._compile_patterns(inclusion_rules)
-
-        filtered_docs = []
+        matcher = RuleMatcher(inclusion_rules, exclusion_rules)
         print("\n[apply_rules] Başlangıç doküman sayısı:", len(documents))
+        filtered_docs = matcher.filter(documents, key=lambda doc: doc.metadata.get("file_path", ""))
+        matcher.log_summary()
+        return filtered_docs
 
-        for doc in documents:
-            file_path = doc.metadata.get("file_path", "")
-            excluded = any(pattern.search(file_path) for pattern in compiled_exclude)
-            included = any(pattern.search(file_path) for pattern in compiled_include) if compiled_include else True
+    
 
-            if excluded:
-                print(f"[apply_rules] Dışlandı: {file_path}")
-                continue
-            if not included:
-                print(f"[apply_rules] Dahil edilmedi: {file_path}")
-                continue
+    def _walk_delta(self, url: str) -> Tuple[List[dict], Optional[str]]:
+        """@odata.nextLink sayfalarını sonuna kadar izler; (öğeler, deltaLink) döner"""
+        items = []
+        while url:
+            data = self._make_graph_api_request(url)
+            items.extend(data.get('value', []))
+            if '@odata.nextLink' in data:
+                url = data['@odata.nextLink']
+            else:
+                return items, data.get('@odata.deltaLink')
+        return items, None
 
-            print(f"[apply_rules] Geçti: {file_path}")
-            filtered_docs.append(doc)
+    @staticmethod
+    def _resolve_path(items_map: Dict[str, dict], item_id: str) -> str:
+        """Delta yanıtları parentReference.path içermez; yol id -> ebeveyn zincirinden kurulur"""
+        parts = []
+        seen = set()
+        while item_id and item_id in items_map and item_id not in seen:
+            seen.add(item_id)
+            entry = items_map[item_id]
+            if entry.get("name"):
+                parts.append(entry["name"])
+            item_id = entry.get("parent")
+        return "/".join(reversed(parts))
 
-        return filtered_docs
+    @staticmethod
+    def _descendants(items_map: Dict[str, dict], root_ids: List[str]) -> List[str]:
+        children: Dict[str, List[str]] = {}
+        for item_id, entry in items_map.items():
+            children.setdefault(entry.get("parent"), []).append(item_id)
+        result = []
+        stack = list(root_ids)
+        while stack:
+            for child_id in children.get(stack.pop(), []):
+                result.append(child_id)
+                stack.append(child_id)
+        return result
 
-    
+    def _download_item(self, item_id: str, download_url: Optional[str]) -> bytes:
+        if download_url:
+            # Ön-imzalı URL; Authorization başlığı gerekmez
+            content_response = self.session.get(download_url)
+            if content_response.ok:
+                return content_response.content
+            # Ön-imzalı URL'lerin süresi dolabilir; içerik endpoint'ine dön
 
-    def get_documents(self, data_source_id: str) -> List[Document]:
-        documents = []
+        content_response = self._authorized_get(f"{self.graph_base_url}/me/drive/items/{item_id}/content")
+        content_response.raise_for_status()
+        return content_response.content
+
+    def _item_to_document(
+        self,
+        item_id: str,
+        items_map: Dict[str, dict],
+        download_url: Optional[str],
+        data_source_id: str,
+    ) -> Optional[Document]:
+        entry = items_map[item_id]
+        file_path = self._resolve_path(items_map, item_id)
+        file_name = entry.get("name", "")
+        file_ext = file_name.split('.')[-1].lower() if '.' in file_name else ''
 
         try:
-            # Graph API endpoint for root children
-            url = "https://graph.microsoft.com/v1.0/me/drive/root/children"
-            items_data = self._make_graph_api_request(url)
-            items = items_data.get('value', [])
+            content = self._download_item(item_id, download_url)
+
+            if isinstance(content, bytes):
+                try:
+                    content = content.decode('utf-8')
+                except UnicodeDecodeError:
+                    print(f"[get_documents] Binary file skipped: {file_path}")
+                    return None
+
+            doc = Document(
+                text=content,
+                metadata={
+                    "item_id": item_id,
+                    "file_path": file_path,
+                    "file_name": file_name,
+                    "file_extension": file_ext,
+                    "last_modified": entry.get("last_modified", "")
+                }
+            )
+            self.customize_metadata(doc, data_source_id)
+            return doc
+
         except Exception as e:
-            print(f"Error accessing OneDrive: {str(e)}")
-            return documents
+            print(f"[get_documents] Error processing {file_path}: {str(e)}")
+            self.failed_items[item_id] = file_path
+            return None
+
+    def _apply_delta(
+        self,
+        items: List[dict],
+        items_map: Dict[str, dict],
+    ) -> Tuple[Dict[str, Optional[str]], List[str]]:
+        """
+        Delta öğelerini items_map'e uygular.
+        Dönüş: ({indirilecek dosya id'si: downloadUrl}, vektörleri önceden silinecek dosya id'leri).
+        Yalnızca silinen ve yolu değişen dosyalar önceden silinir; yerinde değişen
+        dosyaların parçalarını upsert deposu yenileri yazıldıktan sonra değiştirir.
+        """
+        to_fetch: Dict[str, Optional[str]] = {}
+        stale_ids: List[str] = []
+        moved_folders: List[str] = []
 
         for item in items:
-            if 'file' not in item:
+            item_id = item['id']
+
+            if 'deleted' in item:
+                removed = [item_id] + self._descendants(items_map, [item_id])
+                for removed_id in removed:
+                    entry = items_map.pop(removed_id, None)
+                    to_fetch.pop(removed_id, None)
+                    if entry and entry.get("file"):
+                        stale_ids.append(removed_id)
                 continue
 
-            file_path = item.get('name', '')
-            file_name = item.get('name', '')
-            file_ext = file_name.split('.')[-1].lower() if '.' in file_name else ''
-
-            try:
-                # Get file content
-                download_url = item.get('@microsoft.graph.downloadUrl')
-                if not download_url:
-                    print(f"[get_documents] Download URL not available for: {file_path}")
-                    continue
-
-                content_response = requests.get(download_url)
-                content_response.raise_for_status()
-                content = content_response.content
-
-                if isinstance(content, bytes):
-                    try:
-                        content = content.decode('utf-8')
-                    except UnicodeDecodeError:
-                        print(f"[get_documents] Binary file skipped: {file_path}")
-                        continue
-
-                doc = Document(
-                    text=content,
-                    metadata={
-                        "file_path": file_path,
-                        "file_name": file_name,
-                        "file_extension": file_ext,
-                        "last_modified": item.get('lastModifiedDateTime', '')
-                    }
-                )
-                self.customize_metadata(doc, data_source_id)
-                documents.append(doc)
-
-            except Exception as e:
-                print(f"[get_documents] Error processing {file_path}: {str(e)}")
+            previous = items_map.get(item_id)
+            entry = {
+                "name": "" if 'root' in item else item.get('name', ''),
+                "parent": None if 'root' in item else item.get('parentReference', {}).get('id'),
+                "file": 'file' in item,
+                "last_modified": item.get('lastModifiedDateTime', ''),
+                "size": item.get('size'),
+            }
+            items_map[item_id] = entry
+
+            if not entry["file"]:
+                # Yeniden adlandırılan/taşınan klasörlerin alt dosyalarının yolu değişir
+                if previous and (previous.get("name"), previous.get("parent")) != (entry["name"], entry["parent"]):
+                    moved_folders.append(item_id)
                 continue
 
-        print(f"[get_documents] Toplam {len(documents)} dosya alındı")
-        return documents
+            if previous and (previous.get("name"), previous.get("parent")) != (entry["name"], entry["parent"]):
+                # Eski yolun parçaları yeni yolla değiştirilmez
+                stale_ids.append(item_id)
+            to_fetch[item_id] = item.get('@microsoft.graph.downloadUrl')
+
+        for item_id in self._descendants(items_map, moved_folders):
+            if items_map[item_id].get("file") and item_id not in to_fetch:
+                stale_ids.append(item_id)
+                to_fetch[item_id] = None
+
+        return to_fetch, stale_ids
+
+    def _listing_allowed(self, items_map: Dict[str, dict], item_id: str) -> bool:
+        """Yol kuralları ve boyut sınırı, delta metadata'sı üzerinden indirmeden önce değerlendirilir"""
+        size = items_map[item_id].get("size")
+        if self.max_file_size is not None and size is not None and size > self.max_file_size:
+            return False
+        return self._listing_rules.allowed(self._resolve_path(items_map, item_id))
+
+    def _iter_fetched_documents(
+        self,
+        to_fetch: Dict[str, Optional[str]],
+        items_map: Dict[str, dict],
+        data_source_id: str,
+    ) -> Iterator[Document]:
+        """Dosyaları paralel indirir; en fazla max_workers * 2 istek önden gider ve sıra korunur"""
+        allowed = [(item_id, url) for item_id, url in to_fetch.items() if self._listing_allowed(items_map, item_id)]
+        if len(allowed) < len(to_fetch):
+            print(f"[get_documents] {len(to_fetch) - len(allowed)} dosya filtre nedeniyle indirilmeden atlandı")
+
+        pending = iter(allowed)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            submit = lambda item: executor.submit(self._item_to_document, item[0], items_map, item[1], data_source_id)
+            window = deque(submit(item) for item in islice(pending, self.max_workers * 2))
+            while window:
+                doc = window.popleft().result()
+                next_item = next(pending, None)
+                if next_item is not None:
+                    window.append(submit(next_item))
+                if doc is not None:
+                    yield doc
+
+    def _fetch_documents(
+        self,
+        to_fetch: Dict[str, Optional[str]],
+        items_map: Dict[str, dict],
+        data_source_id: str,
+    ) -> List[Document]:
+        return list(self._iter_fetched_documents(to_fetch, items_map, data_source_id))
+
+    def iter_documents(self, data_source_id: str) -> Iterator[Document]:
+        """
+        Tüm sürücüyü delta endpoint'i ile (alt klasörler ve sayfalama dahil) listeler;
+        dosyalar indirildikçe doküman olarak üretilir.
+        """
+        self.failed_items = {}
+        self.listing_complete = False
+        try:
+            items, delta_link = self._walk_delta(f"{self.graph_base_url}/me/drive/root/delta")
+        except Exception as e:
+            print(f"Error accessing OneDrive: {str(e)}")
+            return
+        self.listing_complete = True
+
+        items_map: Dict[str, dict] = {}
+        to_fetch, _ = self._apply_delta(items, items_map)
+        # Ham delta yanıtı artık gerekmez; akış boyunca bellekte tutulmasın
+        del items
+        self._pending_state = {"delta_link": delta_link, "items": items_map}
+
+        count = 0
+        for doc in self._iter_fetched_documents(to_fetch, items_map, data_source_id):
+            count += 1
+            yield doc
+
+        print(f"[get_documents] Toplam {count} dosya alındı")
+
+    def get_documents(self, data_source_id: str) -> List[Document]:
+        return list(self.iter_documents(data_source_id))
+
+    def _load_sync_state(self) -> dict:
+        if not self.state_path or not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"[sync_state] Durum dosyası okunamadı: {str(e)}")
+            return {}
+
+    def commit_sync_state(self) -> None:
+        """
+        İndeksleme başarılı olduktan sonra deltaLink'i ve öğe ağacını kaydeder.
+        İndirilemeyen dosya varsa kaydedilmez; sonraki çalıştırma aynı deltayı tekrar uygular.
+        """
+        if not self.state_path or not self._pending_state or not self._pending_state.get("delta_link"):
+            return
+        if self.failed_items:
+            print(f"[sync_state] {len(self.failed_items)} dosya indirilemedi, deltaLink kaydedilmedi; sonraki çalıştırmada tekrar denenecek")
+            self._pending_state = None
+            return
+        state_dir = os.path.dirname(self.state_path)
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._pending_state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+        self._pending_state = None
+
+    def get_changed_documents(self, data_source_id: str) -> Tuple[Iterable[Document], Optional[List[str]]]:
+        """
+        Kayıtlı deltaLink ile yalnızca değişen ve silinen öğeleri alır.
+        Dönüş: (indekslenecek dokümanlar, vektörleri önceden silinecek item id'leri).
+        Silinecek id'ler None ise tam listeleme yapılmıştır, dokümanlar
+        iter_documents akışıdır ve akış bitince yazılmayan kaynaklar silinmelidir.
+        """
+        self.failed_items = {}
+        self.listing_complete = False
+        saved = self._load_sync_state()
+        delta_link = saved.get("delta_link")
+        if not delta_link:
+            print("[get_changed_documents] Kayıtlı deltaLink yok, tam listeleme yapılıyor")
+            return self.iter_documents(data_source_id), None
+
+        try:
+            items, new_delta_link = self._walk_delta(delta_link)
+        except Exception as e:
+            # 410 Gone (resync gerekli) vb. durumlarda tam listelemeye dön
+            print(f"[get_changed_documents] deltaLink kullanılamadı, tam listeleme yapılıyor: {str(e)}")
+            return self.iter_documents(data_source_id), None
+
+        items_map: Dict[str, dict] = saved.get("items", {})
+        to_fetch, stale_ids = self._apply_delta(items, items_map)
+        # Artık kurallara uymayan dosyalar indirilmez; eski parçaları önceden silinir
+        stale = set(stale_ids)
+        stale_ids.extend(
+            item_id for item_id in to_fetch if item_id not in stale and not self._listing_allowed(items_map, item_id)
+        )
+        documents = self._fetch_documents(to_fetch, items_map, data_source_id)
+        self._pending_state = {"delta_link": new_delta_link, "items": items_map}
+
+        print(f"[get_changed_documents] {len(documents)} dosya alındı, {len(stale_ids)} dosyanın eski vektörleri silinecek")
+        return documents, stale_ids
 
     def get_nodes(self, documents: Sequence[Document]) -> Sequence[BaseNode]:
         return []
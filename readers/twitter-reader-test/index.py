@@ -1,11 +1,16 @@
 from twitter_embedding import TwitterEmbeddingMethod
-from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.core.ingestion import IngestionPipeline
 from llama_index.core.node_parser import SentenceSplitter
 import chromadb
 from dotenv import load_dotenv
 import os
+import sys
+# Ortak modüller depo kökündeki common/ paketindedir
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from common.batching import index_in_batches
+from common.embedding_cache import EmbeddingCache, CachedEmbedding
+from common.chroma_upsert import UpsertChromaVectorStore
 
 
 def debug_print_docs(docs, tag="[DEBUG]", max_print=10):
@@ -19,48 +24,68 @@ if __name__ == "__main__":
 
     embed_model = HuggingFaceEmbedding(model_name="sentence-transformers/all-MiniLM-L6-v2")
 
-    db = chromadb.PersistentClient(path="./chroma_db")
+    chroma_db_path = "./chroma_db"
+    db = chromadb.PersistentClient(path=chroma_db_path)
     chroma_collection = db.get_or_create_collection("twitter_tweets")
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+    # Node id'leri içerikten türetilir; yeniden çalıştırma kopya yerine upsert yapar
+    vector_store = UpsertChromaVectorStore(chroma_collection=chroma_collection, source_key="tweet_id")
+
+    # Değişmemiş parçalar modele gönderilmeden kalıcı önbellekten alınır
+    embedding_cache = EmbeddingCache(
+        os.environ.get("EMBEDDING_CACHE_PATH", os.path.join(chroma_db_path, "embedding_cache.sqlite")),
+        max_bytes=int(os.environ.get("EMBEDDING_CACHE_MAX_MB", "256")) * 1024 * 1024
+    )
+    cached_embed_model = CachedEmbedding(embed_model, embedding_cache)
 
     embedder = TwitterEmbeddingMethod(
         consumer_key=os.environ.get("TWITTER_CONSUMER_KEY"),
         consumer_secret=os.environ.get("TWITTER_CONSUMER_SECRET"),
         access_token=os.environ.get("TWITTER_ACCESS_TOKEN"),
         access_token_secret=os.environ.get("TWITTER_ACCESS_TOKEN_SECRET"),
-        username=os.environ.get("TWITTER_USERNAME")
+        username=os.environ.get("TWITTER_USERNAME"),
+        # Birden fazla kullanıcı için virgülle ayrılmış liste
+        usernames=[u.strip() for u in os.environ.get("TWITTER_USERNAMES", "").split(",") if u.strip()],
+        state_path=os.path.join(chroma_db_path, "twitter_sync_state.json")
+    )
+
+    # Aynı anda filtrelenip gömülen en fazla doküman sayısı
+    batch_size = int(os.environ.get("INDEX_BATCH_SIZE", "64"))
+
+    inclusion_rules = []  # boşsa hepsi dahil
+    exclusion_rules = [
+        r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+',  # URLs
+        r'RT @',  # Retweets
+        r'@[A-Za-z0-9_]+',  # Mentions
+        r'#[A-Za-z0-9_]+'  # Hashtags
+    ]
+
+    pipeline = IngestionPipeline(
+        transformations=[
+            SentenceSplitter(chunk_size=512, chunk_overlap=20),
+            cached_embed_model
+        ],
+        vector_store=vector_store,
     )
 
     try:
-        print("[index_task_001] Loading all tweets...")
-        documents = embedder.get_documents("twitter_data")
-        debug_print_docs(documents, "[LOADED]")
+        print("[index_task_001] Streaming new tweets...")
+        documents = embedder.iter_documents("twitter_data")
 
-        print("\n[index_task_002] Applying regex filters...")
-        documents = embedder.apply_rules(
+        print("\n[index_task_002] Filtering and indexing in batches...")
+        loaded, indexed = index_in_batches(
             documents,
-            inclusion_rules=[],  # boşsa hepsi dahil
-            exclusion_rules=[
-                r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+',  # URLs
-                r'RT @',  # Retweets
-                r'@[A-Za-z0-9_]+',  # Mentions
-                r'#[A-Za-z0-9_]+'  # Hashtags
-            ]
-        )
-        debug_print_docs(documents, "[FILTERED]")
-
-        print("\n[index_task_003] Creating vector index...")
-        pipeline = IngestionPipeline(
-            transformations=[
-                SentenceSplitter(chunk_size=512, chunk_overlap=20),
-                embed_model
-            ],
-            vector_store=vector_store,
+            pipeline,
+            apply_rules=lambda batch: embedder.apply_rules(batch, inclusion_rules, exclusion_rules),
+            batch_size=batch_size,
+            on_first_batch=lambda batch: debug_print_docs(batch, "[LOADED]")
         )
-
-        pipeline.run(documents=documents)
+        print(f"\n[index_task_003] {loaded} tweet yüklendi, {indexed} tweet indekslendi")
+        embedder.commit_sync_state()
         print("[index_task_004] Indexing completed successfully ✅")
 
     except Exception as e:
         print(f"[ERROR] Indexing failed: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+    finally:
+        print(f"[embedding_cache] {embedding_cache.report()}")
+        embedding_cache.close()
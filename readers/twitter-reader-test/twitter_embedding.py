@@ -1,8 +1,14 @@
-import re
-from typing import List, Sequence, Optional, Pattern
+import os
+import sys
+import json
+from collections import deque
+from typing import List, Sequence, Optional, Iterator, Dict
 from llama_index.core import Document
 from llama_index.core.schema import BaseNode
 import tweepy
+# Ortak modüller depo kökündeki common/ paketindedir
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from common.rule_matcher import RuleMatcher
 
 
 class TwitterEmbeddingMethod:
@@ -12,13 +18,18 @@ class TwitterEmbeddingMethod:
         consumer_secret: str,
         access_token: str,
         access_token_secret: str,
-        username: str,
+        username: Optional[str] = None,
+        usernames: Optional[List[str]] = None,
+        state_path: Optional[str] = None,
     ):
         self.consumer_key = consumer_key
         self.consumer_secret = consumer_secret
         self.access_token = access_token
         self.access_token_secret = access_token_secret
         self.username = username
+        self.usernames = usernames or ([username] if username else [])
+        self.state_path = state_path
+        self._pending_state: Optional[Dict[str, dict]] = None
 
     @staticmethod
     def customize_metadata(document: Document, data_source_id: str) -> Document:
@@ -28,87 +39,162 @@ class TwitterEmbeddingMethod:
         })
         return document
 
-    def _compile_patterns(self, patterns: List[str]) -> List[Pattern]:
-        compiled = []
-        for pattern in patterns:
-            try:
-                compiled.append(re.compile(pattern))
-            except re.error:
-                print(f"Invalid regex pattern: {pattern}")
-        return compiled
-
     def apply_rules(
         self,
         documents: Sequence[Document],
         inclusion_rules: List[str],
         exclusion_rules: List[str],
     ) -> Sequence[Document]:
-        compiled_exclude = self._compile_patterns(exclusion_rules)
-        compiled_include = self._compile_patterns(inclusion_rules)
-
-        filtered_docs = []
+        matcher = RuleMatcher(inclusion_rules, exclusion_rules)
         print("\n[apply_rules] Başlangıç doküman sayısı:", len(documents))
+        filtered_docs = matcher.filter(documents, key=lambda doc: doc.metadata.get("text", ""))
+        matcher.log_summary()
+        return filtered_docs
 
-        for doc in documents:
-            tweet_id = doc.metadata.get("tweet_id", "")
-            tweet_text = doc.metadata.get("text", "")
-            excluded = any(pattern.search(tweet_text) for pattern in compiled_exclude)
-            included = any(pattern.search(tweet_text) for pattern in compiled_include) if compiled_include else True
-
-            if excluded:
-                print(f"[apply_rules] Dışlandı: {tweet_id}")
-                continue
-            if not included:
-                print(f"[apply_rules] Dahil edilmedi: {tweet_id}")
-                continue
-
-            print(f"[apply_rules] Geçti: {tweet_id}")
-            filtered_docs.append(doc)
+    def _tweet_to_document(self, tweet, data_source_id: str) -> Optional[Document]:
+        try:
+            content = tweet.full_text
+            if hasattr(tweet, 'retweeted_status'):
+                content = f"RT @{tweet.retweeted_status.user.screen_name}: {tweet.retweeted_status.full_text}"
+
+            doc = Document(
+                text=content,
+                metadata={
+                    "tweet_id": tweet.id_str,
+                    "created_at": tweet.created_at.isoformat(),
+                    "user": tweet.user.screen_name,
+                    "retweet_count": tweet.retweet_count,
+                    "favorite_count": tweet.favorite_count,
+                    "content_type": "retweet" if hasattr(tweet, 'retweeted_status') else "tweet"
+                }
+            )
+            self.customize_metadata(doc, data_source_id)
+            return doc
 
-        return filtered_docs
+        except Exception as e:
+            print(f"[get_documents] Error processing tweet {tweet.id_str}: {str(e)}")
+            return None
 
-    def get_documents(self, data_source_id: str) -> List[Document]:
+    @staticmethod
+    def _iter_timeline_pages(
+        api,
+        screen_name: str,
+        since_id: Optional[int] = None,
+        max_id: Optional[int] = None,
+    ) -> Iterator[list]:
+        """max_id ile geriye doğru sayfalar; API sınırına (~3200 tweet) veya since_id'ye ulaşınca biter"""
+        while True:
+            params = {"screen_name": screen_name, "count": 200, "tweet_mode": "extended"}
+            if since_id:
+                params["since_id"] = since_id
+            if max_id:
+                params["max_id"] = max_id
+            page = api.user_timeline(**params)
+            if not page:
+                return
+            yield page
+            max_id = min(tweet.id for tweet in page) - 1
+
+    def _load_sync_state(self) -> Dict[str, dict]:
+        if not self.state_path or not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"[sync_state] Durum dosyası okunamadı: {str(e)}")
+            return {}
+
+    def commit_sync_state(self) -> None:
+        """İndeksleme başarılı olduktan sonra kullanıcı başına since_id/max_id değerlerini kaydeder"""
+        if not self.state_path or self._pending_state is None:
+            return
+        state = self._load_sync_state()
+        state.update(self._pending_state)
+        state_dir = os.path.dirname(self.state_path)
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+        self._pending_state = None
+
+    def iter_documents(self, data_source_id: str) -> Iterator[Document]:
+        """
+        Tüm kullanıcıların zaman akışlarını sayfa sayfa, kullanıcılar arasında
+        sırayla (round-robin) çeker; böylece tek bir kullanıcının uzun geçmişi
+        diğerlerini bekletmez. Rate limit'e takılınca tweepy sıfırlanmayı bekler.
+        - since_id: en son alınan tweet; yalnızca daha yenileri istenir
+        - max_id: yarıda kalmış geçmiş taramasının devam noktası
+        """
         auth = tweepy.OAuth1UserHandler(
             self.consumer_key,
             self.consumer_secret,
             self.access_token,
             self.access_token_secret
         )
-        api = tweepy.API(auth)
-        documents = []
-
-        try:
-            tweets = api.user_timeline(screen_name=self.username, count=200, tweet_mode="extended")
-        except Exception as e:
-            print(f"Error accessing Twitter API: {str(e)}")
-            return documents
-
-        for tweet in tweets:
+        api = tweepy.API(auth, wait_on_rate_limit=True)
+
+        saved = self._load_sync_state()
+        progress: Dict[str, dict] = {}
+        streams = deque()
+        for screen_name in self.usernames:
+            user_state = saved.get(screen_name, {})
+            since_id = user_state.get("since_id")
+            progress[screen_name] = {
+                "since_id": since_id,
+                "max_id": user_state.get("max_id"),
+                "newest": since_id,
+                "oldest": None,
+                "failed_newer": False,
+            }
+            if since_id:
+                streams.append((screen_name, "newer", self._iter_timeline_pages(api, screen_name, since_id=since_id)))
+            if not since_id or user_state.get("max_id"):
+                streams.append((screen_name, "older", self._iter_timeline_pages(
+                    api, screen_name, max_id=user_state.get("max_id")
+                )))
+
+        count = 0
+        while streams:
+            screen_name, kind, pages = streams.popleft()
+            user_progress = progress[screen_name]
             try:
-                content = tweet.full_text
-                if hasattr(tweet, 'retweeted_status'):
-                    content = f"RT @{tweet.retweeted_status.user.screen_name}: {tweet.retweeted_status.full_text}"
-
-                doc = Document(
-                    text=content,
-                    metadata={
-                        "tweet_id": tweet.id_str,
-                        "created_at": tweet.created_at.isoformat(),
-                        "user": tweet.user.screen_name,
-                        "retweet_count": tweet.retweet_count,
-                        "favorite_count": tweet.favorite_count,
-                        "content_type": "retweet" if hasattr(tweet, 'retweeted_status') else "tweet"
-                    }
-                )
-                self.customize_metadata(doc, data_source_id)
-                documents.append(doc)
-
+                page = next(pages)
+            except StopIteration:
+                if kind == "older":
+                    user_progress["max_id"] = None  # Geçmiş taraması tamamlandı
+                continue
             except Exception as e:
-                print(f"[get_documents] Error processing tweet {tweet.id_str}: {str(e)}")
+                print(f"Error accessing Twitter API ({screen_name}): {str(e)}")
+                if kind == "newer":
+                    user_progress["failed_newer"] = True
+                elif user_progress["oldest"]:
+                    user_progress["max_id"] = user_progress["oldest"] - 1
                 continue
 
-        print(f"[get_documents] Toplam {len(documents)} tweet alındı")
-        return documents
+            for tweet in page:
+                if not user_progress["newest"] or tweet.id > user_progress["newest"]:
+                    user_progress["newest"] = tweet.id
+                if kind == "older" and (not user_progress["oldest"] or tweet.id < user_progress["oldest"]):
+                    user_progress["oldest"] = tweet.id
+                doc = self._tweet_to_document(tweet, data_source_id)
+                if doc is not None:
+                    count += 1
+                    yield doc
+            streams.append((screen_name, kind, pages))
+
+        self._pending_state = {}
+        for screen_name, user_progress in progress.items():
+            # Yeni tweet taraması yarıda kaldıysa since_id ilerletilmez (boşluk kalmasın)
+            since_id = user_progress["since_id"] if user_progress["failed_newer"] else user_progress["newest"]
+            self._pending_state[screen_name] = {"since_id": since_id, "max_id": user_progress["max_id"]}
+
+        print(f"[get_documents] Toplam {count} tweet alındı")
+
+    def get_documents(self, data_source_id: str) -> List[Document]:
+        return list(self.iter_documents(data_source_id))
 
     def get_nodes(self, documents: Sequence[Document]) -> Sequence[BaseNode]:
         return []
\ No newline at end of file
@@ -0,0 +1,18 @@
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# test-repo, bağlayıcıların okuduğu örnek depodur; içindeki testler bu paketin değildir
+collect_ignore = ["test-repo"]
+
+# Bağlayıcı betikleri kendi klasörlerinden çalıştırılır; testler modüllerini aynı adlarla içe aktarır
+for connector in (
+    "indexing/gitlab-index",
+    "indexing/llamaindex-ocr-pdf-parser",
+    "readers/jira-reader-test",
+    "readers/onedrive-reader",
+    "readers/twitter-reader-test",
+):
+    sys.path.append(os.path.join(ROOT, *connector.split("/")))
+sys.path.insert(0, ROOT)
@@ -0,0 +1,120 @@
+import uuid
+
+import pytest
+
+chromadb = pytest.importorskip("chromadb")
+pytest.importorskip("llama_index.vector_stores.chroma")
+
+from llama_index.core import Document
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.ingestion import IngestionPipeline
+from llama_index.core.node_parser import SentenceSplitter
+
+from common.batching import index_in_batches
+from common.chroma_upsert import UpsertChromaVectorStore
+
+
+@pytest.fixture
+def collection():
+    client = chromadb.EphemeralClient()
+    return client.get_or_create_collection(f"test_{uuid.uuid4().hex}")
+
+
+def make_pipeline(collection):
+    return IngestionPipeline(
+        transformations=[SentenceSplitter(chunk_size=64, chunk_overlap=0), MockEmbedding(embed_dim=8)],
+        vector_store=UpsertChromaVectorStore(chroma_collection=collection, source_key="file_path"),
+    )
+
+
+def make_documents(pages=3, words=200):
+    documents = []
+    for name in ("a.md", "b.pdf", "c.md"):
+        for page in range(1, pages + 1 if name == "b.pdf" else 2):
+            text = " ".join(f"{name}-{page}-{i}" for i in range(words))
+            metadata = {"data_source_id": "test", "file_path": name}
+            if name == "b.pdf":
+                metadata.update({"page_start": page, "page_end": page})
+            documents.append(Document(text=text, metadata=metadata))
+    return documents
+
+
+def test_rerun_keeps_collection_size(collection):
+    index_in_batches(make_documents(), make_pipeline(collection), batch_size=2)
+    first = collection.count()
+    assert first > 0
+
+    index_in_batches(make_documents(), make_pipeline(collection), batch_size=2)
+    assert collection.count() == first
+
+
+def test_segments_split_across_batches_are_kept(collection):
+    documents = make_documents()
+    index_in_batches(documents, make_pipeline(collection), batch_size=10)
+    expected = collection.count()
+
+    # b.pdf'in sayfaları farklı gruplara düşer
+    index_in_batches(documents, make_pipeline(collection), batch_size=1)
+    assert collection.count() == expected
+
+
+def test_shrunk_source_drops_stale_chunks(collection):
+    index_in_batches(make_documents(pages=3), make_pipeline(collection), batch_size=2)
+    index_in_batches(make_documents(pages=1), make_pipeline(collection), batch_size=2)
+
+    fresh = chromadb.EphemeralClient().get_or_create_collection(f"test_{uuid.uuid4().hex}")
+    index_in_batches(make_documents(pages=1), make_pipeline(fresh), batch_size=2)
+    assert collection.count() == fresh.count()
+    pages = {m.get("page_start") for m in collection.get(where={"file_path": "b.pdf"})["metadatas"]}
+    assert pages == {1}
+
+
+def test_unsegmented_documents_of_one_source_across_batches(collection):
+    # Segment alanı olmayan, aynı kaynağa ait birden fazla doküman (ör. issue + yorumlar)
+    documents = [
+        Document(text=f"comment {n} " * 50, metadata={"data_source_id": "test", "file_path": "ISSUE-1"})
+        for n in range(4)
+    ]
+    fresh = chromadb.EphemeralClient().get_or_create_collection(f"test_{uuid.uuid4().hex}")
+    index_in_batches(documents, make_pipeline(fresh), batch_size=len(documents))
+
+    index_in_batches(documents, make_pipeline(collection), batch_size=1)
+    assert collection.count() == fresh.count()
+    index_in_batches(documents, make_pipeline(collection), batch_size=1)
+    assert collection.count() == fresh.count()
+
+
+class RecordingCollection:
+    def __init__(self, collection):
+        self._collection = collection
+        self.calls = []
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in ("upsert", "delete"):
+            def record(*args, **kwargs):
+                self.calls.append(name)
+                return attr(*args, **kwargs)
+            return record
+        return attr
+
+
+def test_stale_chunks_deleted_after_upsert(collection):
+    index_in_batches(make_documents(pages=3), make_pipeline(collection), batch_size=2)
+    recording = RecordingCollection(collection)
+    index_in_batches(make_documents(pages=1), make_pipeline(recording), batch_size=2)
+    assert "delete" in recording.calls
+    assert recording.calls.index("upsert") < recording.calls.index("delete")
+
+
+def test_delete_unwritten_removes_only_missing_sources(collection):
+    index_in_batches(make_documents(), make_pipeline(collection), batch_size=2)
+
+    # Sonraki tam senkronizasyonda c.md yok, b.pdf geçici hatayla alınamadı
+    documents = [doc for doc in make_documents() if doc.metadata["file_path"] == "a.md"]
+    pipeline = make_pipeline(collection)
+    index_in_batches(documents, pipeline, batch_size=2)
+    pipeline.vector_store.delete_unwritten("test", keep={"b.pdf"})
+
+    paths = {m["file_path"] for m in collection.get()["metadatas"]}
+    assert paths == {"a.md", "b.pdf"}
@@ -0,0 +1,107 @@
+import io
+import os
+import re
+import tarfile
+
+import pytest
+
+pytest.importorskip("gitlab")
+pytest.importorskip("llama_index.core")
+
+from gitlab_embedding import GitLabEmbeddingMethod
+from common.rule_matcher import RuleMatcher
+
+TEST_REPO = os.path.join(os.path.dirname(__file__), "test-repo")
+# GitLab arşivlerindeki üst klasör: <proje>-<ref>-<sha>/
+PREFIX = "test-repo-main-0123abcd"
+SHA = "0123abcd" * 5
+EXCLUSION_RULES = [r'(^|/)tests?/', r'__pycache__', r'\.md$', r'\.png$', r'\.jpg$', r'\.jpeg$']
+
+
+def build_archive() -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        tar.add(TEST_REPO, arcname=PREFIX)
+    return buffer.getvalue()
+
+
+def expected_files(exclusion_rules):
+    expected = {}
+    for root, _, files in os.walk(TEST_REPO):
+        for name in files:
+            full_path = os.path.join(root, name)
+            path = os.path.relpath(full_path, TEST_REPO).replace(os.sep, "/")
+            if any(re.search(rule, path) for rule in exclusion_rules):
+                continue
+            with open(full_path, "rb") as f:
+                try:
+                    expected[path] = f.read().decode("utf-8")
+                except UnicodeDecodeError:
+                    continue
+    return expected
+
+
+def make_embedder(**kwargs):
+    return GitLabEmbeddingMethod(
+        repo_url="https://gitlab.com/example/test-repo",
+        private_token="token",
+        branch="main",
+        **kwargs,
+    )
+
+
+def test_read_archive_matches_test_repo():
+    embedder = make_embedder()
+    documents = list(embedder._read_archive(
+        io.BytesIO(build_archive()), "test_repo", RuleMatcher([], EXCLUSION_RULES)
+    ))
+
+    expected = expected_files(EXCLUSION_RULES)
+    assert {doc.metadata["file_path"]: doc.text for doc in documents} == expected
+    assert "main.py" in expected and "src/utils.py" in expected
+    for doc in documents:
+        assert doc.metadata["data_source_id"] == "test_repo"
+        assert doc.metadata["file_name"] == doc.metadata["file_path"].split("/")[-1]
+
+
+def test_read_archive_applies_size_limit():
+    embedder = make_embedder(max_file_size=0)
+    documents = list(embedder._read_archive(io.BytesIO(build_archive()), "test_repo", RuleMatcher()))
+    assert documents == []
+
+
+class FakeBranch:
+    commit = {"id": SHA}
+
+
+class FakeProject:
+    def __init__(self, archive):
+        self.archive = archive
+        self.archive_refs = []
+        self.branches = self
+
+    def get(self, name):
+        return FakeBranch()
+
+    def repository_archive(self, sha, format, streamed, action):
+        self.archive_refs.append(sha)
+        for start in range(0, len(self.archive), 1024):
+            action(self.archive[start:start + 1024])
+
+
+def test_iter_archive_documents_reads_head_commit(monkeypatch):
+    embedder = make_embedder(exclusion_rules=EXCLUSION_RULES)
+    project = FakeProject(build_archive())
+
+    class FakeClient:
+        class projects:
+            @staticmethod
+            def get(path):
+                return project
+
+    monkeypatch.setattr(embedder, "_create_client", lambda: FakeClient)
+    documents = list(embedder.iter_archive_documents("test_repo"))
+
+    assert project.archive_refs == [SHA]
+    assert embedder._pending_sha == SHA
+    assert {doc.metadata["file_path"] for doc in documents} == set(expected_files(EXCLUSION_RULES))
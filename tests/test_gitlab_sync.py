@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+pytest.importorskip("gitlab")
+pytest.importorskip("llama_index.core")
+
+from gitlab_embedding import GitLabEmbeddingMethod
+
+OLD_SHA = "a" * 40
+HEAD_SHA = "b" * 40
+
+
+class FakeFile:
+    def __init__(self, content):
+        self.content = content
+
+    def decode(self):
+        return self.content
+
+
+class FakeProject:
+    """repository_compare ve files.get yanıtlarını bellekten döner; failing yolları 5xx gibi hata verir"""
+
+    def __init__(self, diffs, contents, failing=()):
+        self.diffs = diffs
+        self.contents = contents
+        self.failing = set(failing)
+        self.branches = self
+        self.files = self
+        self.fetched = []
+
+    # branches.get ve files.get aynı nesnede
+    def get(self, name, ref=None):
+        if ref is None:
+            return type("Branch", (), {"commit": {"id": HEAD_SHA}})()
+        self.fetched.append((name, ref))
+        if name in self.failing:
+            raise ConnectionError("502 Bad Gateway")
+        return FakeFile(self.contents[name])
+
+    def repository_compare(self, old, new):
+        return {"diffs": self.diffs}
+
+
+DIFFS = [
+    {"old_path": "src/app.py", "new_path": "src/app.py"},
+    {"old_path": "gone.py", "new_path": "gone.py", "deleted_file": True},
+    {"old_path": "old_name.py", "new_path": "new_name.py", "renamed_file": True},
+    {"old_path": "added.py", "new_path": "added.py", "new_file": True},
+    {"old_path": "README.md", "new_path": "README.md"},
+]
+CONTENTS = {"src/app.py": b"print('app')", "new_name.py": b"x = 1", "added.py": b"y = 2"}
+
+
+@pytest.fixture
+def state_path(tmp_path):
+    path = tmp_path / "gitlab_sync_state.json"
+    path.write_text(json.dumps({"example/test-repo@main": OLD_SHA}))
+    return path
+
+
+def make_embedder(monkeypatch, state_path, project):
+    embedder = GitLabEmbeddingMethod(
+        repo_url="https://gitlab.com/example/test-repo",
+        private_token="token",
+        branch="main",
+        max_workers=2,
+        state_path=str(state_path),
+        exclusion_rules=[r"\.md$"],
+    )
+    client = type("Client", (), {"projects": type("Projects", (), {"get": staticmethod(lambda path: project)})})
+    monkeypatch.setattr(embedder, "_create_client", lambda: client)
+    return embedder
+
+
+def test_only_removed_paths_are_pre_deleted(monkeypatch, state_path):
+    project = FakeProject(DIFFS, CONTENTS)
+    embedder = make_embedder(monkeypatch, state_path, project)
+
+    documents, stale_paths = embedder.get_changed_documents("test_repo")
+
+    # Değişen dosyalar upsert ile değiştirilir; artık kurala uymayan README.md önceden silinir
+    assert sorted(stale_paths) == ["README.md", "gone.py", "old_name.py"]
+    assert sorted(doc.metadata["file_path"] for doc in documents) == ["added.py", "new_name.py", "src/app.py"]
+    assert {ref for _, ref in project.fetched} == {HEAD_SHA}
+
+    embedder.commit_sync_state()
+    assert json.loads(state_path.read_text())["example/test-repo@main"] == HEAD_SHA
+
+
+def test_failed_fetch_keeps_sha_for_retry(monkeypatch, state_path):
+    project = FakeProject(DIFFS, CONTENTS, failing={"src/app.py"})
+    embedder = make_embedder(monkeypatch, state_path, project)
+
+    documents, stale_paths = embedder.get_changed_documents("test_repo")
+
+    assert "src/app.py" not in stale_paths
+    assert "src/app.py" not in [doc.metadata["file_path"] for doc in documents]
+    assert embedder.failed_paths == {"src/app.py"}
+
+    embedder.commit_sync_state()
+    assert json.loads(state_path.read_text())["example/test-repo@main"] == OLD_SHA
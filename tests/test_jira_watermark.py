@@ -0,0 +1,115 @@
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("jira")
+pytest.importorskip("llama_index.core")
+
+from jira_embedding import JiraEmbeddingMethod
+
+WATERMARK = "2024-01-01T10:00:00.000+0000"
+
+
+class Page(list):
+    def __init__(self, issues, total):
+        super().__init__(issues)
+        self.total = total
+
+
+def make_issue(number, updated):
+    fields = SimpleNamespace(
+        summary=f"Issue {number}",
+        description="",
+        issuetype=SimpleNamespace(name="Task"),
+        status=SimpleNamespace(name="Open"),
+        created="2023-12-01T10:00:00.000+0000",
+        updated=updated,
+        assignee=None,
+        reporter=None,
+    )
+    return SimpleNamespace(key=f"PRJ-{number}", fields=fields)
+
+
+class FakeJira:
+    """search_issues sayfalarını bellekten döner; fail_at sayfasında bağlantı hatası verir"""
+
+    def __init__(self, issues, fail_at=None):
+        self.issues = issues
+        self.fail_at = fail_at
+
+    def myself(self):
+        return {"timeZone": "UTC"}
+
+    def search_issues(self, jql, startAt=0, maxResults=50, fields=None):
+        if startAt == self.fail_at:
+            raise ConnectionError("connection reset")
+        return Page(self.issues[startAt:startAt + maxResults], len(self.issues))
+
+
+@pytest.fixture
+def issues():
+    return [make_issue(n, f"2024-01-0{1 + n % 3}T12:00:00.000+0000") for n in range(1, 7)]
+
+
+def make_embedder(tmp_path, jira):
+    embedder = JiraEmbeddingMethod(
+        jira_url="https://jira.example",
+        email="user@example.com",
+        api_token="token",
+        project_key="PRJ",
+        page_size=2,
+        max_workers=2,
+        state_path=str(tmp_path / "jira_state.json"),
+    )
+    embedder._connect = lambda: jira
+    return embedder
+
+
+def write_state(tmp_path):
+    path = tmp_path / "jira_state.json"
+    path.write_text(json.dumps({"PRJ": {
+        "updated_watermark": WATERMARK,
+        "issue_keys": ["PRJ-1", "PRJ-2"],
+        "last_reconcile": time.time(),
+    }}))
+    return path
+
+
+def test_incremental_fetch_advances_watermark(tmp_path, issues):
+    path = write_state(tmp_path)
+    embedder = make_embedder(tmp_path, FakeJira(issues))
+
+    documents, stale_keys = embedder.get_changed_documents("jira_project")
+    assert len(documents) == 6
+    assert sorted(stale_keys) == sorted(issue.key for issue in issues)
+
+    embedder.commit_sync_state()
+    state = json.loads(path.read_text())["PRJ"]
+    assert state["updated_watermark"] == "2024-01-03T12:00:00.000+0000"
+
+
+def test_failed_fetch_keeps_watermark(tmp_path, issues):
+    path = write_state(tmp_path)
+    before = path.read_text()
+    embedder = make_embedder(tmp_path, FakeJira(issues, fail_at=4))
+
+    with pytest.raises(ConnectionError):
+        embedder.get_changed_documents("jira_project")
+    assert embedder._pending_state is None
+
+    embedder.commit_sync_state()
+    assert path.read_text() == before
+
+
+def test_failed_first_run_saves_nothing(tmp_path, issues):
+    embedder = make_embedder(tmp_path, FakeJira(issues, fail_at=2))
+
+    # Tam yüklemede hata, çağıranın tüm vektörleri silmesinden önce yükselir
+    with pytest.raises(ConnectionError):
+        embedder.get_changed_documents("jira_project")
+
+    embedder.commit_sync_state()
+    assert not (tmp_path / "jira_state.json").exists()
+
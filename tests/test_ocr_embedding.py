@@ -0,0 +1,164 @@
+import os
+import uuid
+
+import pytest
+
+chromadb = pytest.importorskip("chromadb")
+pytest.importorskip("llama_parse")
+pytest.importorskip("llama_index.vector_stores.chroma")
+
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.ingestion import IngestionPipeline
+from llama_index.core.node_parser import SentenceSplitter
+
+from common.batching import index_in_batches
+from common.chroma_upsert import UpsertChromaVectorStore
+from ocr_embedding import DocumentEmbeddingMethod, ParseCache
+
+
+class FakeParser:
+    """LlamaParse yerine geçer; çağrıları sayar"""
+
+    def __init__(self, text="parsed"):
+        self.text = text
+        self.calls = 0
+
+    def load_data(self, file_path):
+        self.calls += 1
+        return [type("ParsedDocument", (), {"text": self.text})()]
+
+
+def make_embedder(docs_path, failing_ranges=(), page_count=6, **kwargs):
+    embedder = DocumentEmbeddingMethod(
+        docs_path=str(docs_path), parser=FakeParser(), parse_workers=1, extract_workers=1, **kwargs
+    )
+    embedder._pdf_page_count = lambda file_path: page_count
+
+    async def process_pages(file_path, start, end):
+        if (start, end) in failing_ranges:
+            raise RuntimeError("OCR zaman aşımı")
+        text = " ".join(f"page-{start}-{i}" for i in range(150))
+        return text, {"page_start": start + 1, "page_end": end + 1}
+
+    embedder._aprocess_pdf_pages = process_pages
+    return embedder
+
+
+def run_index(docs_path, collection, failing_ranges=(), page_count=6):
+    vector_store = UpsertChromaVectorStore(chroma_collection=collection, source_key="file_path")
+    pipeline = IngestionPipeline(
+        transformations=[SentenceSplitter(chunk_size=256, chunk_overlap=0), MockEmbedding(embed_dim=8)],
+        vector_store=vector_store,
+    )
+    embedder = make_embedder(
+        docs_path, failing_ranges, page_count, pages_per_document=2, on_incomplete=vector_store.keep_stale
+    )
+    index_in_batches(embedder.iter_documents("ocr_test"), pipeline, batch_size=1)
+    return embedder
+
+
+def test_failed_page_range_keeps_existing_chunks(tmp_path):
+    (tmp_path / "a.pdf").write_bytes(b"%PDF-1.4")
+    (tmp_path / "b.txt").write_text("plain text " * 40)
+    collection = chromadb.EphemeralClient().get_or_create_collection(f"test_{uuid.uuid4().hex}")
+
+    run_index(tmp_path, collection)
+    expected = collection.count()
+
+    embedder = run_index(tmp_path, collection, failing_ranges={(2, 3)})
+    assert embedder.failed_paths == {str(tmp_path / "a.pdf")}
+    pages = {m.get("page_start") for m in collection.get(where={"file_path": str(tmp_path / "a.pdf")})["metadatas"]}
+    assert pages == {1, 3, 5}
+    assert collection.count() == expected
+
+
+def test_complete_run_still_drops_stale_chunks(tmp_path):
+    (tmp_path / "a.pdf").write_bytes(b"%PDF-1.4")
+    collection = chromadb.EphemeralClient().get_or_create_collection(f"test_{uuid.uuid4().hex}")
+    run_index(tmp_path, collection, failing_ranges={(2, 3)})
+
+    # Önceki çalıştırmadaki hata işareti taşınmaz; kısalan dosyanın eski sayfaları silinir
+    embedder = run_index(tmp_path, collection, page_count=2)
+    assert embedder.failed_paths == set()
+    pages = {m.get("page_start") for m in collection.get(where={"file_path": str(tmp_path / "a.pdf")})["metadatas"]}
+    assert pages == {1}
+
+
+def make_cached_embedder(tmp_path, text="parsed", **kwargs):
+    embedder = DocumentEmbeddingMethod(
+        docs_path=str(tmp_path), cache_dir=str(tmp_path / "cache"), parser=FakeParser(text), **kwargs
+    )
+    source = tmp_path / "scan.pdf"
+    source.write_bytes(b"%PDF-1.4 scanned")
+    return embedder, str(source)
+
+
+def test_cache_hit_skips_parser(tmp_path):
+    embedder, source = make_cached_embedder(tmp_path)
+    assert embedder._process_with_llamaparse(source) == "parsed"
+    assert embedder._process_with_llamaparse(source) == "parsed"
+    assert embedder.parser.calls == 1
+
+    # İçerik değişince anahtar da değişir
+    with open(source, "ab") as f:
+        f.write(b" edited")
+    embedder._process_with_llamaparse(source)
+    assert embedder.parser.calls == 2
+
+
+def test_parser_settings_change_cache_key(tmp_path):
+    embedder, source = make_cached_embedder(tmp_path)
+    embedder._process_with_llamaparse(source)
+
+    embedder.parser_settings = {**embedder.parser_settings, "parser_version": "next"}
+    embedder._process_with_llamaparse(source)
+    assert embedder.parser.calls == 2
+    assert embedder.parse_cache.stats()["entries"] == 2
+
+
+def test_empty_result_is_not_cached(tmp_path):
+    embedder, source = make_cached_embedder(tmp_path, text="  \n")
+    embedder._process_with_llamaparse(source)
+    embedder._process_with_llamaparse(source)
+    assert embedder.parser.calls == 2
+    assert embedder.parse_cache.stats()["writes"] == 0
+    assert embedder.parse_cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = ParseCache(str(tmp_path / "cache"), max_bytes=10 ** 9)
+    # Sıkıştırılamayan içerik; her girdi yaklaşık aynı boyuttadır
+    for key in ("aa01", "bb02", "cc03"):
+        cache.put(key, os.urandom(2048).hex())
+    entry_size = max(os.path.getsize(cache._path(key)) for key in ("aa01", "bb02", "cc03"))
+    for age, key in enumerate(("aa01", "bb02", "cc03")):
+        os.utime(cache._path(key), (1000 + age, 1000 + age))
+
+    # En eski girdi okununca en yeni olur; sıradaki en eski (bb02) tahliye edilir
+    assert cache.get("aa01") is not None
+    cache.max_bytes = 3 * entry_size
+    cache.put("dd04", os.urandom(2048).hex())
+
+    assert cache.get("bb02") is None
+    assert cache.get("aa01") is not None
+    assert cache.get("dd04") is not None
+    assert cache.evictions == 1
+    assert cache.stats()["bytes"] <= cache.max_bytes
+
+
+def test_stats_counters(tmp_path):
+    embedder, source = make_cached_embedder(tmp_path)
+    embedder._process_with_llamaparse(source)
+    embedder._process_with_llamaparse(source)
+    embedder._process_with_llamaparse(source)
+
+    stats = embedder.parse_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["writes"], stats["evictions"]) == (2, 1, 1, 0)
+    assert stats["entries"] == 1
+    assert stats["bytes"] == sum(
+        os.path.getsize(path) for path in embedder.parse_cache._entries()
+    )
+
+    # Yeniden açılan önbellek diskteki boyutu devralır
+    reopened = ParseCache(embedder.parse_cache.cache_dir)
+    assert reopened.stats()["bytes"] == stats["bytes"]
@@ -0,0 +1,158 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("msal")
+pytest.importorskip("llama_index.core")
+
+import onedrive_embedding
+from onedrive_embedding import OneDriveEmbeddingMethod
+
+GRAPH = "https://graph.example/v1.0"
+
+# Graph /me/drive/root/delta yanıtları (kısaltılmış); ilk tam listeleme iki sayfadır
+RESPONSES = {
+    f"{GRAPH}/me/drive/root/delta": {
+        "value": [
+            {"id": "root", "name": "root", "root": {}, "folder": {"childCount": 3}},
+            {"id": "F1", "name": "docs", "folder": {"childCount": 1}, "parentReference": {"id": "root"}},
+            {
+                "id": "A", "name": "a.txt", "file": {}, "size": 5, "parentReference": {"id": "F1"},
+                "lastModifiedDateTime": "2024-01-01T00:00:00Z", "@microsoft.graph.downloadUrl": "https://dl/A",
+            },
+        ],
+        "@odata.nextLink": f"{GRAPH}/me/drive/root/delta?token=page2",
+    },
+    f"{GRAPH}/me/drive/root/delta?token=page2": {
+        "value": [
+            {"id": "B", "name": "b.md", "file": {}, "size": 5, "parentReference": {"id": "root"}},
+            {"id": "F2", "name": "old", "folder": {"childCount": 1}, "parentReference": {"id": "root"}},
+            {"id": "C", "name": "c.txt", "file": {}, "size": 5, "parentReference": {"id": "F2"}},
+        ],
+        "@odata.deltaLink": f"{GRAPH}/me/drive/root/delta?token=delta1",
+    },
+    # Sonraki çalıştırma: klasör silindi (alt öğeleri için tombstone gelmez), dosya silindi,
+    # klasör yeniden adlandırıldı ve içine yeni dosya eklendi
+    f"{GRAPH}/me/drive/root/delta?token=delta1": {
+        "value": [
+            {"id": "F2", "deleted": {"state": "deleted"}, "parentReference": {"id": "root"}},
+            {"id": "B", "deleted": {"state": "deleted"}, "parentReference": {"id": "root"}},
+            {"id": "F1", "name": "notes", "folder": {"childCount": 2}, "parentReference": {"id": "root"}},
+            {"id": "D", "name": "d.txt", "file": {}, "size": 5, "parentReference": {"id": "F1"}},
+        ],
+        "@odata.deltaLink": f"{GRAPH}/me/drive/root/delta?token=delta2",
+    },
+}
+
+CONTENTS = {"A": b"alpha", "B": b"bravo", "C": b"charl", "D": b"delta"}
+
+
+@pytest.fixture
+def embedder(monkeypatch, tmp_path):
+    monkeypatch.setattr(onedrive_embedding, "ConfidentialClientApplication", lambda **kwargs: None)
+    monkeypatch.setattr(OneDriveEmbeddingMethod, "_get_access_token", lambda self: "token")
+    embedder = OneDriveEmbeddingMethod(
+        client_id="id",
+        client_secret="secret",
+        redirect_uri="http://localhost",
+        refresh_token="refresh",
+        tenant_id="tenant",
+        state_path=str(tmp_path / "state" / "onedrive.json"),
+        graph_base_url=GRAPH,
+        max_workers=2,
+    )
+    requested = []
+
+    def graph_request(url):
+        requested.append(url)
+        return json.loads(json.dumps(RESPONSES[url]))
+
+    monkeypatch.setattr(embedder, "_make_graph_api_request", graph_request)
+    monkeypatch.setattr(embedder, "_download_item", lambda item_id, download_url: CONTENTS[item_id])
+    embedder.requested = requested
+    return embedder
+
+
+def by_path(documents):
+    return {doc.metadata["file_path"]: doc for doc in documents}
+
+
+def test_full_listing_follows_next_link(embedder):
+    documents, stale_ids = embedder.get_changed_documents("onedrive")
+    assert stale_ids is None
+    documents = by_path(documents)
+
+    assert set(documents) == {"docs/a.txt", "b.md", "old/c.txt"}
+    assert documents["docs/a.txt"].text == "alpha"
+    assert documents["docs/a.txt"].metadata["item_id"] == "A"
+    assert len(embedder.requested) == 2
+
+
+def test_delta_replay_applies_tombstones_and_moves(embedder):
+    list(embedder.iter_documents("onedrive"))
+    embedder.commit_sync_state()
+
+    documents, stale_ids = embedder.get_changed_documents("onedrive")
+    documents = by_path(documents)
+
+    # C, silinen klasörün altındadır; A'nın yolu klasör adı değişince değişir
+    assert set(stale_ids) == {"A", "B", "C"}
+    assert set(documents) == {"notes/a.txt", "notes/d.txt"}
+    assert documents["notes/d.txt"].text == "delta"
+
+    embedder.commit_sync_state()
+    with open(embedder.state_path, encoding="utf-8") as f:
+        state = json.load(f)
+    assert state["delta_link"].endswith("token=delta2")
+    assert set(state["items"]) == {"root", "F1", "A", "D"}
+
+
+def test_uncommitted_listing_is_not_saved(embedder):
+    list(embedder.iter_documents("onedrive"))
+    assert not os.path.exists(embedder.state_path)
+
+    # Kaydedilmemiş deltaLink kullanılmaz; yeniden tam listeleme yapılır
+    documents, stale_ids = embedder.get_changed_documents("onedrive")
+    assert stale_ids is None
+    assert set(by_path(documents)) == {"docs/a.txt", "b.md", "old/c.txt"}
+
+
+IN_PLACE_EDIT = {
+    "value": [
+        {
+            "id": "A", "name": "a.txt", "file": {}, "size": 6, "parentReference": {"id": "F1"},
+            "@microsoft.graph.downloadUrl": "https://dl/A2",
+        },
+    ],
+    "@odata.deltaLink": f"{GRAPH}/me/drive/root/delta?token=delta2",
+}
+
+
+def test_in_place_edit_is_not_pre_deleted(embedder, monkeypatch):
+    list(embedder.iter_documents("onedrive"))
+    embedder.commit_sync_state()
+    monkeypatch.setitem(RESPONSES, f"{GRAPH}/me/drive/root/delta?token=delta1", IN_PLACE_EDIT)
+
+    # Yerinde değişen dosyanın parçalarını upsert deposu değiştirir
+    documents, stale_ids = embedder.get_changed_documents("onedrive")
+    assert stale_ids == []
+    assert set(by_path(documents)) == {"docs/a.txt"}
+
+
+def test_failed_download_keeps_delta_link(embedder, monkeypatch):
+    list(embedder.iter_documents("onedrive"))
+    embedder.commit_sync_state()
+    monkeypatch.setitem(RESPONSES, f"{GRAPH}/me/drive/root/delta?token=delta1", IN_PLACE_EDIT)
+
+    def fail(item_id, download_url):
+        raise ConnectionError("503 Service Unavailable")
+
+    monkeypatch.setattr(embedder, "_download_item", fail)
+    documents, stale_ids = embedder.get_changed_documents("onedrive")
+    assert documents == [] and stale_ids == []
+    assert embedder.failed_items == {"A": "docs/a.txt"}
+
+    embedder.commit_sync_state()
+    with open(embedder.state_path, encoding="utf-8") as f:
+        assert json.load(f)["delta_link"].endswith("token=delta1")
@@ -0,0 +1,61 @@
+import re
+
+import pytest
+
+from common.rule_matcher import RuleMatcher
+
+
+RULES = [
+    r"\.md$",
+    r"x$",
+    r"^src/",
+    r"tmp",
+    r"\.jpg$|\.png$",
+    r"b\$",
+    r"^docs/.*\.txt$",
+]
+
+PATHS = [
+    "README.md",
+    "README.md\n",
+    "README.md\n\n",
+    "xend\n",
+    "box",
+    "box\n",
+    "src/main.py",
+    "lib/src/main.py",
+    "temp/tmpfile",
+    "images/logo.png",
+    "images/logo.png.bak",
+    "price b$",
+    "docs/CHANGELOG.txt",
+    "",
+    "\n",
+]
+
+
+def expected(path, inclusion, exclusion):
+    if any(re.search(rule, path) for rule in exclusion):
+        return False
+    if inclusion and not any(re.search(rule, path) for rule in inclusion):
+        return False
+    return True
+
+
+@pytest.mark.parametrize("path", PATHS)
+@pytest.mark.parametrize("rule", RULES)
+def test_single_rule_agrees_with_re_search(rule, path):
+    assert RuleMatcher([rule], []).allowed(path) is expected(path, [rule], [])
+    assert RuleMatcher([], [rule]).allowed(path) is expected(path, [], [rule])
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_rule_lists_agree_with_re_search(path):
+    inclusion = [r"\.md$", r"^src/", r"\.jpg$|\.png$"]
+    exclusion = [r"tmp", r"x$", r"\.bak$"]
+    assert RuleMatcher(inclusion, exclusion).allowed(path) is expected(path, inclusion, exclusion)
+
+
+def test_dollar_matches_before_trailing_newline():
+    assert RuleMatcher([r"\.md$"], []).allowed("README.md\n")
+    assert not RuleMatcher([r"\.md$"], []).allowed("README.md\n\n")
@@ -0,0 +1,116 @@
+import json
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("tweepy")
+pytest.importorskip("llama_index.core")
+
+import twitter_embedding
+from twitter_embedding import TwitterEmbeddingMethod
+
+
+def make_tweet(tweet_id, screen_name):
+    return SimpleNamespace(
+        id=tweet_id,
+        id_str=str(tweet_id),
+        full_text=f"tweet {tweet_id}",
+        created_at=datetime(2024, 1, 1, tzinfo=timezone.utc),
+        user=SimpleNamespace(screen_name=screen_name),
+        retweet_count=0,
+        favorite_count=0,
+    )
+
+
+class FakeAPI:
+    """tweepy.API.user_timeline yerine geçer: since_id < id <= max_id, yeniden eskiye, page_size'lık sayfalar"""
+
+    def __init__(self, timelines, page_size=2, fail_on_call=None):
+        self.timelines = timelines
+        self.page_size = page_size
+        self.fail_on_call = fail_on_call
+        self.calls = []
+
+    def user_timeline(self, screen_name, count, tweet_mode, since_id=None, max_id=None):
+        self.calls.append({"screen_name": screen_name, "since_id": since_id, "max_id": max_id})
+        if self.fail_on_call == len(self.calls):
+            raise RuntimeError("rate limit")
+        ids = sorted(self.timelines[screen_name], reverse=True)
+        ids = [i for i in ids if (not since_id or i > since_id) and (not max_id or i <= max_id)]
+        return [make_tweet(i, screen_name) for i in ids[:min(count, self.page_size)]]
+
+
+@pytest.fixture
+def api(monkeypatch):
+    fake = FakeAPI({"alice": list(range(101, 106))})
+    monkeypatch.setattr(twitter_embedding.tweepy, "OAuth1UserHandler", lambda *args: None)
+    monkeypatch.setattr(twitter_embedding.tweepy, "API", lambda auth, **kwargs: fake)
+    return fake
+
+
+def make_embedder(tmp_path):
+    return TwitterEmbeddingMethod("ck", "cs", "at", "ats", usernames=["alice"], state_path=str(tmp_path / "state.json"))
+
+
+def read_state(tmp_path):
+    with open(tmp_path / "state.json", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_history_walks_back_with_max_id(api, tmp_path):
+    embedder = make_embedder(tmp_path)
+    ids = [int(doc.metadata["tweet_id"]) for doc in embedder.iter_documents("twitter")]
+
+    assert ids == [105, 104, 103, 102, 101]
+    # Her sayfa bir öncekinin en eski tweetinin altından istenir; boş sayfada durulur
+    assert [call["max_id"] for call in api.calls] == [None, 103, 101, 100]
+    assert all(call["since_id"] is None for call in api.calls)
+
+
+def test_new_tweets_stop_at_since_id(api, tmp_path):
+    embedder = make_embedder(tmp_path)
+    list(embedder.iter_documents("twitter"))
+    embedder.commit_sync_state()
+    assert read_state(tmp_path) == {"alice": {"since_id": 105, "max_id": None}}
+
+    api.timelines["alice"].extend([106, 107, 108])
+    api.calls.clear()
+    embedder = make_embedder(tmp_path)
+    ids = [int(doc.metadata["tweet_id"]) for doc in embedder.iter_documents("twitter")]
+
+    # Yalnızca since_id'den yeniler istenir; eski tweetler yeniden çekilmez
+    assert ids == [108, 107, 106]
+    assert all(call["since_id"] == 105 for call in api.calls)
+    assert [call["max_id"] for call in api.calls] == [None, 106, 105]
+    embedder.commit_sync_state()
+    assert read_state(tmp_path) == {"alice": {"since_id": 108, "max_id": None}}
+
+
+def test_state_is_saved_only_after_commit(api, tmp_path):
+    embedder = make_embedder(tmp_path)
+    documents = embedder.iter_documents("twitter")
+    next(documents)
+
+    # İndeksleme yarıda kaldı: akış tükenmeden commit edilen durum yoktur
+    embedder.commit_sync_state()
+    assert not (tmp_path / "state.json").exists()
+
+    list(documents)
+    assert not (tmp_path / "state.json").exists()
+    embedder.commit_sync_state()
+    assert read_state(tmp_path)["alice"]["since_id"] == 105
+
+
+def test_failed_history_page_resumes_from_oldest(monkeypatch, tmp_path):
+    fake = FakeAPI({"alice": list(range(101, 106))}, fail_on_call=2)
+    monkeypatch.setattr(twitter_embedding.tweepy, "OAuth1UserHandler", lambda *args: None)
+    monkeypatch.setattr(twitter_embedding.tweepy, "API", lambda auth, **kwargs: fake)
+
+    embedder = make_embedder(tmp_path)
+    ids = [int(doc.metadata["tweet_id"]) for doc in embedder.iter_documents("twitter")]
+    embedder.commit_sync_state()
+
+    assert ids == [105, 104]
+    # Sonraki çalıştırma geçmiş taramasına en eski alınan tweetin altından devam eder
+    assert read_state(tmp_path) == {"alice": {"since_id": 105, "max_id": 103}}